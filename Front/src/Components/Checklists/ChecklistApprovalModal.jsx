@@ -182,7 +182,7 @@ const ChecklistApprovalModal = ({ completion, onClose, onComplete }) => {
                                         className="block"
                                     >
                                         <img
-                                            src={`${import.meta.env.VITE_API_URL}/uploads/${photo}`}
+                                            src={`${import.meta.env.VITE_API_URL}/uploads/${photo}?variant=thumb`}
                                             alt={`Фото ${index + 1}`}
                                             className="w-full h-32 object-cover rounded-lg hover:opacity-90 transition-opacity"
                                         />
@@ -6,15 +6,19 @@ const ChecklistHistory = ({ projectId, checklistType, onClose }) => {
     const [completions, setCompletions] = useState([]);
     const [loading, setLoading] = useState(true);
     const [selectedCompletion, setSelectedCompletion] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
 
     useEffect(() => {
         loadCompletions();
     }, [projectId, checklistType]);
 
-    const loadCompletions = async () => {
+    const loadCompletions = async (cursor = null) => {
         try {
-            const data = await ApiService.getChecklistCompletions(projectId, checklistType);
-            setCompletions(data);
+            const data = await ApiService.getChecklistCompletions(projectId, checklistType, {}, cursor ? { cursor } : {});
+            // Шаблон чек-листа приходит один раз на страницу - подставляем его в каждое заполнение
+            const page = data.completions.map(completion => ({ ...completion, checklist: data.checklist }));
+            setCompletions(prev => (cursor ? [...prev, ...page] : page));
+            setNextCursor(data.next_cursor);
         } catch (error) {
             toast.error('Не удалось загрузить историю заполнений');
             console.error(error);
@@ -239,7 +243,7 @@ const ChecklistHistory = ({ projectId, checklistType, onClose }) => {
                                             className="block"
                                         >
                                             <img
-                                                src={`${import.meta.env.VITE_API_URL}/uploads/${photo}`}
+                                                src={`${import.meta.env.VITE_API_URL}/uploads/${photo}?variant=thumb`}
                                                 alt={`Фото ${index + 1}`}
                                                 className="w-full h-40 object-cover rounded-lg hover:opacity-90 transition-opacity"
                                             />
@@ -380,6 +384,14 @@ const ChecklistHistory = ({ projectId, checklistType, onClose }) => {
                                     </div>
                                 );
                             })}
+                            {nextCursor && (
+                                <button
+                                    onClick={() => loadCompletions(nextCursor)}
+                                    className="w-full py-2 text-sm font-medium text-blue-600 hover:bg-blue-50 rounded-lg transition-colors"
+                                >
+                                    Показать ещё
+                                </button>
+                            )}
                         </div>
                     )}
                 </div>
@@ -115,7 +115,7 @@ function ManagerDHB() {
         const fetchData = async () => {
             setLoading(true);
             try {
-                const fetchedProjects = await ApiService.getProjects(); 
+                const fetchedProjects = await ApiService.getProjects({}, { include_geometry: true }); 
                 setProjects(fetchedProjects);
 
                 const total = fetchedProjects.length;
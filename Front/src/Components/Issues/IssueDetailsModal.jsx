@@ -203,13 +203,20 @@ const IssueDetailsModal = ({ issueId, onClose }) => {
                             </h4>
                             <div className="grid grid-cols-2 gap-3 sm:grid-cols-3">
                                 {issue.resolution_photos.map((photo, index) => (
-                                    <div key={index} className="overflow-hidden rounded-xl border border-slate-200">
+                                    <a
+                                        key={index}
+                                        href={`${import.meta.env.VITE_API_URL}/uploads/${photo}`}
+                                        target="_blank"
+                                        rel="noopener noreferrer"
+                                        className="block overflow-hidden rounded-xl border border-slate-200"
+                                    >
                                         <img 
-                                            src={photo} 
+                                            src={`${import.meta.env.VITE_API_URL}/uploads/${photo}?variant=thumb`} 
                                             alt={`Фото ${index + 1}`}
+                                            loading="lazy"
                                             className="h-32 w-full object-cover transition-transform hover:scale-105"
                                         />
-                                    </div>
+                                    </a>
                                 ))}
                             </div>
                         </div>
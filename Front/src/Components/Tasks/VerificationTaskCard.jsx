@@ -79,10 +79,10 @@ const VerificationTaskCard = ({ task, onUpdate }) => {
                                 {photos.map((photo, index) => (
                                     <img 
                                         key={index}
-                                        src={`${API_BASE_URL}${photo}`}
+                                        src={`${API_BASE_URL}${photo}?variant=thumb`}
                                         alt={`Фото ${index + 1}`}
                                         className="w-full h-24 object-cover rounded-lg cursor-pointer hover:opacity-80 transition"
-                                        onClick={() => setSelectedPhoto(`${API_BASE_URL}${photo}`)}
+                                        onClick={() => setSelectedPhoto(`${API_BASE_URL}${photo}?variant=preview`)}
                                     />
                                 ))}
                             </div>
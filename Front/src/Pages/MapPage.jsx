@@ -11,7 +11,7 @@ const MapPage = () => {
     const fetchProjects = useCallback(async (signal) => {
         setLoading(true);
         try {
-            const data = await ApiService.getProjects({ signal });
+            const data = await ApiService.getProjects({ signal }, { include_geometry: true });
             console.log('Проекты, полученные от API:', data);
             setProjects(data);
         } catch (err) {
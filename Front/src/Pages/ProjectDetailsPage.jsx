@@ -72,7 +72,7 @@ function ProjectDetailsPage() {
                     ApiService.getChecklistCompletions(projectId, 'opening', { signal }).catch(() => []),
                     ApiService.getChecklistCompletions(projectId, 'daily', { signal }).catch(() => [])
                 ]);
-                const allCompletions = [...(Array.isArray(openingCompletions) ? openingCompletions : []), ...(Array.isArray(dailyCompletions) ? dailyCompletions : [])];
+                const allCompletions = [...(openingCompletions?.completions || []), ...(dailyCompletions?.completions || [])];
                 setChecklistCompletions(allCompletions);
             } catch (err) {
                 console.error('Ошибка загрузки чек-листов:', err);
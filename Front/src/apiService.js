@@ -43,8 +43,9 @@ class ApiService {
         return API_BASE_URL.replace('/api', '');
     }
 
-    getProjects(options = {}) {
-        return request('/projects', options);
+    getProjects(options = {}, params = {}) {
+        const query = new URLSearchParams(params).toString();
+        return request(query ? `/projects?${query}` : '/projects', options);
     }
 
     getProjectDetails(projectId, options = {}) {
@@ -352,8 +353,10 @@ class ApiService {
         });
     }
 
-    getChecklistCompletions(projectId, checklistType, options = {}) {
-        return request(`/projects/${projectId}/checklists/${checklistType}/completions`, options);
+    getChecklistCompletions(projectId, checklistType, options = {}, params = {}) {
+        const query = new URLSearchParams(params).toString();
+        const endpoint = `/projects/${projectId}/checklists/${checklistType}/completions`;
+        return request(query ? `${endpoint}?${query}` : endpoint, options);
     }
 
     getChecklistCompletionDetails(completionId) {
@@ -1,10 +1,12 @@
 from flask import Blueprint, request, jsonify
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, union, select, and_
 
 from models import (db, WorkPlan, WorkPlanItem, RequiredMaterial, Material, 
                    MaterialDelivery, MaterialDeliveryItem, ConsumptionLog, Project)
 from auth import token_required
-from project_access import require_project_access
+from project_access import require_project_access, accessible_project_ids
+from work_calendar import get_project_calendar, get_builtin_calendar
 
 analytics_material_bp = Blueprint('analytics_material_bp', __name__)
 
@@ -70,98 +72,170 @@ def get_material_plan_fact_report(project_id):
     if access_error:
         return access_error
     
-    from sqlalchemy import func
-    from collections import defaultdict
-    
-    work_plan = WorkPlan.query.filter_by(project_id=project_id).first()
-    if not work_plan:
+    has_work_plan = db.session.query(WorkPlan.id).filter_by(project_id=project_id).first()
+    if not has_work_plan:
         return jsonify({'message': 'План работ для этого проекта не найден'}), 404
     
-    planned_dict = defaultdict(float)
-    work_item_ids = [item.id for item in work_plan.items]
-    
-    if work_item_ids:
-        planned = db.session.query(
-            RequiredMaterial.material_id,
-            func.sum(RequiredMaterial.planned_quantity).label('total_planned')
-        ).filter(
-            RequiredMaterial.work_item_id.in_(work_item_ids)
-        ).group_by(RequiredMaterial.material_id).all()
-        
-        for item in planned:
-            planned_dict[item.material_id] = float(item.total_planned)
-    
-    delivered_dict = defaultdict(float)
-    delivered = db.session.query(
-        MaterialDeliveryItem.material_id,
-        func.sum(MaterialDeliveryItem.quantity).label('total_delivered')
-    ).join(MaterialDelivery).filter(
-        MaterialDelivery.project_id == project_id
-    ).group_by(MaterialDeliveryItem.material_id).all()
+    rows = build_material_plan_fact_query(project_ids=[project_id]).all()
     
-    for item in delivered:
-        delivered_dict[item.material_id] = float(item.total_delivered)
+    return jsonify({
+        'project_id': project_id,
+        'materials': [serialize_plan_fact_row(row) for row in rows]
+    }), 200
+
+
+@analytics_material_bp.route('/api/analytics/material-plan-fact', methods=['GET'])
+@token_required
+def get_portfolio_material_plan_fact_report():
+    """
+    Сводный отчет План/Факт по материалам по нескольким или всем проектам.
+    Принимает необязательный параметр `project_ids` (через запятую) и флаг `by_project`
+    для разбивки по проектам. Без `project_ids` берутся все доступные пользователю проекты.
+    """
+    current_user = request.current_user
     
-    consumed_dict = defaultdict(float)
-    if work_item_ids:
-        consumed = db.session.query(
-            ConsumptionLog.material_id,
-            func.sum(ConsumptionLog.quantity_used).label('total_consumed')
-        ).filter(
-            ConsumptionLog.work_item_id.in_(work_item_ids)
-        ).group_by(ConsumptionLog.material_id).all()
-        
-        for item in consumed:
-            consumed_dict[item.material_id] = float(item.total_consumed)
-    
-    all_material_ids = set(planned_dict.keys()) | set(delivered_dict.keys()) | set(consumed_dict.keys())
-    
-    if not all_material_ids:
-        return jsonify({
-            'project_id': project_id,
-            'materials': []
-        }), 200
-    
-    materials = Material.query.filter(Material.id.in_(all_material_ids)).all()
-    
-    report = []
-    for material in materials:
-        total_planned = planned_dict.get(material.id, 0.0)
-        total_delivered = delivered_dict.get(material.id, 0.0)
-        total_consumed = consumed_dict.get(material.id, 0.0)
-        remaining = total_delivered - total_consumed
-        forecast_variance = total_delivered - total_planned
-        
-        status = 'ok'
-        if total_planned > 0:
-            if total_delivered < total_planned * 0.8:
-                status = 'shortage_risk'
-            elif remaining < total_planned * 0.2 and total_consumed > 0:
-                status = 'running_low'
+    project_ids = None
+    project_ids_param = request.args.get('project_ids')
+    if project_ids_param:
+        try:
+            project_ids = [int(pid) for pid in project_ids_param.split(',') if pid.strip()]
+        except ValueError:
+            return jsonify({'message': 'project_ids должен быть списком чисел через запятую'}), 400
         
-        if total_consumed > total_planned and total_planned > 0:
-            status = 'overrun'
-        
-        report.append({
-            'material_id': material.id,
-            'material_name': material.name,
-            'unit': material.unit,
-            'planned': total_planned,
-            'delivered': total_delivered,
-            'consumed': total_consumed,
-            'remaining': remaining,
-            'forecast_variance': forecast_variance,
-            'status': status
-        })
+        for pid in project_ids:
+            access_error = require_project_access(pid, current_user['id'], current_user['role'])
+            if access_error:
+                return access_error
+    else:
+        project_ids = accessible_project_ids(current_user['id'], current_user['role'])
     
-    report.sort(key=lambda x: x['material_name'])
+    by_project = request.args.get('by_project', 'false').lower() in ('1', 'true', 'yes')
+    rows = build_material_plan_fact_query(project_ids=project_ids, by_project=by_project).all()
     
     return jsonify({
-        'project_id': project_id,
-        'materials': report
+        'project_ids': project_ids,
+        'by_project': by_project,
+        'materials': [serialize_plan_fact_row(row, by_project=by_project) for row in rows]
     }), 200
 
 
+def build_material_plan_fact_query(project_ids=None, by_project=True):
+    """
+    Строит единый CTE-запрос План/Факт по материалам.
+    План и расход связываются с проектом через WorkPlanItem.work_plan_id -> WorkPlan.project_id,
+    поставки - напрямую через MaterialDelivery.project_id. ORM-объекты работ не загружаются.
+    При by_project=False суммы сворачиваются по материалу для всего портфеля.
+    """
+    planned = db.session.query(
+        WorkPlan.project_id.label('project_id'),
+        RequiredMaterial.material_id.label('material_id'),
+        func.sum(RequiredMaterial.planned_quantity).label('total')
+    ).join(WorkPlanItem, RequiredMaterial.work_item_id == WorkPlanItem.id) \
+     .join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id)
+    
+    delivered = db.session.query(
+        MaterialDelivery.project_id.label('project_id'),
+        MaterialDeliveryItem.material_id.label('material_id'),
+        func.sum(MaterialDeliveryItem.quantity).label('total')
+    ).join(MaterialDelivery, MaterialDeliveryItem.delivery_id == MaterialDelivery.id)
+    
+    consumed = db.session.query(
+        WorkPlan.project_id.label('project_id'),
+        ConsumptionLog.material_id.label('material_id'),
+        func.sum(ConsumptionLog.quantity_used).label('total')
+    ).join(WorkPlanItem, ConsumptionLog.work_item_id == WorkPlanItem.id) \
+     .join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id)
+    
+    if project_ids is not None:
+        planned = planned.filter(WorkPlan.project_id.in_(project_ids))
+        delivered = delivered.filter(MaterialDelivery.project_id.in_(project_ids))
+        consumed = consumed.filter(WorkPlan.project_id.in_(project_ids))
+    
+    planned = planned.group_by(WorkPlan.project_id, RequiredMaterial.material_id).cte('planned')
+    delivered = delivered.group_by(MaterialDelivery.project_id, MaterialDeliveryItem.material_id).cte('delivered')
+    consumed = consumed.group_by(WorkPlan.project_id, ConsumptionLog.material_id).cte('consumed')
+    
+    keys = union(
+        select(planned.c.project_id, planned.c.material_id),
+        select(delivered.c.project_id, delivered.c.material_id),
+        select(consumed.c.project_id, consumed.c.material_id)
+    ).cte('plan_fact_keys')
+    
+    planned_total = func.coalesce(planned.c.total, 0.0)
+    delivered_total = func.coalesce(delivered.c.total, 0.0)
+    consumed_total = func.coalesce(consumed.c.total, 0.0)
+    
+    if by_project:
+        columns = [
+            keys.c.project_id.label('project_id'),
+            planned_total.label('planned'),
+            delivered_total.label('delivered'),
+            consumed_total.label('consumed')
+        ]
+    else:
+        columns = [
+            func.count(func.distinct(keys.c.project_id)).label('projects_count'),
+            func.sum(planned_total).label('planned'),
+            func.sum(delivered_total).label('delivered'),
+            func.sum(consumed_total).label('consumed')
+        ]
+    
+    query = db.session.query(
+        Material.id.label('material_id'),
+        Material.name.label('material_name'),
+        Material.unit.label('unit'),
+        *columns
+    ).select_from(keys) \
+     .join(Material, Material.id == keys.c.material_id) \
+     .outerjoin(planned, and_(planned.c.project_id == keys.c.project_id,
+                              planned.c.material_id == keys.c.material_id)) \
+     .outerjoin(delivered, and_(delivered.c.project_id == keys.c.project_id,
+                                delivered.c.material_id == keys.c.material_id)) \
+     .outerjoin(consumed, and_(consumed.c.project_id == keys.c.project_id,
+                               consumed.c.material_id == keys.c.material_id))
+    
+    if by_project:
+        return query.order_by(keys.c.project_id, Material.name)
+    
+    return query.group_by(Material.id, Material.name, Material.unit).order_by(Material.name)
+
+
+def serialize_plan_fact_row(row, by_project=False):
+    """Преобразует строку запроса План/Факт в элемент отчета со статусом материала."""
+    total_planned = float(row.planned or 0.0)
+    total_delivered = float(row.delivered or 0.0)
+    total_consumed = float(row.consumed or 0.0)
+    remaining = total_delivered - total_consumed
+    forecast_variance = total_delivered - total_planned
+    
+    status = 'ok'
+    if total_planned > 0:
+        if total_delivered < total_planned * 0.8:
+            status = 'shortage_risk'
+        elif remaining < total_planned * 0.2 and total_consumed > 0:
+            status = 'running_low'
+    
+    if total_consumed > total_planned and total_planned > 0:
+        status = 'overrun'
+    
+    result = {
+        'material_id': row.material_id,
+        'material_name': row.material_name,
+        'unit': row.unit,
+        'planned': total_planned,
+        'delivered': total_delivered,
+        'consumed': total_consumed,
+        'remaining': remaining,
+        'forecast_variance': forecast_variance,
+        'status': status
+    }
+    if by_project:
+        result['project_id'] = row.project_id
+    elif 'projects_count' in row._fields:
+        result['projects_count'] = row.projects_count
+    return result
+
+
 @analytics_material_bp.route('/api/projects/<int:project_id>/risk-analysis', methods=['GET'])
 @token_required
 def get_project_risk_analysis(project_id):
@@ -184,6 +258,7 @@ def get_project_risk_analysis(project_id):
     material_risks = []
     schedule_risks = []
     today = date.today()
+    calendar = get_project_calendar(project_id)
     
     for item in work_plan.items:
         risk_info = analyze_work_item_risks(item, project_id)
@@ -196,20 +271,20 @@ def get_project_risk_analysis(project_id):
                     **risk
                 })
         
-        if item.end_date < today and item.progress < 100:
-            days_overdue = (today - item.end_date).days
+        days_overdue = calendar.working_days_between(item.end_date + timedelta(days=1), today)
+        if days_overdue > 0 and item.progress < 100:
             schedule_risks.append({
                 'work_item_id': item.id,
                 'work_item_name': item.name,
                 'risk_type': 'schedule_delay',
                 'severity': 'high' if days_overdue > 7 else 'medium',
-                'description': f'Работа просрочена на {days_overdue} дней. Прогресс: {item.progress}%',
+                'description': f'Работа просрочена на {days_overdue} рабочих дней. Прогресс: {item.progress}%',
                 'days_overdue': days_overdue,
                 'progress': item.progress
             })
         
         if item.status == 'in_progress':
-            expected_progress = calculate_expected_progress(item.start_date, item.end_date, today)
+            expected_progress = calculate_expected_progress(item.start_date, item.end_date, today, calendar)
             if item.progress < expected_progress - 10:
                 schedule_risks.append({
                     'work_item_id': item.id,
@@ -358,20 +433,10 @@ def get_material_balance_on_project(project_id, material_id):
     return float(delivered) - float(consumed)
 
 
-def calculate_expected_progress(start_date, end_date, current_date):
+def calculate_expected_progress(start_date, end_date, current_date, calendar=None):
     """
     Вычисляет ожидаемый прогресс работы на текущую дату.
-    Предполагает линейное выполнение работы.
+    Предполагает линейное выполнение работы по рабочим дням календаря проекта.
     """
-    if current_date <= start_date:
-        return 0.0
-    if current_date >= end_date:
-        return 100.0
-    
-    total_days = (end_date - start_date).days
-    elapsed_days = (current_date - start_date).days
-    
-    if total_days == 0:
-        return 100.0
-    
-    return (elapsed_days / total_days) * 100.0
+    calendar = calendar or get_builtin_calendar()
+    return calendar.expected_progress(start_date, end_date, current_date)
@@ -1,6 +1,9 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, request, jsonify
 from models import db, Project, Task, Issue, Document
 from auth import token_required
+from project_access import require_project_access, accessible_project_ids
+from compliance_service import compliance_report
+from evm_service import get_project_evm
 from datetime import date
 
 analytics_bp = Blueprint('analytics_bp', __name__)
@@ -82,4 +85,74 @@ def get_risk_assessment(project_id):
     """
     db.get_or_404(Project, project_id)
     risk_data = calculate_project_risk(project_id)
-    return jsonify(risk_data), 200
\ No newline at end of file
+    return jsonify(risk_data), 200
+
+
+@analytics_bp.route('/api/projects/<int:project_id>/evm', methods=['GET'])
+@token_required
+def get_project_evm_summary(project_id):
+    """
+    Показатели освоенного объема проекта (PV, EV, AC, SPI, CPI, EAC).
+    Необязательный параметр date (YYYY-MM-DD) - дата среза, не позже текущей.
+    """
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    day = None
+    if request.args.get('date'):
+        try:
+            day = date.fromisoformat(request.args['date'])
+        except ValueError:
+            return jsonify({'message': 'Неверный формат даты, ожидается YYYY-MM-DD'}), 400
+
+    db.get_or_404(Project, project_id)
+    series = get_project_evm(project_id)
+    if series is None:
+        return jsonify({'message': 'План работ для этого проекта не найден'}), 404
+    return jsonify(series.summary(day)), 200
+
+
+@analytics_bp.route('/api/projects/<int:project_id>/s-curve', methods=['GET'])
+@token_required
+def get_project_s_curve(project_id):
+    """S-кривая проекта: базовый план (PV) и фактические кривые EV и AC накопительным итогом."""
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    db.get_or_404(Project, project_id)
+    series = get_project_evm(project_id)
+    if series is None:
+        return jsonify({'message': 'План работ для этого проекта не найден'}), 404
+    return jsonify(series.s_curve()), 200
+
+
+@analytics_bp.route('/api/analytics/checklist-compliance', methods=['GET'])
+@token_required
+def get_checklist_compliance():
+    """
+    Аналитика соблюдения чек-листов по доступным проектам: пункты, чаще всего получающие ответ НЕТ,
+    тепловая карта (пункт x неделя), тренд доли нарушений по неделям и сводка по проектам.
+    Параметры: project_id, checklist_id, date_from, date_to (YYYY-MM-DD), top (до 100 пунктов).
+    """
+    current_user = request.current_user
+
+    project_ids = accessible_project_ids(current_user['id'], current_user['role'])
+    project_id = request.args.get('project_id', type=int)
+    if project_id:
+        access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+        if access_error:
+            return access_error
+        project_ids = [project_id]
+
+    try:
+        date_from = date.fromisoformat(request.args['date_from']) if request.args.get('date_from') else None
+        date_to = date.fromisoformat(request.args['date_to']) if request.args.get('date_to') else None
+    except ValueError:
+        return jsonify({'message': 'Неверный формат даты, ожидается YYYY-MM-DD'}), 400
+
+    top = max(1, min(request.args.get('top', 20, type=int), 100))
+    report = compliance_report(project_ids, date_from=date_from, date_to=date_to,
+                               checklist_id=request.args.get('checklist_id', type=int), top=top)
+    return jsonify(report), 200
@@ -0,0 +1,159 @@
+from flask import Blueprint, request, jsonify
+from datetime import date
+from sqlalchemy import update
+from models import db, WorkCalendar, Project
+from auth import token_required, role_required
+from project_access import require_project_access
+from work_calendar import get_project_calendar
+
+calendar_bp = Blueprint('calendar_bp', __name__)
+
+
+def _validate_calendar_data(data):
+    """Проверяет режим рабочей недели и списки дат. Возвращает текст ошибки или None."""
+    weekmask = data.get('weekmask')
+    if weekmask is not None and (not isinstance(weekmask, str) or len(weekmask) != 7 or set(weekmask) - {'0', '1'} or '1' not in weekmask):
+        return "weekmask должен состоять из 7 символов '0'/'1' (с понедельника) и содержать рабочий день"
+
+    for field in ('holidays', 'working_days'):
+        values = data.get(field)
+        if values is None:
+            continue
+        if not isinstance(values, list):
+            return f'Поле {field} должно быть массивом дат'
+        try:
+            for value in values:
+                date.fromisoformat(str(value))
+        except ValueError:
+            return f'Неверный формат даты в поле {field}, ожидается YYYY-MM-DD'
+    return None
+
+
+def _reset_default_calendar(exclude_id=None):
+    query = update(WorkCalendar).where(WorkCalendar.is_default.is_(True))
+    if exclude_id is not None:
+        query = query.where(WorkCalendar.id != exclude_id)
+    db.session.execute(query.values(is_default=False), execution_options={'synchronize_session': 'fetch'})
+
+
+@calendar_bp.route('/api/calendars', methods=['GET'])
+@token_required
+def get_calendars():
+    """Возвращает список рабочих календарей."""
+    calendars = WorkCalendar.query.order_by(WorkCalendar.id).all()
+    return jsonify([calendar.to_dict() for calendar in calendars]), 200
+
+
+@calendar_bp.route('/api/calendars', methods=['POST'])
+@token_required
+@role_required('client')
+def create_calendar():
+    """
+    Создает рабочий календарь.
+    Принимает name, region, weekmask, holidays, working_days и is_default.
+    """
+    data = request.get_json()
+    if not data or not data.get('name'):
+        return jsonify({'message': 'Поле name обязательно для заполнения'}), 400
+
+    error = _validate_calendar_data(data)
+    if error:
+        return jsonify({'message': error}), 400
+
+    if data.get('is_default'):
+        _reset_default_calendar()
+
+    calendar = WorkCalendar(
+        name=data['name'],
+        region=data.get('region'),
+        weekmask=data.get('weekmask', '1111100'),
+        holidays=sorted(set(data.get('holidays') or [])),
+        working_days=sorted(set(data.get('working_days') or [])),
+        is_default=bool(data.get('is_default', False))
+    )
+    db.session.add(calendar)
+    db.session.commit()
+    return jsonify(calendar.to_dict()), 201
+
+
+@calendar_bp.route('/api/calendars/<int:calendar_id>', methods=['PUT'])
+@token_required
+@role_required('client')
+def update_calendar(calendar_id):
+    """Обновляет рабочий календарь. Изменение увеличивает ревизию и сбрасывает кэш календаря."""
+    calendar = db.get_or_404(WorkCalendar, calendar_id)
+    data = request.get_json()
+    if not data:
+        return jsonify({'message': 'Пустое тело запроса'}), 400
+
+    error = _validate_calendar_data(data)
+    if error:
+        return jsonify({'message': error}), 400
+
+    if 'name' in data:
+        calendar.name = data['name']
+    if 'region' in data:
+        calendar.region = data['region']
+    if 'weekmask' in data:
+        calendar.weekmask = data['weekmask']
+    if 'holidays' in data:
+        calendar.holidays = sorted(set(data['holidays']))
+    if 'working_days' in data:
+        calendar.working_days = sorted(set(data['working_days']))
+    if data.get('is_default'):
+        _reset_default_calendar(exclude_id=calendar.id)
+        calendar.is_default = True
+    elif 'is_default' in data:
+        calendar.is_default = False
+
+    calendar.revision = (calendar.revision or 0) + 1
+    db.session.commit()
+    return jsonify(calendar.to_dict()), 200
+
+
+@calendar_bp.route('/api/projects/<int:project_id>/calendar', methods=['PUT'])
+@token_required
+@role_required('client')
+def assign_project_calendar(project_id):
+    """Назначает проекту рабочий календарь. calendar_id = null возвращает календарь по умолчанию."""
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    project = db.get_or_404(Project, project_id)
+    data = request.get_json() or {}
+    calendar_id = data.get('calendar_id')
+    if calendar_id is not None and not db.session.get(WorkCalendar, calendar_id):
+        return jsonify({'message': 'Календарь не найден'}), 404
+
+    project.work_calendar_id = calendar_id
+    db.session.commit()
+    return jsonify({'project_id': project.id, 'calendar_id': project.work_calendar_id}), 200
+
+
+@calendar_bp.route('/api/projects/<int:project_id>/calendar/working-days', methods=['GET'])
+@token_required
+def get_project_working_days(project_id):
+    """
+    Возвращает число рабочих дней проекта в периоде.
+    Параметры: start_date, end_date (YYYY-MM-DD), границы включаются.
+    """
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    try:
+        start_date = date.fromisoformat(request.args['start_date'])
+        end_date = date.fromisoformat(request.args['end_date'])
+    except (KeyError, ValueError):
+        return jsonify({'message': 'Параметры start_date и end_date обязательны, формат YYYY-MM-DD'}), 400
+
+    calendar = get_project_calendar(project_id)
+    return jsonify({
+        'project_id': project_id,
+        'calendar_id': calendar.calendar_id,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'calendar_days': max(0, (end_date - start_date).days + 1),
+        'working_days': calendar.working_days_between(start_date, end_date)
+    }), 200
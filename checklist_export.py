@@ -0,0 +1,296 @@
+import os
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.orm import joinedload, selectinload
+from models import db, ChecklistCompletion, ChecklistExport, ChecklistItem, ProjectUser, User
+from docx_templates import render_docx, serialize_docx
+from upload_store import UPLOADS_ROOT, upload_abspath
+
+EXPORT_FOLDER = os.path.join(UPLOADS_ROOT, 'checklist_exports')
+# Каталоги (относительно UPLOADS_ROOT), в которые сервер сохраняет фото чек-листов
+SERVER_PHOTO_PREFIXES = ('blobs/', 'checklist_photos/')
+MAX_EXPORT_COMPLETIONS = 5000
+EXPORT_BATCH_SIZE = 200
+# Число документов, начиная с которого рендеринг распределяется по процессам
+PARALLEL_THRESHOLD = 20
+RESPONSE_MARKS = ('yes', 'no', 'not_applicable')
+# Срок хранения готовых архивов выгрузки
+EXPORT_RETENTION = timedelta(days=7)
+
+
+def _user_name(user):
+    return f"{user.last_name} {user.first_name}" if user else ''
+
+
+def project_foremen(project_ids):
+    """ФИО прораба по проектам одним запросом."""
+    rows = db.session.query(ProjectUser.project_id, User.last_name, User.first_name) \
+        .join(User, User.id == ProjectUser.user_id) \
+        .filter(ProjectUser.project_id.in_(project_ids), User.role == 'foreman') \
+        .order_by(ProjectUser.user_id).all()
+    foremen = {}
+    for project_id, last_name, first_name in rows:
+        foremen.setdefault(project_id, f"{last_name} {first_name}")
+    return foremen
+
+
+def completion_payload(completion, foreman_name, checklist_items):
+    """
+    Данные для рендеринга DOCX заполненного чек-листа в виде простых значений,
+    которые можно передать в другой процесс.
+    """
+    checklist = completion.checklist
+    completion_date_str = completion.completion_date.strftime('%d.%m.%Y') if completion.completion_date else datetime.now().strftime('%d.%m.%Y')
+    project = completion.project
+    responses = {r.item_id: r for r in completion.item_responses}
+
+    rows = []
+    for idx, item in enumerate(checklist_items):
+        response = responses.get(item.id)
+        answer = response.response if response else None
+        rows.append([str(idx + 1), item.text] +
+                    ['✓' if answer == mark else '' for mark in RESPONSE_MARKS] +
+                    [response.comment if response and response.comment else ''])
+
+    photos = list(completion.photos or [])
+    for response in completion.item_responses:
+        photos.extend(response.photos or [])
+
+    return {
+        'completion_id': completion.id,
+        'template': 'checklist_opening_template.docx' if checklist.type == 'opening' else 'checklist_daily_template.docx',
+        'values': {
+            'PROJECT_NAME': project.name if project else '',
+            'DATE': completion_date_str,
+            'COMPLETED_BY': _user_name(completion.completed_by),
+            'ADDRESS': project.address if project else '',
+            'NOTES': completion.notes or '',
+            'FOREMAN': foreman_name or '',
+            'CHECK_DATE': completion_date_str
+        },
+        'rows': rows,
+        'photos': [photo for photo in photos if isinstance(photo, str)],
+        'filename': f"checklist_{completion.id}_{completion_date_str.replace('.', '')}.docx"
+    }
+
+
+def render_completion(payload):
+    """Рендерит DOCX заполненного чек-листа и возвращает его содержимое в байтах."""
+    doc = render_docx(payload['template'], payload['values'])
+
+    if len(doc.tables) > 0:
+        table = doc.tables[0]
+        for idx, values in enumerate(payload['rows']):
+            row_idx = idx + 2
+            while row_idx >= len(table.rows):
+                table.add_row()
+            cells = table.rows[row_idx].cells
+            for cell, value in zip(cells, values):
+                cell.text = value
+
+    doc.add_paragraph()
+    doc.add_paragraph("Проверил: _____________/_______________/")
+    doc.add_paragraph()
+    doc.add_paragraph("Чек-лист по выявленным нарушениям получил: _______________/_____________/")
+    return serialize_docx(doc).getvalue()
+
+
+def _completions_query(job):
+    query = ChecklistCompletion.query.filter(ChecklistCompletion.project_id == job.project_id)
+    if job.checklist_id:
+        query = query.filter(ChecklistCompletion.checklist_id == job.checklist_id)
+    if job.date_from:
+        query = query.filter(ChecklistCompletion.completion_date >= job.date_from)
+    if job.date_to:
+        query = query.filter(ChecklistCompletion.completion_date < job.date_to + timedelta(days=1))
+    return query
+
+
+def count_export_completions(job):
+    return _completions_query(job).count()
+
+
+def _load_payloads(completion_ids, foremen, items_cache):
+    completions = ChecklistCompletion.query.options(
+        joinedload(ChecklistCompletion.project),
+        joinedload(ChecklistCompletion.completed_by),
+        joinedload(ChecklistCompletion.checklist),
+        selectinload(ChecklistCompletion.item_responses)
+    ).filter(ChecklistCompletion.id.in_(completion_ids)).all()
+    by_id = {completion.id: completion for completion in completions}
+
+    payloads = []
+    for completion_id in completion_ids:
+        completion = by_id[completion_id]
+        if completion.checklist_id not in items_cache:
+            items_cache[completion.checklist_id] = db.session.query(ChecklistItem.id, ChecklistItem.text) \
+                .filter_by(checklist_id=completion.checklist_id).order_by(ChecklistItem.order).all()
+        payloads.append(completion_payload(completion, foremen.get(completion.project_id),
+                                           items_cache[completion.checklist_id]))
+    return payloads
+
+
+def _stored_photo_path(photo):
+    """
+    Абсолютный путь фото, сохраненного сервером (хранилище по хэшу или каталог фото чек-листов),
+    или None. Пути фото приходят и из запросов клиента, поэтому все остальное, в том числе
+    пути за пределами каталога загрузок, в архив не попадает.
+    """
+    if not isinstance(photo, str):
+        return None
+    relative = photo.lstrip('/')
+    if relative.startswith('uploads/'):
+        relative = relative[len('uploads/'):]
+    if not relative.startswith(SERVER_PHOTO_PREFIXES):
+        return None
+
+    path = upload_abspath(relative)
+    if not path:
+        return None
+    root = os.path.realpath(UPLOADS_ROOT)
+    real_path = os.path.realpath(path)
+    if os.path.commonpath([root, real_path]) != root or not os.path.isfile(real_path):
+        return None
+    return real_path
+
+
+def _write_entry(archive, payload, document, include_photos, written):
+    name = payload['filename']
+    if name in written:
+        name = f"checklist_{payload['completion_id']}.docx"
+    written.add(name)
+    archive.writestr(name, document)
+
+    if include_photos:
+        for photo in payload['photos']:
+            path = _stored_photo_path(photo)
+            if path:
+                archive.write(path, f"photos/{payload['completion_id']}/{os.path.basename(path)}")
+
+
+def build_export_archive(job, archive_path, progress_callback=None, workers=None):
+    """
+    Записывает DOCX заполненных чек-листов (и при необходимости фотографии) в ZIP-архив.
+    Чек-листы обрабатываются пакетами по EXPORT_BATCH_SIZE: данные пакета читаются из БД
+    в текущем процессе, документы рендерятся в пуле процессов и сразу дописываются в архив.
+    Если пул недоступен (например, внутри демонизированного воркера), рендеринг идет в текущем процессе.
+    progress_callback(processed) вызывается после каждого пакета.
+    """
+    completion_ids = [row.id for row in _completions_query(job)
+                      .with_entities(ChecklistCompletion.id)
+                      .order_by(ChecklistCompletion.completion_date, ChecklistCompletion.id)]
+    foremen = project_foremen([job.project_id])
+    include_photos = job.include_photos
+    workers = workers or int(os.environ.get('EXPORT_WORKERS', os.cpu_count() or 1))
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(completion_ids) >= PARALLEL_THRESHOLD else None
+
+    def render_batch(payloads):
+        nonlocal pool
+        if pool is not None:
+            try:
+                return list(pool.map(render_completion, payloads, chunksize=max(1, len(payloads) // (workers * 4))))
+            except (OSError, AssertionError, RuntimeError) as e:
+                print(f"[ChecklistExport] Пул процессов недоступен, рендеринг в текущем процессе: {e}")
+                pool.shutdown(cancel_futures=True)
+                pool = None
+        return [render_completion(payload) for payload in payloads]
+
+    items_cache, written, processed = {}, set(), 0
+    try:
+        # DOCX и JPEG уже сжаты, поэтому файлы добавляются в архив без повторного сжатия
+        with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for start in range(0, len(completion_ids), EXPORT_BATCH_SIZE):
+                payloads = _load_payloads(completion_ids[start:start + EXPORT_BATCH_SIZE], foremen, items_cache)
+                for payload, document in zip(payloads, render_batch(payloads)):
+                    _write_entry(archive, payload, document, include_photos, written)
+                processed += len(payloads)
+                db.session.expunge_all()
+                if progress_callback:
+                    progress_callback(processed)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return processed
+
+
+def run_checklist_export(export_id, progress_callback=None):
+    """
+    Выполняет фоновую выгрузку: прогресс фиксируется в записи выгрузки после каждого пакета,
+    при ошибке недописанный архив удаляется.
+    """
+    job = db.session.get(ChecklistExport, export_id)
+    if not job:
+        return None
+
+    os.makedirs(EXPORT_FOLDER, exist_ok=True)
+    archive_path = os.path.join(EXPORT_FOLDER, f"checklists_{job.project_id}_{job.id}_{uuid.uuid4().hex}.zip")
+
+    total = count_export_completions(job)
+
+    def on_progress(processed):
+        db.session.query(ChecklistExport).filter_by(id=export_id).update({'processed': processed})
+        db.session.commit()
+        if progress_callback:
+            progress_callback(processed, total)
+
+    try:
+        job.status = 'running'
+        job.total = total
+        db.session.commit()
+
+        build_export_archive(job, archive_path, progress_callback=on_progress)
+
+        job = db.session.get(ChecklistExport, export_id)
+        job.file_path = archive_path
+        job.file_size = os.path.getsize(archive_path)
+        job.status = 'completed'
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        job = db.session.get(ChecklistExport, export_id)
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+    return job
+
+
+def expire_export_archives(retention=EXPORT_RETENTION):
+    """
+    Удаляет архивы выгрузок старше retention: у завершенных выгрузок путь к архиву очищается
+    и статус меняется на expired; файлы каталога выгрузок без записи в БД (остаются после
+    прерванных задач) удаляются по времени изменения. Возвращает число удаленных файлов.
+    """
+    cutoff = datetime.now(timezone.utc) - retention
+    removed = 0
+    expired = db.session.query(ChecklistExport).filter(
+        ChecklistExport.file_path.isnot(None),
+        ChecklistExport.finished_at < cutoff
+    ).all()
+    for job in expired:
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+            removed += 1
+        job.file_path = None
+        job.status = 'expired'
+    db.session.commit()
+
+    if not os.path.isdir(EXPORT_FOLDER):
+        return removed
+
+    known = {os.path.basename(path) for (path,) in
+             db.session.query(ChecklistExport.file_path).filter(ChecklistExport.file_path.isnot(None))}
+    for name in os.listdir(EXPORT_FOLDER):
+        target = os.path.join(EXPORT_FOLDER, name)
+        if name in known or not os.path.isfile(target):
+            continue
+        if datetime.fromtimestamp(os.path.getmtime(target), timezone.utc) < cutoff:
+            os.remove(target)
+            removed += 1
+    return removed
@@ -0,0 +1,175 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from models import db, ChecklistCompletion, ChecklistItemResponse, Project, User
+from notification_service import create_notifications
+from compliance_service import apply_rollup_deltas, response_deltas
+from upload_store import UPLOADS_ROOT, store_upload, store_local_file
+from risk_calculator import recalculate_project_risk
+
+# Каталог временных файлов прежней схемы загрузки; такие фото переносятся в хранилище при обработке
+STAGING_FOLDER = os.path.join(UPLOADS_ROOT, 'checklist_photos', 'incoming')
+ALLOWED_PHOTO_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+MAX_IDEMPOTENCY_KEY_LENGTH = 100
+RESPONSE_VALUES = ('yes', 'no', 'not_applicable')
+# Заполнения в статусе pending/failed старше этого срока повторно ставятся в очередь обработки
+STALLED_PROCESSING_AFTER = timedelta(minutes=10)
+STALLED_PROCESSING_BATCH = 500
+
+
+class ChecklistIngestError(ValueError):
+    """Некорректные данные заполнения чек-листа (ответ 400)."""
+
+
+def allowed_photo(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_PHOTO_EXTENSIONS
+
+
+def find_completion_by_key(user_id, idempotency_key):
+    if not idempotency_key:
+        return None
+    return ChecklistCompletion.query.filter_by(completed_by_id=user_id, idempotency_key=idempotency_key).first()
+
+
+def parse_responses(raw, geolocation=None):
+    """Проверяет ответы на пункты и возвращает строки для пакетной вставки (без completion_id)."""
+    try:
+        responses = json.loads(raw or '[]')
+    except ValueError:
+        raise ChecklistIngestError('responses должен быть JSON-массивом')
+    if not isinstance(responses, list):
+        raise ChecklistIngestError('responses должен быть JSON-массивом')
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    for position, resp in enumerate(responses, start=1):
+        if not isinstance(resp, dict) or not resp.get('item_id') or resp.get('response') not in RESPONSE_VALUES:
+            raise ChecklistIngestError(
+                f'Ответ {position}: требуются item_id и response ({", ".join(RESPONSE_VALUES)})'
+            )
+        rows.append({
+            'item_id': resp['item_id'],
+            'response': resp['response'],
+            'photos': resp.get('photos', []),
+            'comment': resp.get('comment'),
+            'geolocation': resp.get('geolocation', geolocation),
+            'created_at': now
+        })
+    return rows
+
+
+def stage_photos(files):
+    """
+    Сохраняет загруженные фотографии в хранилище по содержимому (в текущей транзакции,
+    повторная загрузка того же фото - только ссылка на него).
+    Возвращает список {'path', 'filename'} для фоновой обработки.
+    """
+    staged = []
+    for file in files:
+        if file and file.filename and allowed_photo(file.filename):
+            staged.append({'path': store_upload(file).path, 'filename': file.filename})
+    return staged
+
+
+def ingest_completion(completion, responses, staged_photos):
+    """
+    Сохраняет заполнение одной транзакцией: запись заполнения и пакетная вставка ответов.
+    Если заполнение с тем же ключом идемпотентности уже создано параллельным запросом,
+    транзакция откатывается и возвращается существующее заполнение.
+    Возвращает (заполнение, создано ли новое).
+    """
+    completion.processing_status = 'pending'
+    completion.pending_photos = staged_photos or None
+    completion.photos = []
+    try:
+        db.session.add(completion)
+        db.session.flush()
+        if responses:
+            db.session.execute(
+                insert(ChecklistItemResponse),
+                [{'completion_id': completion.id, **row} for row in responses]
+            )
+            apply_rollup_deltas(response_deltas(completion, responses))
+        db.session.commit()
+    except IntegrityError:
+        # Откат снимает и ссылки на загруженные фото; файлы без ссылок удалит сборщик хранилища
+        db.session.rollback()
+        existing = find_completion_by_key(completion.completed_by_id, completion.idempotency_key)
+        if existing is None:
+            raise
+        return existing, False
+    return completion, True
+
+
+def _store_photos(completion):
+    """Переносит ожидающие фото в completion.photos. Возвращает временные файлы, которые можно удалить после фиксации."""
+    stored, staged_files = list(completion.photos or []), []
+    for photo in completion.pending_photos or []:
+        path = photo['path']
+        if os.path.isabs(path):
+            # Фото, сохраненное во временный каталог до перехода на хранилище по содержимому
+            if not os.path.exists(path):
+                continue
+            stored.append(store_local_file(path, photo['filename']).path)
+            staged_files.append(path)
+        else:
+            stored.append(path)
+    completion.photos = stored
+    completion.pending_photos = None
+    return staged_files
+
+
+def process_completion(completion_id, triggering_user_id=None):
+    """
+    Фоновая обработка сохраненного заполнения: перенос фотографий в постоянное хранилище,
+    пересчет риска проекта и уведомления инспекторов одной пакетной вставкой.
+    Повторный вызов для уже обработанного заполнения ничего не делает.
+    """
+    completion = db.session.get(ChecklistCompletion, completion_id)
+    if completion is None or completion.processing_status == 'completed':
+        return completion
+
+    try:
+        staged_files = _store_photos(completion)
+        db.session.commit()
+        for path in staged_files:
+            os.remove(path)
+
+        recalculate_project_risk(completion.project_id, triggering_user_id=triggering_user_id)
+
+        checklist = completion.checklist
+        if checklist.requires_approval and checklist.type == 'opening':
+            project = db.session.get(Project, completion.project_id)
+            inspector_ids = [row.id for row in db.session.query(User.id).filter_by(role='inspector', is_active=True)]
+            create_notifications([
+                {
+                    'user_id': inspector_id,
+                    'message': f"Новый чек-лист открытия объекта '{project.name}' ожидает согласования",
+                    'link': "/pending-approvals"
+                }
+                for inspector_id in inspector_ids
+            ])
+
+        completion.processing_status = 'completed'
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        completion = db.session.get(ChecklistCompletion, completion_id)
+        completion.processing_status = 'failed'
+        db.session.commit()
+        raise
+    return completion
+
+
+def stalled_completion_ids(older_than=STALLED_PROCESSING_AFTER, limit=STALLED_PROCESSING_BATCH):
+    """
+    Заполнения, обработка которых не поставлена в очередь (брокер был недоступен), прервалась
+    или завершилась ошибкой: (id, автор) в статусе pending/failed старше older_than.
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    return db.session.query(ChecklistCompletion.id, ChecklistCompletion.completed_by_id).filter(
+        ChecklistCompletion.processing_status.in_(['pending', 'failed']),
+        ChecklistCompletion.completion_date < cutoff
+    ).order_by(ChecklistCompletion.id).limit(limit).all()
@@ -1,38 +1,27 @@
 from flask import Blueprint, jsonify, request, send_file
-from sqlalchemy.orm import joinedload
-from models import db, Checklist, ChecklistCompletion, ChecklistItem, ChecklistItemResponse, User, Project, ProjectUser
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload, selectinload
+from models import (db, Checklist, ChecklistCompletion, ChecklistExport, ChecklistItem, ChecklistItemResponse,
+                    Project, ProjectUser)
 from auth import token_required
+from project_access import require_project_access
 from datetime import datetime, date, timezone, timedelta
-from docx import Document
+from checklist_export import (completion_payload, render_completion, project_foremen, count_export_completions,
+                              MAX_EXPORT_COMPLETIONS)
 from notification_service import create_notification
+from checklist_ingest import (find_completion_by_key, parse_responses, stage_photos, ingest_completion,
+                             ChecklistIngestError, MAX_IDEMPOTENCY_KEY_LENGTH)
 from risk_calculator import recalculate_project_risk
+from compliance_service import apply_rollup_deltas, response_deltas
+from upload_store import retain_upload, release_uploads
 import io
 import os
 import json
-from werkzeug.utils import secure_filename
 
 checklist_bp = Blueprint('checklist', __name__)
 
-UPLOAD_FOLDER = '/app/uploads/checklist_photos'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-
-@checklist_bp.route('/api/checklists', methods=['GET'])
-@token_required
-def get_checklists():
-    """Получение списка всех чек-листов"""
-    try:
-        checklists = Checklist.query.all()
-        return jsonify([checklist.to_dict() for checklist in checklists]), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+COMPLETIONS_PAGE_SIZE = 50
+MAX_COMPLETIONS_PAGE_SIZE = 200
 
 
 @checklist_bp.route('/api/checklists/pending-approval', methods=['GET'])
@@ -87,7 +76,12 @@ def get_checklist(checklist_id):
 @checklist_bp.route('/api/checklists/<int:checklist_id>/complete', methods=['POST'])
 @token_required
 def complete_checklist(checklist_id):
-    """Заполнение чек-листа с загрузкой файлов."""
+    """
+    Заполнение чек-листа с загрузкой файлов.
+    Заголовок Idempotency-Key (или поле idempotency_key) делает повторную отправку безопасной:
+    при повторе возвращается уже созданное заполнение (200). Фотографии, пересчет риска
+    и уведомления обрабатываются фоновой задачей после сохранения.
+    """
     try:
         current_user_role = request.current_user.get('role')
         current_user_id = request.current_user.get('id')
@@ -95,6 +89,18 @@ def complete_checklist(checklist_id):
         if current_user_role != 'client':
             return jsonify({'error': 'Только клиент может заполнять чек-листы'}), 403
 
+        idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        if idempotency_key and len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({'error': f'Ключ идемпотентности длиннее {MAX_IDEMPOTENCY_KEY_LENGTH} символов'}), 400
+
+        existing = find_completion_by_key(current_user_id, idempotency_key)
+        if existing:
+            if existing.checklist_id != checklist_id:
+                return jsonify({'error': 'Ключ идемпотентности уже использован для другого чек-листа'}), 409
+            response = jsonify(existing.to_dict())
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response, 200
+
         checklist = Checklist.query.get_or_404(checklist_id)
         project_id = request.form.get('project_id', type=int)
         if not project_id:
@@ -117,17 +123,10 @@ def complete_checklist(checklist_id):
             if project.status != 'active':
                 return jsonify({'error': 'Объект должен быть активирован перед заполнением ежедневного чек-листа'}), 403
 
-        photo_paths = []
-        uploaded_files = request.files.getlist('photos')
-        for file in uploaded_files:
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                random_chars = os.urandom(4).hex()
-                unique_filename = f"{timestamp}_{random_chars}_{filename}"
-                file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(file_path)
-                photo_paths.append(f'checklist_photos/{unique_filename}')
+        try:
+            responses = parse_responses(request.form.get('responses'), request.form.get('geolocation'))
+        except ChecklistIngestError as e:
+            return jsonify({'error': str(e)}), 400
 
         completion = ChecklistCompletion(
             checklist_id=checklist_id,
@@ -135,44 +134,28 @@ def complete_checklist(checklist_id):
             completed_by_id=current_user_id,
             completion_date=datetime.now(timezone.utc),
             items_data=json.loads(request.form.get('items_data', '{}')),
-            photos=photo_paths,
             geolocation=request.form.get('geolocation'),
             notes=request.form.get('notes'),
             approval_status='not_required' if not checklist.requires_approval else 'pending',
             initialization_required=checklist.requires_initialization,
             initialized_at=datetime.now(timezone.utc) if checklist.requires_initialization else None,
-            initialization_geolocation=request.form.get('initialization_geolocation') if checklist.requires_initialization else None
+            initialization_geolocation=request.form.get('initialization_geolocation') if checklist.requires_initialization else None,
+            idempotency_key=idempotency_key
         )
-        db.session.add(completion)
-        db.session.flush()
-
-        responses_data = json.loads(request.form.get('responses', '[]'))
-        for resp in responses_data:
-            response = ChecklistItemResponse(
-                completion_id=completion.id,
-                item_id=resp['item_id'],
-                response=resp['response'],
-                photos=resp.get('photos', []),
-                comment=resp.get('comment'),
-                geolocation=resp.get('geolocation', request.form.get('geolocation')),
-                created_at=datetime.now(timezone.utc)
-            )
-            db.session.add(response)
-
-        db.session.commit()
-
-        recalculate_project_risk(project_id, triggering_user_id=request.current_user['id'])
-        
-        if checklist.requires_approval and checklist.type == 'opening':
-            project = db.session.get(Project, project_id)
-            inspector_users = db.session.query(User).filter_by(role='inspector', is_active=True).all()
-            
-            for inspector in inspector_users:
-                create_notification(
-                    user_id=inspector.id,
-                    message=f"Новый чек-лист открытия объекта '{project.name}' ожидает согласования",
-                    link=f"/pending-approvals"
-                )
+        completion, created = ingest_completion(completion, responses, stage_photos(request.files.getlist('photos')))
+        if not created:
+            response = jsonify(completion.to_dict())
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response, 200
+
+        try:
+            from tasks import process_checklist_completion_task
+            process_checklist_completion_task.delay(completion.id, current_user_id)
+        except Exception as e:
+            # Заполнение уже сохранено; обработку повторит периодическая задача
+            print(f"[Checklist] Не удалось поставить обработку заполнения {completion.id} в очередь: {e}")
+            completion.processing_status = 'failed'
+            db.session.commit()
         
         return jsonify(completion.to_dict()), 201
 
@@ -184,21 +167,48 @@ def complete_checklist(checklist_id):
 @checklist_bp.route('/api/projects/<int:project_id>/checklists/<checklist_type>/completions', methods=['GET'])
 @token_required
 def get_completions(project_id, checklist_type):
-    """Получение истории заполнений чек-листов для проекта"""
+    """
+    История заполнений чек-листа для проекта.
+    Шаблон чек-листа с пунктами передается один раз в поле checklist, заполнения ссылаются на него
+    по checklist_id и checklist_version (время последнего изменения шаблона).
+    Keyset-пагинация: limit (по умолчанию 50) и cursor из next_cursor предыдущего ответа.
+    """
     try:
-        checklist = Checklist.query.filter_by(type=checklist_type).first()
+        checklist = Checklist.query.options(selectinload(Checklist.items)).filter_by(type=checklist_type).first()
         if not checklist:
             return jsonify({'error': 'Чек-лист не найден'}), 404
 
-        completions = ChecklistCompletion.query.filter_by(
-            project_id=project_id,
-            checklist_id=checklist.id
-        ).order_by(ChecklistCompletion.completion_date.desc()).all()
-
+        query = ChecklistCompletion.query.options(
+            selectinload(ChecklistCompletion.completed_by),
+            selectinload(ChecklistCompletion.approved_by)
+        ).filter_by(project_id=project_id, checklist_id=checklist.id)
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                cursor_date, cursor_id = cursor.rsplit('_', 1)
+                cursor_date, cursor_id = datetime.fromisoformat(cursor_date), int(cursor_id)
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Неверный формат курсора'}), 400
+            query = query.filter(or_(
+                ChecklistCompletion.completion_date < cursor_date,
+                and_(ChecklistCompletion.completion_date == cursor_date, ChecklistCompletion.id < cursor_id)
+            ))
+
+        limit = max(1, min(request.args.get('limit', COMPLETIONS_PAGE_SIZE, type=int), MAX_COMPLETIONS_PAGE_SIZE))
+        completions = query.order_by(ChecklistCompletion.completion_date.desc(), ChecklistCompletion.id.desc()) \
+            .limit(limit + 1).all()
+
+        next_cursor = None
+        if len(completions) > limit:
+            completions = completions[:limit]
+            next_cursor = f"{completions[-1].completion_date.isoformat()}_{completions[-1].id}"
+
+        checklist_version = checklist.updated_at.isoformat()
         result = []
         for completion in completions:
             completion_dict = completion.to_dict()
-            completion_dict['checklist'] = completion.checklist.to_dict()
+            completion_dict['checklist_version'] = checklist_version
             completion_dict['completed_by'] = {
                 'id': completion.completed_by.id,
                 'first_name': completion.completed_by.first_name,
@@ -213,7 +223,11 @@ def get_completions(project_id, checklist_type):
                 }
             result.append(completion_dict)
 
-        return jsonify(result), 200
+        return jsonify({
+            'checklist': {**checklist.to_dict(), 'version': checklist_version},
+            'completions': result,
+            'next_cursor': next_cursor
+        }), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -262,114 +276,21 @@ def export_checklist_docx(completion_id):
         completion = ChecklistCompletion.query.get_or_404(completion_id)
         checklist = completion.checklist
 
-        if checklist.type == 'opening':
-            template_path = os.path.join(os.path.dirname(__file__), 'templates', 'checklist_opening_template.docx')
-        else:
-            template_path = os.path.join(os.path.dirname(__file__), 'templates', 'checklist_daily_template.docx')
-
-        if not os.path.exists(template_path):
-            return jsonify({'error': f'Шаблон не найден: {template_path}'}), 404
-
-        doc = Document(template_path)
-
-        completion_date_str = completion.completion_date.strftime('%d.%m.%Y') if completion.completion_date else datetime.now().strftime('%d.%m.%Y')
-        completed_by_name = f"{completion.completed_by.last_name} {completion.completed_by.first_name}"
-        
-        foreman_name = ''
-        if completion.project:
-            foreman_member = next((m for m in completion.project.members if m.user and m.user.role == 'foreman'), None)
-            if foreman_member and foreman_member.user:
-                foreman_name = f"{foreman_member.user.last_name} {foreman_member.user.first_name}"
-        
-        replacements = {
-            '{{PROJECT_NAME}}': completion.project.name if completion.project else '',
-            '{{DATE}}': completion_date_str,
-            '{{COMPLETED_BY}}': completed_by_name,
-            '{{ADDRESS}}': completion.project.address if completion.project else '',
-            '{{NOTES}}': completion.notes or '',
-            '{{FOREMAN}}': foreman_name,
-            '{{CHECK_DATE}}': completion_date_str
-        }
-
-        for paragraph in doc.paragraphs:
-            for key, value in replacements.items():
-                if key in paragraph.text:
-                    for run in paragraph.runs:
-                        if key in run.text:
-                            run.text = run.text.replace(key, value)
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        for key, value in replacements.items():
-                            if key in paragraph.text:
-                                for run in paragraph.runs:
-                                    if key in run.text:
-                                        run.text = run.text.replace(key, value)
-
-        responses = {r.item_id: r for r in completion.item_responses}
-        sorted_items = sorted(checklist.items, key=lambda x: x.order)
-
-        if len(doc.tables) > 0:
-            table = doc.tables[0]
-            
-            for idx, item in enumerate(sorted_items):
-                row_idx = idx + 2
-                
-                while row_idx >= len(table.rows):
-                    table.add_row()
-                
-                row = table.rows[row_idx]
-                
-                try:
-                    row.cells[0].text = str(idx + 1)
-                except:
-                    pass
-                
-                try:
-                    row.cells[1].text = item.text
-                except:
-                    pass
-                
-                response = responses.get(item.id)
-                
-                try:
-                    row.cells[2].text = '✓' if response and response.response == 'yes' else ''
-                except:
-                    pass
-                
-                try:
-                    row.cells[3].text = '✓' if response and response.response == 'no' else ''
-                except:
-                    pass
-                
-                try:
-                    row.cells[4].text = '✓' if response and response.response == 'not_applicable' else ''
-                except:
-                    pass
-                
-                try:
-                    row.cells[5].text = response.comment if response and response.comment else ''
-                except:
-                    pass
-        
-        doc.add_paragraph()
-        doc.add_paragraph("Проверил: _____________/_______________/")
-        doc.add_paragraph()
-        doc.add_paragraph("Чек-лист по выявленным нарушениям получил: _______________/_____________/")
-
-        docx_io = io.BytesIO()
-        doc.save(docx_io)
-        docx_io.seek(0)
-
-        filename = f"checklist_{completion.id}_{completion_date_str.replace('.', '')}.docx"
+        payload = completion_payload(
+            completion,
+            project_foremen([completion.project_id]).get(completion.project_id),
+            sorted(checklist.items, key=lambda x: x.order)
+        )
+        try:
+            docx_io = io.BytesIO(render_completion(payload))
+        except FileNotFoundError:
+            return jsonify({'error': f"Шаблон не найден: {payload['template']}"}), 404
 
         return send_file(
             docx_io,
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             as_attachment=True,
-            download_name=filename
+            download_name=payload['filename']
         )
 
     except Exception as e:
@@ -476,9 +397,22 @@ def update_completion(completion_id):
         if 'notes' in data:
             completion.notes = data['notes']
         if 'photos' in data:
-            completion.photos = data['photos']
+            photos = data['photos'] or []
+            if not isinstance(photos, list) or not all(isinstance(photo, str) for photo in photos):
+                return jsonify({'error': 'photos должен быть списком путей'}), 400
+            # Сначала ссылки на новый список, затем снятие ссылок старого: общие фото не теряют ссылку
+            for photo in photos:
+                retain_upload(photo)
+            release_uploads(completion.photos)
+            completion.photos = photos
 
         if 'responses' in data:
+            old_responses = db.session.query(ChecklistItemResponse.item_id, ChecklistItemResponse.response) \
+                .filter_by(completion_id=completion_id).all()
+            deltas = response_deltas(completion, old_responses, sign=-1)
+            response_deltas(completion, data['responses'], deltas=deltas)
+            apply_rollup_deltas(deltas)
+
             ChecklistItemResponse.query.filter_by(completion_id=completion_id).delete()
             
             for resp in data['responses']:
@@ -579,3 +513,90 @@ def reject_completion(completion_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+
+
+@checklist_bp.route('/api/projects/<int:project_id>/checklist-exports', methods=['POST'])
+@token_required
+def create_checklist_export(project_id):
+    """
+    Запускает фоновую выгрузку заполненных чек-листов проекта в ZIP-архив DOCX.
+    Тело: date_from, date_to (YYYY-MM-DD), checklist_id, include_photos.
+    """
+    current_user_id = request.current_user.get('id')
+    access_error = require_project_access(project_id, current_user_id, request.current_user.get('role'))
+    if access_error:
+        return access_error
+
+    data = request.get_json(silent=True) or {}
+    try:
+        date_from = date.fromisoformat(data['date_from']) if data.get('date_from') else None
+        date_to = date.fromisoformat(data['date_to']) if data.get('date_to') else None
+    except ValueError:
+        return jsonify({'error': 'Неверный формат даты, ожидается YYYY-MM-DD'}), 400
+    if date_from and date_to and date_from > date_to:
+        return jsonify({'error': 'date_from не может быть позже date_to'}), 400
+
+    job = ChecklistExport(
+        project_id=project_id,
+        requested_by_id=current_user_id,
+        checklist_id=data.get('checklist_id'),
+        date_from=date_from,
+        date_to=date_to,
+        include_photos=bool(data.get('include_photos', False))
+    )
+    job.total = count_export_completions(job)
+    if job.total == 0:
+        return jsonify({'error': 'Нет заполненных чек-листов за выбранный период'}), 404
+    if job.total > MAX_EXPORT_COMPLETIONS:
+        return jsonify({'error': f'За один раз можно выгрузить не более {MAX_EXPORT_COMPLETIONS} чек-листов'}), 400
+
+    db.session.add(job)
+    db.session.commit()
+
+    try:
+        from tasks import export_checklists_task
+        export_checklists_task.delay(job.id)
+    except Exception as e:
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+        return jsonify({'error': f'Ошибка при запуске выгрузки: {e}', 'export': job.to_dict()}), 500
+
+    return jsonify(job.to_dict()), 202
+
+
+def _get_checklist_export(export_id):
+    job = db.get_or_404(ChecklistExport, export_id)
+    access_error = require_project_access(job.project_id, request.current_user.get('id'), request.current_user.get('role'))
+    return job, access_error
+
+
+@checklist_bp.route('/api/checklist-exports/<int:export_id>', methods=['GET'])
+@token_required
+def get_checklist_export(export_id):
+    """Статус выгрузки чек-листов: прогресс и ссылка на архив после завершения."""
+    job, access_error = _get_checklist_export(export_id)
+    if access_error:
+        return access_error
+    return jsonify(job.to_dict()), 200
+
+
+@checklist_bp.route('/api/checklist-exports/<int:export_id>/download', methods=['GET'])
+@token_required
+def download_checklist_export(export_id):
+    """Скачивание готового ZIP-архива выгрузки чек-листов."""
+    job, access_error = _get_checklist_export(export_id)
+    if access_error:
+        return access_error
+    if job.status == 'expired':
+        return jsonify({'error': 'Срок хранения архива истек, запустите выгрузку заново', 'status': job.status}), 410
+    if job.status != 'completed' or not job.file_path or not os.path.exists(job.file_path):
+        return jsonify({'error': 'Архив еще не готов', 'status': job.status}), 409
+
+    return send_file(
+        job.file_path,
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=f'checklists_{job.project_id}_{job.id}.zip'
+    )
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy.orm import selectinload
 from models import Classifier, Checklist, ChecklistItem, db
 from auth import token_required, role_required
+from reference_cache import cached_json_response
 from datetime import datetime, timezone
 import uuid
 
@@ -14,20 +16,18 @@ def get_classifiers():
     Возвращает список классификаторов.
 
     Позволяет фильтровать классификаторы по типу (violation, remark).
+    Ответ кэшируется до изменения справочника и отдается со строгим ETag (304 при If-None-Match).
     """
     try:
         classifier_type = request.args.get('type')
-        
-        query = Classifier.query
-        
-        if classifier_type:
-            query = query.filter_by(type=classifier_type)
-        
-        classifiers = query.all()
-        
-        return jsonify({
-            'classifiers': [classifier.to_dict() for classifier in classifiers]
-        }), 200
+
+        def build():
+            query = Classifier.query
+            if classifier_type:
+                query = query.filter_by(type=classifier_type)
+            return {'classifiers': [classifier.to_dict() for classifier in query.all()]}
+
+        return cached_json_response('classifiers', classifier_type, build)
         
     except Exception as e:
         return jsonify({'message': 'Ошибка получения классификаторов', 'error': str(e)}), 500
@@ -166,20 +166,18 @@ def get_checklists():
     Возвращает список чек-листов.
 
     Позволяет фильтровать чек-листы по типу.
+    Ответ кэшируется до изменения справочника и отдается со строгим ETag (304 при If-None-Match).
     """
     try:
         checklist_type = request.args.get('type')
-        
-        query = Checklist.query
-        
-        if checklist_type:
-            query = query.filter_by(type=checklist_type)
-        
-        checklists = query.all()
-        
-        return jsonify({
-            'checklists': [checklist.to_dict() for checklist in checklists]
-        }), 200
+
+        def build():
+            query = Checklist.query.options(selectinload(Checklist.items))
+            if checklist_type:
+                query = query.filter_by(type=checklist_type)
+            return {'checklists': [checklist.to_dict() for checklist in query.all()]}
+
+        return cached_json_response('checklists', checklist_type, build)
         
     except Exception as e:
         return jsonify({'message': 'Ошибка получения чек-листов', 'error': str(e)}), 500
@@ -0,0 +1,235 @@
+from datetime import timedelta
+from sqlalchemy import func, update, insert
+from models import db, ChecklistComplianceRollup, ChecklistCompletion, ChecklistItem, ChecklistItemResponse
+
+RESPONSE_COUNTERS = {
+    'yes': 'yes_count',
+    'no': 'no_count',
+    'not_applicable': 'not_applicable_count'
+}
+ROLLUP_KEY_COLUMNS = ('checklist_item_id', 'project_id', 'week_start')
+
+
+def week_start(value):
+    """Понедельник недели, к которой относится дата заполнения."""
+    day = value.date() if hasattr(value, 'date') else value
+    return day - timedelta(days=day.weekday())
+
+
+def add_response_delta(deltas, project_id, completion_date, item_id, response, sign=1):
+    """
+    Накапливает приращение недельной сводки для одного ответа.
+    deltas - словарь {(item_id, project_id, week_start): [yes, no, not_applicable]}; sign=-1 для удаления ответа.
+    """
+    if response not in RESPONSE_COUNTERS:
+        return deltas
+    counts = deltas.setdefault((item_id, project_id, week_start(completion_date)), [0, 0, 0])
+    counts[list(RESPONSE_COUNTERS).index(response)] += sign
+    return deltas
+
+
+def response_deltas(completion, responses, sign=1, deltas=None):
+    """Приращения сводки для ответов одного заполнения (responses - объекты или словари с item_id и response)."""
+    deltas = {} if deltas is None else deltas
+    for response in responses:
+        item_id = response['item_id'] if isinstance(response, dict) else response.item_id
+        value = response['response'] if isinstance(response, dict) else response.response
+        add_response_delta(deltas, completion.project_id, completion.completion_date, item_id, value, sign)
+    return deltas
+
+
+def _upsert_insert(dialect_name):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def apply_rollup_deltas(deltas):
+    """
+    Применяет приращения к недельным сводкам в текущей транзакции.
+    В PostgreSQL и SQLite - один INSERT ... ON CONFLICT DO UPDATE на все ключи,
+    в остальных СУБД - UPDATE с вставкой отсутствующих строк.
+    """
+    rows = [
+        {
+            'checklist_item_id': item_id,
+            'project_id': project_id,
+            'week_start': week,
+            'yes_count': counts[0],
+            'no_count': counts[1],
+            'not_applicable_count': counts[2]
+        }
+        for (item_id, project_id, week), counts in sorted(deltas.items())
+        if any(counts)
+    ]
+    if not rows:
+        return
+
+    dialect_insert = _upsert_insert(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        statement = dialect_insert(ChecklistComplianceRollup).values(rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY_COLUMNS),
+            set_={
+                column: getattr(ChecklistComplianceRollup, column) + getattr(statement.excluded, column)
+                for column in RESPONSE_COUNTERS.values()
+            }
+        ))
+        return
+
+    for row in rows:
+        result = db.session.execute(
+            update(ChecklistComplianceRollup)
+            .where(*(getattr(ChecklistComplianceRollup, column) == row[column] for column in ROLLUP_KEY_COLUMNS))
+            .values({
+                column: getattr(ChecklistComplianceRollup, column) + row[column]
+                for column in RESPONSE_COUNTERS.values()
+            })
+        )
+        if result.rowcount == 0:
+            db.session.execute(insert(ChecklistComplianceRollup), [row])
+
+
+def reconcile_compliance_rollups(project_id=None, fix=False):
+    """
+    Сверяет недельные сводки с ответами чек-листов (полный проход по ответам, для фоновой проверки).
+    Возвращает список расхождений; при fix=True записывает корректные значения.
+    """
+    responses_query = db.session.query(
+        ChecklistItemResponse.item_id,
+        ChecklistCompletion.project_id,
+        ChecklistCompletion.completion_date,
+        ChecklistItemResponse.response,
+        func.count(ChecklistItemResponse.id)
+    ).join(ChecklistCompletion, ChecklistCompletion.id == ChecklistItemResponse.completion_id) \
+        .group_by(ChecklistItemResponse.item_id, ChecklistCompletion.project_id,
+                  ChecklistCompletion.completion_date, ChecklistItemResponse.response)
+
+    stored_query = db.session.query(ChecklistComplianceRollup)
+    if project_id is not None:
+        responses_query = responses_query.filter(ChecklistCompletion.project_id == project_id)
+        stored_query = stored_query.filter(ChecklistComplianceRollup.project_id == project_id)
+
+    actual = {}
+    for item_id, row_project_id, completion_date, response, count in responses_query:
+        add_response_delta(actual, row_project_id, completion_date, item_id, response, sign=count)
+
+    stored = {
+        (rollup.checklist_item_id, rollup.project_id, rollup.week_start):
+            [rollup.yes_count, rollup.no_count, rollup.not_applicable_count]
+        for rollup in stored_query
+    }
+
+    drift = []
+    corrections = {}
+    for key in sorted(set(actual) | set(stored)):
+        real = actual.get(key, [0, 0, 0])
+        current = stored.get(key, [0, 0, 0])
+        if real == current:
+            continue
+        item_id, row_project_id, week = key
+        drift.append({
+            'checklist_item_id': item_id,
+            'project_id': row_project_id,
+            'week_start': week.isoformat(),
+            'stored': dict(zip(RESPONSE_COUNTERS, current)),
+            'actual': dict(zip(RESPONSE_COUNTERS, real))
+        })
+        corrections[key] = [r - c for r, c in zip(real, current)]
+
+    if fix and corrections:
+        apply_rollup_deltas(corrections)
+        db.session.commit()
+
+    return drift
+
+
+def _fail_rate(yes, no):
+    return round(no * 100.0 / (yes + no), 1) if yes + no else None
+
+
+def _counts(yes, no, not_applicable):
+    yes, no, not_applicable = int(yes or 0), int(no or 0), int(not_applicable or 0)
+    return {
+        'yes': yes,
+        'no': no,
+        'not_applicable': not_applicable,
+        'fail_rate': _fail_rate(yes, no)
+    }
+
+
+def compliance_report(project_ids=None, date_from=None, date_to=None, checklist_id=None, top=20):
+    """
+    Аналитика соблюдения чек-листов по недельным сводкам (без чтения ответов):
+    items - пункты, чаще всего получающие ответ НЕТ; trend - доля нарушений по неделям;
+    heatmap - пункты x недели для items; projects - доля нарушений по проектам.
+    project_ids=None - все проекты.
+    """
+    rollup = ChecklistComplianceRollup
+    sums = (func.sum(rollup.yes_count), func.sum(rollup.no_count), func.sum(rollup.not_applicable_count))
+
+    def scoped(query):
+        if project_ids is not None:
+            query = query.filter(rollup.project_id.in_(project_ids))
+        if date_from:
+            query = query.filter(rollup.week_start >= week_start(date_from))
+        if date_to:
+            query = query.filter(rollup.week_start <= date_to)
+        if checklist_id:
+            query = query.join(ChecklistItem, ChecklistItem.id == rollup.checklist_item_id) \
+                .filter(ChecklistItem.checklist_id == checklist_id)
+        return query
+
+    no_total = func.sum(rollup.no_count)
+    top_items = scoped(db.session.query(rollup.checklist_item_id, *sums)) \
+        .group_by(rollup.checklist_item_id) \
+        .having(no_total > 0) \
+        .order_by(no_total.desc(), rollup.checklist_item_id) \
+        .limit(top).all()
+    top_item_ids = [row[0] for row in top_items]
+
+    item_info = {
+        item.id: item for item in
+        db.session.query(ChecklistItem.id, ChecklistItem.checklist_id, ChecklistItem.text, ChecklistItem.category)
+        .filter(ChecklistItem.id.in_(top_item_ids))
+    } if top_item_ids else {}
+
+    items = []
+    for item_id, yes, no, not_applicable in top_items:
+        info = item_info.get(item_id)
+        items.append({
+            'checklist_item_id': item_id,
+            'checklist_id': info.checklist_id if info else None,
+            'text': info.text if info else None,
+            'category': info.category if info else None,
+            **_counts(yes, no, not_applicable)
+        })
+
+    trend = [
+        {'week_start': week.isoformat(), **_counts(yes, no, not_applicable)}
+        for week, yes, no, not_applicable in scoped(db.session.query(rollup.week_start, *sums))
+        .group_by(rollup.week_start).order_by(rollup.week_start)
+    ]
+
+    heatmap = []
+    if top_item_ids:
+        heatmap = [
+            {'checklist_item_id': item_id, 'week_start': week.isoformat(), **_counts(yes, no, not_applicable)}
+            for item_id, week, yes, no, not_applicable in
+            scoped(db.session.query(rollup.checklist_item_id, rollup.week_start, *sums))
+            .filter(rollup.checklist_item_id.in_(top_item_ids))
+            .group_by(rollup.checklist_item_id, rollup.week_start)
+            .order_by(rollup.checklist_item_id, rollup.week_start)
+        ]
+
+    projects = [
+        {'project_id': row_project_id, **_counts(yes, no, not_applicable)}
+        for row_project_id, yes, no, not_applicable in
+        scoped(db.session.query(rollup.project_id, *sums)).group_by(rollup.project_id).order_by(rollup.project_id)
+    ]
+
+    return {'items': items, 'trend': trend, 'heatmap': heatmap, 'projects': projects}
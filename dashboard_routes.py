@@ -2,6 +2,7 @@
 from flask import Blueprint, request, jsonify
 from models import Project, DailyReport, User, Task, Issue, db
 from auth import token_required
+from evm_service import get_project_evm
 from datetime import datetime, timedelta
 from sqlalchemy import func
 import uuid
@@ -86,7 +87,9 @@ def get_project_summary(project_id):
         
         total_requests = 0
         completed_requests = 0
-        progress_percentage = 0
+        evm_series = get_project_evm(int(project_id))
+        evm = evm_series.summary() if evm_series else {}
+        progress_percentage = evm.get('percent_complete', 0)
 
         overdue_tasks = 0
         
@@ -96,6 +99,8 @@ def get_project_summary(project_id):
         
         return jsonify({
             'progress_percentage': progress_percentage,
+            'spi': evm.get('spi'),
+            'cpi': evm.get('cpi'),
             'tasks_total': total_requests,
             'tasks_completed': completed_requests,
             'tasks_verified': completed_requests,
@@ -3,6 +3,7 @@ from flask import Blueprint, request, jsonify
 from models import db, Project, Document, Material, MaterialDelivery, MaterialDeliveryItem
 from auth import token_required, role_required
 from datetime import datetime
+from upload_store import release_upload
 import os
 
 delivery_bp = Blueprint('delivery_bp', __name__)
@@ -106,6 +107,9 @@ def delete_material_delivery(delivery_id):
         if document_id:
             document = Document.query.get(document_id)
             if document:
+                if document_file_path and release_upload(document_file_path):
+                    # Файл хранилища удаляется сборщиком, когда на него не останется ссылок
+                    document_file_path = None
                 db.session.delete(document)
                 print(f"[Delete Delivery] Документ {document_id} помечен на удаление")
         
@@ -2,6 +2,8 @@ from flask import Blueprint, request, jsonify
 from models import db, Document, Project
 from auth import token_required, role_required
 from project_access import require_project_access
+from upload_store import store_upload
+from upload_previews import send_upload
 import uuid
 
 document_bp = Blueprint('document', __name__)
@@ -41,9 +43,6 @@ def update_document(document_id):
     return jsonify(doc.to_dict())
 
 
-import os
-from flask import current_app
-
 @document_bp.route('/api/documents/upload', methods=['POST'])
 @token_required
 def upload_document():
@@ -51,9 +50,9 @@ def upload_document():
     Загружает документ в систему.
 
     Принимает файл и метаданные (project_id, file_type, linked_entity_id)
-    из multipart/form-data запроса. Генерирует уникальный идентификатор для файла,
-    сохраняет его в папку 'uploads', сохраняет информацию о документе в базе данных 
-    и возвращает словарь с данными нового документа.
+    из multipart/form-data запроса. Файл сохраняется в хранилище по содержимому
+    (повторная загрузка того же файла не занимает места), информация о документе -
+    в базе данных. Возвращает словарь с данными нового документа.
     """
     if 'file' not in request.files:
         return jsonify({'message': 'Файл не найден в запросе'}), 400
@@ -69,19 +68,10 @@ def upload_document():
     if not project_id or not file_type:
         return jsonify({'message': 'Требуются поля формы project_id и file_type'}), 400
 
-    file_extension = file.filename.rsplit('.', 1)[1].lower()
     file_id = str(uuid.uuid4())
-    filename = f"{file_id}.{file_extension}"
-    
-    upload_folder = os.path.join(current_app.root_path, 'uploads')
-    if not os.path.exists(upload_folder):
-        os.makedirs(upload_folder)
-    file_path = os.path.join(upload_folder, filename)
-    
-    try:
-        file.save(file_path)
 
-        file_url = f"/uploads/{filename}"
+    try:
+        file_url = store_upload(file).url
 
         new_doc = Document(
             id=file_id,
@@ -99,8 +89,6 @@ def upload_document():
 
     except Exception as e:
         db.session.rollback()
-        if os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({'message': 'Ошибка сохранения документа', 'error': str(e)}), 500
 
 @document_bp.route('/api/documents/recognize', methods=['POST'])
@@ -120,22 +108,13 @@ def recognize_document():
     
     return jsonify({'recognition_task_id': recognition_task_id}), 202
 
-from flask import Blueprint, request, jsonify, current_app, send_from_directory
-import os
-
 @document_bp.route('/api/documents/<string:document_id>/file', methods=['GET'])
 @token_required
 def get_document_file(document_id):
-    """Отдает файл документа по его ID."""
+    """Отдает файл документа по его ID (?variant=thumb|preview - превью первой страницы)."""
     doc = db.get_or_404(Document, document_id)
 
-    filename = os.path.basename(doc.url)
-    upload_folder = os.path.join(current_app.root_path, 'uploads')
-
-    if not os.path.exists(os.path.join(upload_folder, filename)):
-        return jsonify({'message': 'Файл не найден на сервере'}), 404
-
-    return send_from_directory(upload_folder, filename)
+    return send_upload(doc.url, request.args.get('variant'), private=True)
 
 
 @document_bp.route('/api/documents/recognize/<task_id>', methods=['GET'])
@@ -0,0 +1,129 @@
+import copy
+import io
+import os
+import re
+import threading
+from docx import Document
+from docx.oxml.ns import qn
+from docx.text.run import Run
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+PLACEHOLDER_PATTERN = re.compile(r'\{\{([A-Z0-9_]+)\}\}')
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def _element_path(root, element):
+    """Путь от корня документа до элемента в виде индексов дочерних элементов."""
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    return tuple(reversed(path))
+
+
+def _merge_split_placeholders(paragraph):
+    """
+    Word может разбить {{KEY}} на несколько runs (правка, проверка орфографии).
+    Такие runs склеиваются в первый, чтобы каждый заполнитель целиком находился в одном run.
+    """
+    runs = paragraph.findall(qn('w:r'))
+    texts = [Run(r, None).text for r in runs]
+    offsets, position = [], 0
+    for text in texts:
+        offsets.append(position)
+        position += len(text)
+
+    def run_at(offset):
+        index = 0
+        while index + 1 < len(offsets) and offsets[index + 1] <= offset:
+            index += 1
+        return index
+
+    for match in reversed(list(PLACEHOLDER_PATTERN.finditer(''.join(texts)))):
+        first, last = run_at(match.start()), run_at(match.end() - 1)
+        if first != last:
+            Run(runs[first], None).text = ''.join(texts[first:last + 1])
+            for index in range(first + 1, last + 1):
+                Run(runs[index], None).text = ''
+            texts[first:last + 1] = [''.join(texts[first:last + 1])] + [''] * (last - first)
+
+
+def _substitute(match, values):
+    if match.group(1) not in values:
+        return match.group(0)
+    value = values[match.group(1)]
+    return '' if value is None else str(value)
+
+
+class CompiledDocxTemplate:
+    """
+    Разобранный шаблон DOCX с заранее найденными заполнителями {{KEY}}.
+    Каждый рендер работает с глубокой копией документа: шаблон разбирается один раз,
+    а заполнение сводится к подстановке текста в известные runs.
+    """
+
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.document = Document(path)
+        root = self.document.element
+        self.placeholders = []
+        for paragraph in root.body.iter(qn('w:p')):
+            _merge_split_placeholders(paragraph)
+            for run in paragraph.findall(qn('w:r')):
+                text = Run(run, None).text
+                if PLACEHOLDER_PATTERN.search(text):
+                    self.placeholders.append((_element_path(root, run), text))
+
+    @property
+    def keys(self):
+        return sorted({key for _, text in self.placeholders for key in PLACEHOLDER_PATTERN.findall(text)})
+
+    def render(self, values):
+        """
+        Возвращает новый документ (python-docx Document) с подставленными значениями.
+        Неизвестные заполнители остаются в тексте без изменений.
+        """
+        document = copy.deepcopy(self.document)
+        root = document.element
+        for path, text in self.placeholders:
+            run = root
+            for index in path:
+                run = run[index]
+            Run(run, None).text = PLACEHOLDER_PATTERN.sub(lambda match: _substitute(match, values), text)
+        return document
+
+
+def get_template(name):
+    """
+    Скомпилированный шаблон из кэша процесса. Шаблон перекомпилируется,
+    если файл изменен (по mtime). Выбрасывает FileNotFoundError, если файла нет.
+    """
+    path = name if os.path.isabs(name) else os.path.join(TEMPLATES_DIR, name)
+    mtime = os.stat(path).st_mtime_ns
+
+    with _templates_lock:
+        template = _templates.get(path)
+    if template is not None and template.mtime == mtime:
+        return template
+
+    template = CompiledDocxTemplate(path, mtime)
+    with _templates_lock:
+        _templates[path] = template
+    return template
+
+
+def render_docx(name, values):
+    """Заполняет шаблон значениями и возвращает документ для дальнейшего заполнения."""
+    return get_template(name).render(values)
+
+
+def serialize_docx(document):
+    """Сохраняет документ в BytesIO, готовый к отправке через send_file."""
+    output = io.BytesIO()
+    document.save(output)
+    output.seek(0)
+    return output
@@ -0,0 +1,270 @@
+import threading
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy import func
+from models import db, Project, Task, WorkPlan, WorkPlanItem, RequiredMaterial, ConsumptionLog
+from progress_service import COMPLETED_TASK_STATUSES
+from work_calendar import get_project_calendar
+
+_evm_cache = {}
+_evm_cache_lock = threading.Lock()
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _safe_ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator else None
+
+
+class EarnedValueSeries:
+    """
+    Дневные ряды освоенного объема проекта (накопительным итогом).
+    pv - плановый объем (базовый план), ev - освоенный объем, ac - фактические затраты.
+    Все ряды рассчитываются матрично по пунктам плана и дням одним проходом NumPy.
+    """
+
+    def __init__(self, project_id, fingerprint, start_date, as_of, dates_count, bac, pv, ev, ac, plan_end):
+        self.project_id = project_id
+        self.fingerprint = fingerprint
+        self.start_date = start_date
+        self.as_of = as_of
+        self.dates_count = dates_count
+        self.bac = bac
+        self.pv = pv
+        self.ev = ev
+        self.ac = ac
+        self.plan_end = plan_end
+
+    def day_index(self, day):
+        return min(max((day - self.start_date).days, 0), self.dates_count - 1)
+
+    def summary(self, day=None):
+        """Показатели EVM на дату (по умолчанию - на дату расчета)."""
+        day = min(day or self.as_of, self.as_of)
+        index = self.day_index(day)
+        pv, ev, ac = float(self.pv[index]), float(self.ev[index]), float(self.ac[index])
+        spi = _safe_ratio(ev, pv)
+        cpi = _safe_ratio(ev, ac)
+        eac = self.bac / cpi if cpi else None
+        return {
+            'project_id': self.project_id,
+            'as_of': day.isoformat(),
+            'bac': round(self.bac, 4),
+            'pv': round(pv, 4),
+            'ev': round(ev, 4),
+            'ac': round(ac, 4),
+            'sv': round(ev - pv, 4),
+            'cv': round(ev - ac, 4),
+            'spi': round(spi, 4) if spi is not None else None,
+            'cpi': round(cpi, 4) if cpi is not None else None,
+            'eac': round(eac, 4) if eac is not None else None,
+            'etc': round(eac - ac, 4) if eac is not None else None,
+            'vac': round(self.bac - eac, 4) if eac is not None else None,
+            'percent_planned': round(pv / self.bac * 100.0, 2) if self.bac else 0.0,
+            'percent_complete': round(ev / self.bac * 100.0, 2) if self.bac else 0.0
+        }
+
+    def s_curve(self):
+        """
+        S-кривая: базовый план на весь срок проекта и фактические кривые EV/AC до даты расчета.
+        """
+        baseline_end = self.day_index(self.plan_end)
+        actual_end = self.day_index(self.as_of)
+        dates = [(self.start_date + timedelta(days=i)).isoformat() for i in range(self.dates_count)]
+        return {
+            'project_id': self.project_id,
+            'as_of': self.as_of.isoformat(),
+            'bac': round(self.bac, 4),
+            'baseline': [
+                {'date': dates[i], 'pv': round(float(self.pv[i]), 4)}
+                for i in range(baseline_end + 1)
+            ],
+            'actual': [
+                {'date': dates[i], 'ev': round(float(self.ev[i]), 4), 'ac': round(float(self.ac[i]), 4)}
+                for i in range(actual_end + 1)
+            ]
+        }
+
+
+def _project_fingerprint(project_id, calendar, as_of):
+    """
+    Признак актуальности расчета: ревизия графика, отметки изменения пунктов плана,
+    агрегаты счетчиков задач и журнал расхода. Любое изменение исходных данных меняет его.
+    """
+    items = db.session.query(
+        Project.schedule_revision,
+        func.count(WorkPlanItem.id),
+        func.max(WorkPlanItem.updated_at),
+        func.sum(WorkPlanItem.actual_quantity_total),
+        func.sum(WorkPlanItem.tasks_completed)
+    ).select_from(Project) \
+     .outerjoin(WorkPlan, WorkPlan.project_id == Project.id) \
+     .outerjoin(WorkPlanItem, WorkPlanItem.work_plan_id == WorkPlan.id) \
+     .filter(Project.id == project_id) \
+     .group_by(Project.schedule_revision).first()
+    if items is None:
+        return None
+
+    logs = db.session.query(
+        func.count(ConsumptionLog.id),
+        func.max(ConsumptionLog.id),
+        func.sum(ConsumptionLog.quantity_used)
+    ).join(WorkPlanItem, ConsumptionLog.work_item_id == WorkPlanItem.id) \
+     .join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id) \
+     .filter(WorkPlan.project_id == project_id).one()
+
+    return (tuple(items), tuple(logs), calendar.calendar_id, calendar.revision, as_of)
+
+
+def _item_budgets(budgets):
+    """
+    Бюджет по завершении (BAC) по пунктам плана. Пункты без заданного бюджета
+    получают средний бюджет остальных, а если бюджеты не заданы вовсе - равные веса.
+    """
+    budgets = np.array([np.nan if b is None else float(b) for b in budgets], dtype=float)
+    known = budgets[~np.isnan(budgets)]
+    fill = known.mean() if known.size else 1.0
+    return np.where(np.isnan(budgets), fill, budgets)
+
+
+def _build_series(project_id, fingerprint, calendar, as_of):
+    items = db.session.query(
+        WorkPlanItem.id, WorkPlanItem.start_date, WorkPlanItem.end_date,
+        WorkPlanItem.quantity, WorkPlanItem.tasks_total, WorkPlanItem.budget
+    ).join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id) \
+     .filter(WorkPlan.project_id == project_id) \
+     .order_by(WorkPlanItem.order, WorkPlanItem.id).all()
+    if not items:
+        return None
+
+    row_of = {item.id: row for row, item in enumerate(items)}
+    start_date = min(item.start_date for item in items)
+    plan_end = max(item.end_date for item in items)
+    end_date = max(plan_end, as_of)
+    days = (end_date - start_date).days + 1
+    item_count = len(items)
+
+    bac = _item_budgets([item.budget for item in items])
+    starts = np.array([(item.start_date - start_date).days for item in items])
+    ends = np.array([(item.end_date - start_date).days for item in items])
+
+    # PV: линейное распределение бюджета пункта по рабочим дням его периода
+    cumulative = calendar.cumulative_working_days(start_date, end_date).astype(float)
+    working_total = cumulative[ends + 1] - cumulative[starts]
+    done = np.clip(cumulative[None, 1:] - cumulative[starts][:, None], 0.0, working_total[:, None])
+    day_axis = np.arange(days)[None, :]
+    planned_fraction = np.where(
+        working_total[:, None] > 0,
+        done / np.where(working_total > 0, working_total, 1.0)[:, None],
+        (day_axis >= ends[:, None]).astype(float)
+    )
+    pv = (bac[:, None] * planned_fraction).sum(axis=0)
+
+    # EV: доля выполненного объема по выполненным задачам; если объем не фиксируется - доля задач
+    completed = db.session.query(
+        Task.work_plan_item_id,
+        func.coalesce(Task.completed_at, Task.end_date).label('completed_at'),
+        Task.actual_quantity
+    ).join(WorkPlanItem, Task.work_plan_item_id == WorkPlanItem.id) \
+     .join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id) \
+     .filter(
+        WorkPlan.project_id == project_id,
+        Task.status.in_(COMPLETED_TASK_STATUSES)
+    ).all()
+
+    quantity_by_day = np.zeros((item_count, days))
+    tasks_by_day = np.zeros((item_count, days))
+    if completed:
+        rows = np.array([row_of[task.work_plan_item_id] for task in completed])
+        cols = np.clip([(_as_date(task.completed_at) - start_date).days for task in completed], 0, days - 1)
+        np.add.at(quantity_by_day, (rows, cols), [float(task.actual_quantity or 0.0) for task in completed])
+        np.add.at(tasks_by_day, (rows, cols), 1.0)
+
+    quantity = np.array([float(item.quantity or 0.0) for item in items])
+    tasks_total = np.array([float(item.tasks_total or 0) for item in items])
+    quantity_done = np.cumsum(quantity_by_day, axis=1)
+    tasks_done = np.cumsum(tasks_by_day, axis=1)
+    by_quantity = (quantity > 0) & (quantity_done[:, -1] > 0)
+    earned_fraction = np.where(
+        by_quantity[:, None],
+        quantity_done / np.where(quantity > 0, quantity, 1.0)[:, None],
+        tasks_done / np.where(tasks_total > 0, tasks_total, 1.0)[:, None]
+    )
+    earned = bac[:, None] * np.clip(earned_fraction, 0.0, 1.0)
+    ev = earned.sum(axis=0)
+
+    # AC: расход материалов относительно плановой потребности пункта
+    required = db.session.query(
+        RequiredMaterial.work_item_id, RequiredMaterial.material_id, RequiredMaterial.planned_quantity
+    ).filter(RequiredMaterial.work_item_id.in_(row_of)).all()
+    planned_material = {
+        (req.work_item_id, req.material_id): float(req.planned_quantity)
+        for req in required if req.planned_quantity
+    }
+    materials_count = np.zeros(item_count)
+    for work_item_id, _ in planned_material:
+        materials_count[row_of[work_item_id]] += 1
+
+    logs = db.session.query(
+        ConsumptionLog.work_item_id, ConsumptionLog.material_id,
+        ConsumptionLog.consumption_date, ConsumptionLog.quantity_used
+    ).filter(ConsumptionLog.work_item_id.in_(row_of)).all()
+
+    spent_by_day = np.zeros((item_count, days))
+    logs = [log for log in logs if (log.work_item_id, log.material_id) in planned_material]
+    if logs:
+        rows = np.array([row_of[log.work_item_id] for log in logs])
+        cols = np.clip([(_as_date(log.consumption_date) - start_date).days for log in logs], 0, days - 1)
+        shares = [
+            float(log.quantity_used) / planned_material[(log.work_item_id, log.material_id)]
+            for log in logs
+        ]
+        np.add.at(spent_by_day, (rows, cols), shares)
+
+    spent_fraction = np.cumsum(spent_by_day, axis=1) / np.where(materials_count > 0, materials_count, 1.0)[:, None]
+    # Для пунктов без плановой потребности в материалах затраты принимаются равными освоенному объему
+    actual = np.where(materials_count[:, None] > 0, bac[:, None] * spent_fraction, earned)
+    ac = actual.sum(axis=0)
+
+    return EarnedValueSeries(
+        project_id=project_id,
+        fingerprint=fingerprint,
+        start_date=start_date,
+        as_of=as_of,
+        dates_count=days,
+        bac=float(bac.sum()),
+        pv=pv,
+        ev=ev,
+        ac=ac,
+        plan_end=plan_end
+    )
+
+
+def get_project_evm(project_id, as_of=None):
+    """
+    Возвращает ряды EVM проекта из кэша процесса.
+    Ряды пересчитываются только при изменении исходных данных проекта или даты расчета.
+    Возвращает None, если у проекта нет плана работ.
+    """
+    as_of = as_of or date.today()
+    calendar = get_project_calendar(project_id)
+    fingerprint = _project_fingerprint(project_id, calendar, as_of)
+    if fingerprint is None:
+        return None
+
+    with _evm_cache_lock:
+        cached = _evm_cache.get(project_id)
+    if cached is not None and cached.fingerprint == fingerprint:
+        return cached
+
+    series = _build_series(project_id, fingerprint, calendar, as_of)
+    if series is not None:
+        with _evm_cache_lock:
+            _evm_cache[project_id] = series
+    return series
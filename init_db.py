@@ -24,6 +24,8 @@ load_dotenv()
 from main import create_app
 from models import db, User, Project, ProjectUser, Classifier, Task, Issue, Checklist, ChecklistItem, ChecklistCompletion, ChecklistItemResponse, WorkPlan, WorkPlanItem, Material, RequiredMaterial, MaterialDelivery, MaterialDeliveryItem
 from auth import hash_password
+from progress_service import reconcile_work_item_counters
+from compliance_service import reconcile_compliance_rollups
 
 def create_fixtures():
     """
@@ -709,6 +711,11 @@ def create_fixtures():
             print(f"✓ Создано 4 фикстурных заполнения чек-листов")
 
             db.session.commit()
+
+            reconcile_work_item_counters(fix=True)
+            print("Счетчики прогресса пунктов плана работ пересчитаны.")
+            reconcile_compliance_rollups(fix=True)
+            print("Сводки соблюдения чек-листов пересчитаны.")
             print("Фикстуры успешно созданы!")
 
         except Exception as e:
@@ -5,13 +5,10 @@ from project_access import require_project_access
 from datetime import datetime, timezone
 from risk_calculator import recalculate_project_risk
 from notification_service import create_notification
-import os
-import uuid
+from upload_store import store_upload, release_uploads
 
 issue_bp = Blueprint('issue_bp', __name__)
 
-UPLOAD_FOLDER = 'uploads/issue_photos'
-
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -81,19 +78,14 @@ def resolve_issue(issue_id):
     if not photos or len(photos) == 0:
         return jsonify({'message': 'Необходимо прикрепить минимум одно фото устранения'}), 400
     
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    
     photo_urls = []
     for photo in photos:
         if photo and allowed_file(photo.filename):
-            ext = photo.filename.rsplit('.', 1)[1].lower()
-            filename = f"{uuid.uuid4()}.{ext}"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            photo.save(filepath)
-            photo_urls.append(f"issue_photos/{filename}")
+            photo_urls.append(store_upload(photo).path)
     
     if not photo_urls:
         return jsonify({'message': 'Не удалось загрузить фотографии. Проверьте формат файлов.'}), 400
+    release_uploads(issue.resolution_photos)
     
     issue.status = 'pending_verification'
     issue.resolved_by_id = request.current_user['id']
@@ -1,6 +1,6 @@
 
 import os
-from flask import Flask, send_from_directory
+from flask import Flask, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
@@ -32,6 +32,10 @@ from delivery_material_routes import delivery_material_bp
 from work_execution_routes import work_execution_bp
 from analytics_material_routes import analytics_material_bp
 from notification_routes import notification_bp
+from calendar_routes import calendar_bp
+from workplan_template_routes import workplan_template_bp
+from sync_routes import sync_bp
+from upload_previews import send_upload
 
 
 def create_app(test_config=None):
@@ -56,6 +60,9 @@ def create_app(test_config=None):
         app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'fallback-secret-key-change-me')
         app.config['CELERY_BROKER_URL'] = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
         app.config['CELERY_RESULT_BACKEND'] = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+        # Передача отдачи /uploads фронт-прокси: префикс internal location nginx или X-Sendfile
+        app.config['UPLOADS_X_ACCEL_REDIRECT'] = os.environ.get('UPLOADS_X_ACCEL_REDIRECT')
+        app.config['UPLOADS_X_SENDFILE'] = os.environ.get('UPLOADS_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
     else:
         app.config.update(test_config)
 
@@ -88,10 +95,13 @@ def create_app(test_config=None):
     app.register_blueprint(work_execution_bp)
     app.register_blueprint(analytics_material_bp)
     app.register_blueprint(notification_bp)
+    app.register_blueprint(calendar_bp)
+    app.register_blueprint(workplan_template_bp)
+    app.register_blueprint(sync_bp)
 
     @app.route('/uploads/<path:filename>')
     def serve_upload(filename):
-        return send_from_directory(os.path.join(app.root_path, 'uploads'), filename)
+        return send_upload(filename, request.args.get('variant'))
     
     return app, celery
 
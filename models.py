@@ -1,8 +1,18 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
+from sync_tracking import next_change_seq, track_changes, register_sequence_function, SYNC_SEQUENCE_NAME
 
 db = SQLAlchemy()
 
+# Последовательность номеров изменений для синхронизации мобильных клиентов (используется в PostgreSQL)
+sync_change_sequence = db.Sequence(SYNC_SEQUENCE_NAME, metadata=db.metadata)
+register_sequence_function(db.metadata)
+
+
+def change_seq_column():
+    """Номер последнего изменения строки; присваивается при каждой вставке и обновлении."""
+    return db.Column(db.BigInteger, default=next_change_seq(), onupdate=next_change_seq(), nullable=True, index=True)
+
 
 class Material(db.Model):
     """Справочник строительных материалов."""
@@ -123,9 +133,29 @@ class ChecklistItemResponse(db.Model):
         }
 
 
+class ChecklistComplianceRollup(db.Model):
+    """
+    Недельная сводка ответов по пункту чек-листа в проекте.
+    Поддерживается приращениями при сохранении и редактировании заполнений (compliance_service).
+    """
+    __tablename__ = 'checklist_compliance_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('checklist_item_id', 'project_id', 'week_start', name='uq_checklist_compliance_rollup'),
+        db.Index('ix_checklist_compliance_rollup_week', 'week_start', 'project_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    checklist_item_id = db.Column(db.Integer, db.ForeignKey('checklist_items.id', ondelete='CASCADE'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), nullable=False)
+    week_start = db.Column(db.Date, nullable=False)
+    yes_count = db.Column(db.Integer, nullable=False, default=0)
+    no_count = db.Column(db.Integer, nullable=False, default=0)
+    not_applicable_count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class ChecklistCompletion(db.Model):
     """Модель для сохранения заполненных чек-листов."""
     __tablename__ = 'checklist_completions'
+    __table_args__ = (db.UniqueConstraint('completed_by_id', 'idempotency_key', name='uq_checklist_completion_idempotency'),)
     id = db.Column(db.Integer, primary_key=True)
     checklist_id = db.Column(db.Integer, db.ForeignKey('checklists.id'), nullable=False)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
@@ -146,6 +176,13 @@ class ChecklistCompletion(db.Model):
     initialized_at = db.Column(db.DateTime, nullable=True)
     initialization_geolocation = db.Column(db.String(100), nullable=True)
     
+    # Ключ идемпотентности клиента: повторная отправка с тем же ключом возвращает уже созданное заполнение
+    idempotency_key = db.Column(db.String(100), nullable=True)
+    # Фоновая обработка после сохранения: перенос фотографий, пересчет риска, уведомления
+    processing_status = db.Column(db.String(20), nullable=False, default='completed')
+    pending_photos = db.Column(db.JSON, nullable=True)
+    change_seq = change_seq_column()
+    
     checklist = db.relationship('Checklist')
     project = db.relationship('Project')
     completed_by = db.relationship('User', foreign_keys=[completed_by_id])
@@ -170,7 +207,48 @@ class ChecklistCompletion(db.Model):
             'attached_document': self.attached_document,
             'initialization_required': self.initialization_required,
             'initialized_at': self.initialized_at.isoformat() if self.initialized_at else None,
-            'initialization_geolocation': self.initialization_geolocation
+            'initialization_geolocation': self.initialization_geolocation,
+            'processing_status': self.processing_status
+        }
+
+
+class ChecklistExport(db.Model):
+    """Фоновая выгрузка заполненных чек-листов проекта в ZIP-архив DOCX."""
+    __tablename__ = 'checklist_exports'
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False, index=True)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    checklist_id = db.Column(db.Integer, db.ForeignKey('checklists.id'), nullable=True)
+    date_from = db.Column(db.Date, nullable=True)
+    date_to = db.Column(db.Date, nullable=True)
+    include_photos = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(50), nullable=False, default='pending')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    file_path = db.Column(db.String(500), nullable=True)
+    file_size = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'requested_by_id': self.requested_by_id,
+            'checklist_id': self.checklist_id,
+            'date_from': self.date_from.isoformat() if self.date_from else None,
+            'date_to': self.date_to.isoformat() if self.date_to else None,
+            'include_photos': self.include_photos,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': round(self.processed * 100.0 / self.total, 1) if self.total else 0.0,
+            'file_size': self.file_size,
+            'download_url': f'/api/checklist-exports/{self.id}/download' if self.status == 'completed' else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
         }
 
 
@@ -211,6 +289,7 @@ class Notification(db.Model):
     link = db.Column(db.String(500), nullable=True)
     is_read = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    change_seq = change_seq_column()
     
     user = db.relationship('User', backref='notifications')
 
@@ -225,6 +304,37 @@ class Notification(db.Model):
         }
 
 
+class WorkCalendar(db.Model):
+    """
+    Производственный календарь региона или проекта.
+    weekmask - семь символов '0'/'1' начиная с понедельника (режим смен),
+    holidays - нерабочие праздничные дни, working_days - перенесенные рабочие выходные.
+    """
+    __tablename__ = 'work_calendars'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    region = db.Column(db.String(200), nullable=True)
+    weekmask = db.Column(db.String(7), nullable=False, default='1111100')
+    holidays = db.Column(db.JSON, nullable=False, default=list)
+    working_days = db.Column(db.JSON, nullable=False, default=list)
+    is_default = db.Column(db.Boolean, nullable=False, default=False)
+    revision = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'region': self.region,
+            'weekmask': self.weekmask,
+            'holidays': sorted(self.holidays or []),
+            'working_days': sorted(self.working_days or []),
+            'is_default': self.is_default,
+            'revision': self.revision,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
 class Project(db.Model):
     """Модель строительного проекта."""
     __tablename__ = 'projects'
@@ -239,6 +349,8 @@ class Project(db.Model):
     risk_score = db.Column(db.Integer, nullable=False, default=0)
     risk_level = db.Column(db.String(20), nullable=False, default='LOW')
     risk_breakdown = db.Column(db.JSON, nullable=True, default=dict)
+    schedule_revision = db.Column(db.Integer, nullable=False, default=0)
+    work_calendar_id = db.Column(db.Integer, db.ForeignKey('work_calendars.id'), nullable=True)
     
     members = db.relationship('ProjectUser', back_populates='project', cascade="all, delete-orphan")
     tasks = db.relationship('Task', back_populates='project', cascade="all, delete-orphan")
@@ -260,7 +372,8 @@ class Project(db.Model):
             'created_at': self.created_at.isoformat(),
             'risk_score': self.risk_score,
             'risk_level': self.risk_level,
-            'risk_factors': self.risk_factors
+            'risk_factors': self.risk_factors,
+            'work_calendar_id': self.work_calendar_id
         }
 
 class Task(db.Model):
@@ -281,6 +394,9 @@ class Task(db.Model):
     completion_photos = db.Column(db.JSON, nullable=True)
     completion_geolocation = db.Column(db.String(100), nullable=True)
     actual_quantity = db.Column(db.Float, nullable=True)
+    projected_start_date = db.Column(db.Date, nullable=True)
+    projected_end_date = db.Column(db.Date, nullable=True)
+    change_seq = change_seq_column()
     
     project = db.relationship('Project', back_populates='tasks')
     work_plan_item = db.relationship('WorkPlanItem')
@@ -293,6 +409,68 @@ class Task(db.Model):
                                secondaryjoin='Task.id==task_dependencies.c.depends_on_id',
                                backref='dependents')
 
+class ScheduleSimulation(db.Model):
+    """Расчет вероятностных сроков завершения плана работ методом Монте-Карло."""
+    __tablename__ = 'schedule_simulations'
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False, index=True)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    status = db.Column(db.String(50), nullable=False, default='pending')
+    iterations = db.Column(db.Integer, nullable=False)
+    iterations_done = db.Column(db.Integer, nullable=False, default=0)
+    seed = db.Column(db.Integer, nullable=True)
+    celery_task_id = db.Column(db.String(255), nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    items = db.relationship('ScheduleSimulationItem', back_populates='simulation',
+                            cascade="all, delete-orphan", order_by='ScheduleSimulationItem.id')
+
+    def to_dict(self, include_items=False):
+        result = {
+            'id': self.id,
+            'project_id': self.project_id,
+            'requested_by_id': self.requested_by_id,
+            'status': self.status,
+            'iterations': self.iterations,
+            'iterations_done': self.iterations_done,
+            'progress': round(self.iterations_done * 100.0 / self.iterations, 1) if self.iterations else 0.0,
+            'seed': self.seed,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+        if include_items:
+            result['items'] = [item.to_dict() for item in self.items]
+        return result
+
+
+class ScheduleSimulationItem(db.Model):
+    """Результат моделирования по пункту плана: процентили даты окончания и индекс критичности."""
+    __tablename__ = 'schedule_simulation_items'
+    id = db.Column(db.Integer, primary_key=True)
+    simulation_id = db.Column(db.Integer, db.ForeignKey('schedule_simulations.id'), nullable=False, index=True)
+    work_plan_item_id = db.Column(db.Integer, db.ForeignKey('work_plan_items.id', ondelete='CASCADE'), nullable=False)
+    p50_finish = db.Column(db.Date, nullable=False)
+    p80_finish = db.Column(db.Date, nullable=False)
+    p90_finish = db.Column(db.Date, nullable=False)
+    criticality_index = db.Column(db.Float, nullable=False, default=0.0)
+
+    simulation = db.relationship('ScheduleSimulation', back_populates='items')
+
+    def to_dict(self):
+        return {
+            'work_plan_item_id': self.work_plan_item_id,
+            'p50_finish': self.p50_finish.isoformat(),
+            'p80_finish': self.p80_finish.isoformat(),
+            'p90_finish': self.p90_finish.isoformat(),
+            'criticality_index': self.criticality_index
+        }
+
+
 class Document(db.Model):
     """Модель документа, прикрепленного к проекту или другой сущности."""
     __tablename__ = 'documents'
@@ -348,6 +526,7 @@ class Issue(db.Model):
     verification_comment = db.Column(db.Text, nullable=True)
     
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    change_seq = change_seq_column()
 
     project = db.relationship('Project', back_populates='issues')
     task = db.relationship('Task', backref='issues')
@@ -389,6 +568,7 @@ class DailyReport(db.Model):
     notes = db.Column(db.Text, nullable=True)
     geolocation = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    change_seq = change_seq_column()
     
     author = db.relationship('User', backref='daily_reports')
     project = db.relationship('Project', back_populates='daily_reports')
@@ -449,9 +629,12 @@ class WorkPlan(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     editing_status = db.Column(db.String(50), nullable=False, default='original')
+    revision = db.Column(db.Integer, nullable=False, default=0)
     
     project = db.relationship('Project', back_populates='work_plan')
     items = db.relationship('WorkPlanItem', back_populates='work_plan', cascade="all, delete-orphan", order_by='WorkPlanItem.order')
+    revisions = db.relationship('WorkPlanRevision', back_populates='work_plan', cascade="all, delete-orphan",
+                                passive_deletes=True, lazy='dynamic')
 
     def to_dict(self):
         return {
@@ -462,10 +645,160 @@ class WorkPlan(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'editing_status': self.editing_status,
+            'revision': self.revision,
             'items': [item.to_dict() for item in self.items]
         }
 
 
+class WorkPlanRevision(db.Model):
+    """
+    Версия плана работ: полный снимок (snapshot) или компактная дельта (delta)
+    относительно предыдущей ревизии.
+    """
+    __tablename__ = 'work_plan_revisions'
+    __table_args__ = (db.UniqueConstraint('work_plan_id', 'revision', name='uq_work_plan_revision'),)
+    id = db.Column(db.Integer, primary_key=True)
+    work_plan_id = db.Column(db.Integer, db.ForeignKey('work_plans.id', ondelete='CASCADE'), nullable=False, index=True)
+    revision = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    data = db.Column(db.JSON, nullable=False)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    work_plan = db.relationship('WorkPlan', back_populates='revisions')
+
+    def to_dict(self):
+        result = {
+            'revision': self.revision,
+            'kind': self.kind,
+            'created_by_id': self.created_by_id,
+            'created_at': self.created_at.isoformat()
+        }
+        if self.kind == 'snapshot':
+            result['items_count'] = len(self.data.get('items', {}))
+        else:
+            result['added'] = len(self.data.get('added', {}))
+            result['changed'] = len(self.data.get('changed', {}))
+            result['removed'] = len(self.data.get('removed', []))
+            result['plan_changed'] = bool(self.data.get('plan'))
+        return result
+
+
+class WorkPlanTemplate(db.Model):
+    """Шаблон плана работ: структура работ и плановых материалов для повторного использования."""
+    __tablename__ = 'work_plan_templates'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    source_project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='SET NULL'), nullable=True)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    items_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    items = db.relationship('WorkPlanTemplateItem', back_populates='template', cascade="all, delete-orphan",
+                            passive_deletes=True, order_by='WorkPlanTemplateItem.order')
+
+    def to_dict(self, include_items=False):
+        result = {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'created_by_id': self.created_by_id,
+            'source_project_id': self.source_project_id,
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat(),
+            'duration_days': (self.end_date - self.start_date).days,
+            'items_count': self.items_count,
+            'created_at': self.created_at.isoformat()
+        }
+        if include_items:
+            result['items'] = [item.to_dict() for item in self.items]
+        return result
+
+
+class WorkPlanTemplateItem(db.Model):
+    """Работа шаблона плана. Сроки хранятся в датах исходного плана и сдвигаются при применении."""
+    __tablename__ = 'work_plan_template_items'
+    id = db.Column(db.Integer, primary_key=True)
+    template_id = db.Column(db.Integer, db.ForeignKey('work_plan_templates.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = db.Column(db.String(500), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    unit = db.Column(db.String(50), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    order = db.Column(db.Integer, default=0, nullable=False)
+    budget = db.Column(db.Float, nullable=True)
+
+    template = db.relationship('WorkPlanTemplate', back_populates='items')
+    materials = db.relationship('WorkPlanTemplateMaterial', cascade="all, delete-orphan", passive_deletes=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'quantity': self.quantity,
+            'unit': self.unit,
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat(),
+            'order': self.order,
+            'budget': self.budget,
+            'materials': [
+                {'material_id': material.material_id, 'planned_quantity': material.planned_quantity}
+                for material in self.materials
+            ]
+        }
+
+
+class WorkPlanTemplateMaterial(db.Model):
+    """Плановая потребность в материале для работы шаблона."""
+    __tablename__ = 'work_plan_template_materials'
+    id = db.Column(db.Integer, primary_key=True)
+    template_item_id = db.Column(db.Integer, db.ForeignKey('work_plan_template_items.id', ondelete='CASCADE'),
+                                 nullable=False, index=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('materials.id'), nullable=False)
+    planned_quantity = db.Column(db.Float, nullable=False)
+
+
+class WorkPlanImport(db.Model):
+    """Фоновый импорт плана работ из xlsx-файла сметы."""
+    __tablename__ = 'work_plan_imports'
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False, index=True)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    file_path = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(50), nullable=False, default='pending')
+    rows_total = db.Column(db.Integer, nullable=False, default=0)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    items_imported = db.Column(db.Integer, nullable=False, default=0)
+    materials_imported = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.JSON, nullable=False, default=list)
+    errors_count = db.Column(db.Integer, nullable=False, default=0)
+    work_plan_id = db.Column(db.Integer, db.ForeignKey('work_plans.id', ondelete='SET NULL'), nullable=True)
+    message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'status': self.status,
+            'rows_total': self.rows_total,
+            'rows_processed': self.rows_processed,
+            'progress': round(self.rows_processed * 100.0 / self.rows_total, 1) if self.rows_total else 0.0,
+            'items_imported': self.items_imported,
+            'materials_imported': self.materials_imported,
+            'errors': self.errors or [],
+            'errors_count': self.errors_count,
+            'work_plan_id': self.work_plan_id,
+            'message': self.message,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
 class WorkPlanItem(db.Model):
     """Элемент плана работ (конкретная работа)."""
     __tablename__ = 'work_plan_items'
@@ -479,20 +812,19 @@ class WorkPlanItem(db.Model):
     order = db.Column(db.Integer, default=0, nullable=False)
     status = db.Column(db.String(50), nullable=False, default='not_started')
     progress = db.Column(db.Float, nullable=False, default=0.0)
+    tasks_total = db.Column(db.Integer, nullable=False, default=0)
+    tasks_completed = db.Column(db.Integer, nullable=False, default=0)
+    actual_quantity_total = db.Column(db.Float, nullable=False, default=0.0)
+    budget = db.Column(db.Float, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    change_seq = change_seq_column()
     
     work_plan = db.relationship('WorkPlan', back_populates='items')
     required_materials = db.relationship('RequiredMaterial', back_populates='work_item', cascade="all, delete-orphan")
     consumption_logs = db.relationship('ConsumptionLog', back_populates='work_item', cascade="all, delete-orphan")
 
     def to_dict(self, include_materials=False):
-        actual_quantity = 0.0
-        tasks = Task.query.filter_by(work_plan_item_id=self.id).all()
-        for task in tasks:
-            if task.actual_quantity:
-                actual_quantity += task.actual_quantity
-        
         result = {
             'id': self.id,
             'work_plan_id': self.work_plan_id,
@@ -504,7 +836,10 @@ class WorkPlanItem(db.Model):
             'order': self.order,
             'status': self.status,
             'progress': self.progress,
-            'actual_quantity': actual_quantity,
+            'actual_quantity': self.actual_quantity_total or 0.0,
+            'tasks_total': self.tasks_total or 0,
+            'tasks_completed': self.tasks_completed or 0,
+            'budget': self.budget,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -647,3 +982,45 @@ class RiskEvent(db.Model):
             'triggering_user_id': self.triggering_user_id
         }
 
+
+class StoredBlob(db.Model):
+    """
+    Загруженный файл в хранилище по содержимому (upload_store): один файл на диске
+    для одинакового содержимого, ref_count - число ссылок на него из записей.
+    """
+    __tablename__ = 'stored_blobs'
+    __table_args__ = (db.UniqueConstraint('sha256', 'extension', name='uq_stored_blob_content'),)
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    extension = db.Column(db.String(20), nullable=False, default='')
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=1, index=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    last_referenced_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class SyncTombstone(db.Model):
+    """Журнал удалений для синхронизации: удаленная строка отслеживаемой сущности."""
+    __tablename__ = 'sync_tombstones'
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(50), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    project_id = db.Column(db.Integer, nullable=True, index=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    change_seq = change_seq_column()
+    deleted_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+def _project_scope(model):
+    return lambda ids: db.select(model.id, model.project_id, db.null()).where(model.id.in_(ids))
+
+
+track_changes(Task, 'tasks', _project_scope(Task))
+track_changes(Issue, 'issues', _project_scope(Issue))
+track_changes(DailyReport, 'daily_reports', _project_scope(DailyReport))
+track_changes(ChecklistCompletion, 'checklist_completions', _project_scope(ChecklistCompletion))
+track_changes(WorkPlanItem, 'work_plan_items', lambda ids: db.select(WorkPlanItem.id, WorkPlan.project_id, db.null())
+              .join(WorkPlan, WorkPlan.id == WorkPlanItem.work_plan_id).where(WorkPlanItem.id.in_(ids)))
+track_changes(Notification, 'notifications', lambda ids: db.select(Notification.id, db.null(), Notification.user_id)
+              .where(Notification.id.in_(ids)))
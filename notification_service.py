@@ -9,3 +9,15 @@ def create_notification(user_id, message, link=None):
     db.session.add(notification)
     db.session.commit()
     return notification
+
+
+def create_notifications(notifications):
+    """Создает несколько уведомлений одной транзакцией. Принимает список словарей user_id/message/link."""
+    objects = [
+        Notification(user_id=n['user_id'], message=n['message'], link=n.get('link'))
+        for n in notifications
+    ]
+    if objects:
+        db.session.add_all(objects)
+        db.session.commit()
+    return objects
@@ -0,0 +1,129 @@
+from sqlalchemy import func, case, update
+from models import db, Task, WorkPlanItem, WorkPlan
+
+COMPLETED_TASK_STATUSES = ('completed', 'verified')
+
+
+def _task_counter_values(status, actual_quantity):
+    """Вклад одной задачи в счетчики пункта плана: (всего, выполнено, фактический объем)."""
+    return (
+        1,
+        1 if status in COMPLETED_TASK_STATUSES else 0,
+        float(actual_quantity or 0.0)
+    )
+
+
+def apply_counter_deltas(deltas):
+    """
+    Применяет приращения счетчиков к пунктам плана работ.
+    Принимает словарь {work_plan_item_id: (tasks_delta, completed_delta, quantity_delta)}.
+    Каждый пункт обновляется одним атомарным UPDATE в текущей транзакции,
+    прогресс пересчитывается в том же выражении без COUNT-запросов.
+    """
+    for work_plan_item_id, (tasks_delta, completed_delta, quantity_delta) in deltas.items():
+        if not work_plan_item_id or not (tasks_delta or completed_delta or quantity_delta):
+            continue
+
+        new_total = WorkPlanItem.tasks_total + tasks_delta
+        new_completed = WorkPlanItem.tasks_completed + completed_delta
+
+        db.session.execute(
+            update(WorkPlanItem).where(WorkPlanItem.id == work_plan_item_id).values(
+                tasks_total=new_total,
+                tasks_completed=new_completed,
+                actual_quantity_total=WorkPlanItem.actual_quantity_total + quantity_delta,
+                progress=case((new_total > 0, new_completed * 100.0 / new_total), else_=0.0)
+            ),
+            execution_options={'synchronize_session': 'fetch'}
+        )
+
+
+def add_task_delta(deltas, work_plan_item_id, old_state=None, new_state=None):
+    """
+    Накапливает приращение счетчиков пункта плана для пакетных операций.
+    old_state/new_state - пары (status, actual_quantity); None означает создание или удаление задачи.
+    """
+    old_values = _task_counter_values(*old_state) if old_state else (0, 0, 0.0)
+    new_values = _task_counter_values(*new_state) if new_state else (0, 0, 0.0)
+    current = deltas.get(work_plan_item_id, (0, 0, 0.0))
+    deltas[work_plan_item_id] = tuple(
+        total + new - old for total, new, old in zip(current, new_values, old_values)
+    )
+    return deltas
+
+
+def on_task_created(task):
+    apply_counter_deltas({task.work_plan_item_id: _task_counter_values(task.status, task.actual_quantity)})
+
+
+def on_task_deleted(task):
+    tasks_delta, completed_delta, quantity_delta = _task_counter_values(task.status, task.actual_quantity)
+    apply_counter_deltas({task.work_plan_item_id: (-tasks_delta, -completed_delta, -quantity_delta)})
+
+
+def on_task_changed(task, old_status, old_actual_quantity):
+    """Учитывает смену статуса и/или фактического объема задачи."""
+    _, old_completed, old_quantity = _task_counter_values(old_status, old_actual_quantity)
+    _, new_completed, new_quantity = _task_counter_values(task.status, task.actual_quantity)
+    apply_counter_deltas({task.work_plan_item_id: (0, new_completed - old_completed, new_quantity - old_quantity)})
+
+
+def reconcile_work_item_counters(project_id=None, fix=False):
+    """
+    Сверяет денормализованные счетчики пунктов плана с фактическими данными задач.
+    Возвращает список расхождений; при fix=True записывает корректные значения.
+    """
+    actual = db.session.query(
+        Task.work_plan_item_id,
+        func.count(Task.id).label('tasks_total'),
+        func.sum(case((Task.status.in_(COMPLETED_TASK_STATUSES), 1), else_=0)).label('tasks_completed'),
+        func.coalesce(func.sum(Task.actual_quantity), 0.0).label('actual_quantity_total')
+    ).group_by(Task.work_plan_item_id).subquery()
+
+    query = db.session.query(
+        WorkPlanItem.id,
+        WorkPlanItem.tasks_total,
+        WorkPlanItem.tasks_completed,
+        WorkPlanItem.actual_quantity_total,
+        func.coalesce(actual.c.tasks_total, 0),
+        func.coalesce(actual.c.tasks_completed, 0),
+        func.coalesce(actual.c.actual_quantity_total, 0.0)
+    ).outerjoin(actual, actual.c.work_plan_item_id == WorkPlanItem.id)
+
+    if project_id is not None:
+        query = query.join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id) \
+                     .filter(WorkPlan.project_id == project_id)
+
+    drift = []
+    corrections = {}
+    for (item_id, stored_total, stored_completed, stored_quantity,
+         real_total, real_completed, real_quantity) in query.all():
+        real_quantity = float(real_quantity)
+        if (stored_total, stored_completed) == (real_total, real_completed) \
+                and abs(stored_quantity - real_quantity) < 1e-6:
+            continue
+
+        drift.append({
+            'work_plan_item_id': item_id,
+            'stored': {
+                'tasks_total': stored_total,
+                'tasks_completed': stored_completed,
+                'actual_quantity_total': stored_quantity
+            },
+            'actual': {
+                'tasks_total': real_total,
+                'tasks_completed': real_completed,
+                'actual_quantity_total': real_quantity
+            }
+        })
+        corrections[item_id] = (
+            real_total - stored_total,
+            real_completed - stored_completed,
+            real_quantity - stored_quantity
+        )
+
+    if fix and corrections:
+        apply_counter_deltas(corrections)
+        db.session.commit()
+
+    return drift
@@ -27,3 +27,16 @@ def require_project_access(project_id, user_id, user_role):
     if not check_project_access(project_id, user_id, user_role):
         return jsonify({'message': 'У вас нет доступа к этому проекту'}), 403
     return None
+
+def accessible_project_ids(user_id, user_role):
+    """
+    Идентификаторы проектов, доступных пользователю.
+    Возвращает None для инспекторов (доступ ко всем проектам).
+    """
+    if user_role == 'inspector':
+        return None
+
+    if user_role in ['client', 'foreman']:
+        return [row.project_id for row in ProjectUser.query.with_entities(ProjectUser.project_id).filter_by(user_id=user_id)]
+
+    return []
@@ -1,11 +1,12 @@
 from flask import Blueprint, request, jsonify
-from sqlalchemy import func
-from sqlalchemy.orm import aliased
+from datetime import datetime
+from sqlalchemy import func, cast, exists, or_, and_, String
+from sqlalchemy.orm import aliased, defer
 from geopy.geocoders import Nominatim
 from risk_calculator import recalculate_project_risk
 from geopy.exc import GeocoderQueryError, GeocoderTimedOut, GeocoderUnavailable
 
-from models import db, Project, User, ProjectUser, Task, Issue
+from models import db, Project, User, ProjectUser, Task, Issue, ChecklistCompletion
 from auth import token_required, role_required
 from project_access import require_project_access
 from risk_calculator import recalculate_project_risk
@@ -14,43 +15,101 @@ project_bp_v2 = Blueprint('project_bp_v2', __name__)
 
 geolocator = Nominatim(user_agent="shutdown-team-app")
 
+MAX_PROJECTS_PAGE_SIZE = 200
+PROJECT_SORT_FIELDS = {
+    'name': Project.name,
+    'risk_score': Project.risk_score,
+    'created_at': Project.created_at
+}
+
 @project_bp_v2.route('/api/projects', methods=['GET'])
 @token_required
 def get_projects():
-    from models import ChecklistCompletion
-    
+    """
+    Список проектов пользователя со счетчиками задач и открытых замечаний одним запросом.
+    Фильтры: `status`, `risk_level` (через запятую), `name` (подстрока без учета регистра).
+    Сортировка: `sort` (name, risk_score, created_at) и `order` (asc, desc).
+    Поддерживает keyset-пагинацию (`limit`, `cursor`), курсор следующей страницы - в заголовке `X-Next-Cursor`.
+    Контур объекта (polygon) возвращается только при `include_geometry=true`.
+    """
     current_user = request.current_user
-    
+
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    if sort not in PROJECT_SORT_FIELDS or order not in ('asc', 'desc'):
+        return jsonify({'message': f"Сортировка возможна по полям: {', '.join(PROJECT_SORT_FIELDS)} (order: asc, desc)"}), 400
+    include_geometry = request.args.get('include_geometry', '').lower() in ('1', 'true', 'yes')
+
     tasks_count_query = db.session.query(Task.project_id, func.count(Task.id).label('tasks_count')) \
         .group_by(Task.project_id).subquery()
     
     issues_count_query = db.session.query(Issue.project_id, func.count(Issue.id).label('issues_count')) \
         .filter(Issue.status == 'open').group_by(Issue.project_id).subquery()
 
+    # Чек-лист, ожидающий согласования, учитывается только если в нем есть заполненные пункты
+    items_data_text = cast(ChecklistCompletion.items_data, String)
+    has_pending_checklist = exists().where(
+        ChecklistCompletion.project_id == Project.id,
+        ChecklistCompletion.approval_status == 'pending',
+        ChecklistCompletion.items_data.isnot(None),
+        items_data_text.notin_(['[]', '{}', 'null', '""'])
+    ).label('has_pending_checklist')
+
     query = db.session.query(
         Project,
         func.coalesce(tasks_count_query.c.tasks_count, 0).label('tasks_count'),
-        func.coalesce(issues_count_query.c.issues_count, 0).label('issues_count')
+        func.coalesce(issues_count_query.c.issues_count, 0).label('issues_count'),
+        has_pending_checklist
     ).outerjoin(tasks_count_query, Project.id == tasks_count_query.c.project_id) \
      .outerjoin(issues_count_query, Project.id == issues_count_query.c.project_id)
 
+    if not include_geometry:
+        query = query.options(defer(Project.polygon))
+
     if current_user['role'] != 'inspector':
         query = query.join(ProjectUser, Project.id == ProjectUser.project_id) \
                      .filter(ProjectUser.user_id == current_user['id'])
 
-    results = query.order_by(Project.name).all()
+    for param, column in (('status', Project.status), ('risk_level', Project.risk_level)):
+        values = [value.strip() for value in request.args.get(param, '').split(',') if value.strip()]
+        if values:
+            query = query.filter(column.in_(values))
+
+    name = request.args.get('name', '').strip()
+    if name:
+        query = query.filter(func.lower(Project.name).contains(name.lower(), autoescape=True))
+
+    sort_column = PROJECT_SORT_FIELDS[sort]
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_value, cursor_id = _decode_project_cursor(cursor, sort)
+        except (ValueError, TypeError):
+            return jsonify({'message': 'Неверный формат курсора'}), 400
+        if order == 'asc':
+            query = query.filter(or_(sort_column > cursor_value, and_(sort_column == cursor_value, Project.id > cursor_id)))
+        else:
+            query = query.filter(or_(sort_column < cursor_value, and_(sort_column == cursor_value, Project.id < cursor_id)))
+
+    if order == 'asc':
+        query = query.order_by(sort_column, Project.id)
+    else:
+        query = query.order_by(sort_column.desc(), Project.id.desc())
+
+    limit = request.args.get('limit', type=int)
+    if limit:
+        limit = max(1, min(limit, MAX_PROJECTS_PAGE_SIZE))
+        results = query.limit(limit + 1).all()
+    else:
+        results = query.all()
+
+    next_cursor = None
+    if limit and len(results) > limit:
+        results = results[:limit]
+        next_cursor = _encode_project_cursor(results[-1][0], sort)
 
     projects_list = []
-    for project, tasks_count, issues_count in results:
-        pending_checklist = ChecklistCompletion.query.filter_by(
-            project_id=project.id,
-            approval_status='pending'
-        ).first()
-        
-        has_pending = False
-        if pending_checklist:
-            has_pending = bool(pending_checklist.items_data and len(pending_checklist.items_data) > 0)
-        
+    for project, tasks_count, issues_count, has_pending in results:
         project_dict = {
             'id': project.id,
             'name': project.name,
@@ -58,17 +117,37 @@ def get_projects():
             'latitude': project.latitude,
             'longitude': project.longitude,
             'status': project.status,
-            'polygon': project.polygon,
             'created_at': project.created_at.isoformat(),
             'tasks_count': tasks_count,
             'issues_count': issues_count,
-            'has_pending_checklist': has_pending,
+            'has_pending_checklist': bool(has_pending),
             'risk_score': project.risk_score,
             'risk_level': project.risk_level
         }
+        if include_geometry:
+            project_dict['polygon'] = project.polygon
         projects_list.append(project_dict)
 
-    return jsonify(projects_list), 200
+    response = jsonify(projects_list)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+
+def _encode_project_cursor(project, sort):
+    value = getattr(project, sort)
+    if sort == 'created_at':
+        value = value.isoformat()
+    return f"{project.id}_{value}"
+
+
+def _decode_project_cursor(cursor, sort):
+    project_id, value = cursor.split('_', 1)
+    if sort == 'risk_score':
+        value = int(value)
+    elif sort == 'created_at':
+        value = datetime.fromisoformat(value)
+    return value, int(project_id)
 
 @project_bp_v2.route('/api/projects', methods=['POST'])
 @token_required
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+import time
+from itertools import chain
+from flask import current_app, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import Classifier, Checklist, ChecklistItem, Material
+
+# Модель справочника -> набор данных, кэш которого сбрасывается при ее изменении
+REFERENCE_DATASETS = {
+    Classifier: 'classifiers',
+    Checklist: 'checklists',
+    ChecklistItem: 'checklists',
+    Material: 'materials'
+}
+VERSION_KEY_PREFIX = 'reference_cache:version:'
+REDIS_TIMEOUT_SECONDS = 0.5
+# После ошибки Redis повторное подключение не раньше чем через это время, чтобы не тормозить запросы
+REDIS_RETRY_SECONDS = 30
+
+_local_versions = {}
+_entries = {}
+_lock = threading.Lock()
+_redis_state = {'client': None, 'url': None, 'retry_at': 0.0}
+
+
+def _redis_client():
+    """Клиент Redis для межпроцессной инвалидации или None, если Redis не настроен или недоступен."""
+    if not has_app_context():
+        return None
+    url = current_app.config.get('REDIS_URL') or current_app.config.get('CELERY_BROKER_URL')
+    if not url or not url.startswith(('redis://', 'rediss://', 'unix://')):
+        return None
+    if _redis_state['url'] == url and _redis_state['client'] is not None:
+        return _redis_state['client']
+    if time.monotonic() < _redis_state['retry_at']:
+        return None
+    try:
+        import redis
+    except ImportError:
+        return None
+    _redis_state.update(client=redis.Redis.from_url(url, socket_timeout=REDIS_TIMEOUT_SECONDS,
+                                                    socket_connect_timeout=REDIS_TIMEOUT_SECONDS), url=url)
+    return _redis_state['client']
+
+
+def _redis_failed(error):
+    print(f"[ReferenceCache] Redis недоступен, инвалидация только в текущем процессе: {error}")
+    _redis_state.update(client=None, retry_at=time.monotonic() + REDIS_RETRY_SECONDS)
+
+
+def current_version(dataset):
+    """
+    Версия набора данных: (общий счетчик в Redis, локальный счетчик процесса).
+    Локальный счетчик гарантирует сброс кэша в процессе, выполнившем изменение, даже без Redis.
+    """
+    shared = None
+    client = _redis_client()
+    if client is not None:
+        try:
+            shared = int(client.get(VERSION_KEY_PREFIX + dataset) or 0)
+        except Exception as e:
+            _redis_failed(e)
+    return shared, _local_versions.get(dataset, 0)
+
+
+def bump_version(*datasets):
+    """Сбрасывает кэш наборов данных во всех процессах."""
+    with _lock:
+        for dataset in datasets:
+            _local_versions[dataset] = _local_versions.get(dataset, 0) + 1
+            for key in [key for key in _entries if key[0] == dataset]:
+                del _entries[key]
+    client = _redis_client()
+    if client is not None:
+        try:
+            pipeline = client.pipeline()
+            for dataset in datasets:
+                pipeline.incr(VERSION_KEY_PREFIX + dataset)
+            pipeline.execute()
+        except Exception as e:
+            _redis_failed(e)
+
+
+def cached_json_response(dataset, variant, build):
+    """
+    JSON-ответ справочника из кэша процесса со строгим ETag.
+    build() вызывается только при промахе (первый запрос или изменение справочника);
+    повторный запрос с совпадающим If-None-Match получает 304 без обращения к БД.
+    """
+    version = current_version(dataset)
+    key = (dataset, variant)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is None or entry[0] != version:
+        body = current_app.json.dumps(build()).encode('utf-8')
+        entry = (version, body, hashlib.sha256(body).hexdigest()[:32])
+        with _lock:
+            _entries[key] = entry
+
+    _, body, etag = entry
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+def _mark_changed(session, model):
+    dataset = REFERENCE_DATASETS.get(model)
+    if dataset:
+        session.info.setdefault('reference_changes', set()).add(dataset)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_changes(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        _mark_changed(session, type(obj))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_changes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None:
+            _mark_changed(orm_execute_state.session, mapper.class_)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed_changes(session):
+    changes = session.info.pop('reference_changes', None)
+    if changes:
+        bump_version(*sorted(changes))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_changes(session):
+    session.info.pop('reference_changes', None)
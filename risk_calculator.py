@@ -2,6 +2,7 @@
 from datetime import date, timedelta
 from sqlalchemy import func
 from models import db, Project, Task, Issue, DailyReport, MaterialDelivery, ChecklistCompletion, WorkPlan, RiskEvent, User, Checklist
+from work_calendar import get_project_calendar
 
 RISK_WEIGHTS = {
 
@@ -85,7 +86,13 @@ def calculate_schedule_deviation(project_id):
 
     today = date.today()
 
-    overdue_items = [item for item in work_plan.items if item.end_date < today and item.status != 'completed']
+    calendar = get_project_calendar(project_id)
+
+    overdue_items = [
+        item for item in work_plan.items
+        if item.status != 'completed'
+        and calendar.working_days_between(item.end_date + timedelta(days=1), today) > 0
+    ]
 
     
 
@@ -167,7 +174,9 @@ def calculate_missed_checklists(project_id):
 
 
 
-    total_days = (today - project_start_date).days + 1
+    calendar = get_project_calendar(project_id)
+
+    working_days = calendar.working_days_between(project_start_date, today)
 
     completions = db.session.query(ChecklistCompletion.completion_date).filter(
 
@@ -179,16 +188,12 @@ def calculate_missed_checklists(project_id):
 
     completion_dates = {comp.completion_date.date() for comp in completions}
 
+    completed_working_days = sum(
+        1 for completion_date in completion_dates
+        if project_start_date <= completion_date <= today and calendar.is_working_day(completion_date)
+    )
 
-    missed_days_count = 0
-
-    for i in range(total_days):
-
-        check_date = project_start_date + timedelta(days=i)
-
-        if check_date not in completion_dates:
-
-            missed_days_count += 1
+    missed_days_count = working_days - completed_working_days
 
 
 
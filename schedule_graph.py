@@ -0,0 +1,267 @@
+import threading
+from collections import deque
+from datetime import date
+from sqlalchemy import update
+from models import db, Project, Task, task_dependencies
+from work_calendar import get_project_calendar
+
+_graph_cache = {}
+_graph_cache_lock = threading.Lock()
+
+
+class DependencyGraph:
+    """
+    Граф зависимостей задач проекта.
+    Ребро depends_on -> task означает, что задача не может начаться раньше окончания предшественника.
+    Строится один раз на ревизию графика проекта и рабочего календаря и хранит результаты CPM-расчета.
+    """
+
+    def __init__(self, project_id, revision, tasks, edges, calendar):
+        self.project_id = project_id
+        self.revision = revision
+        self.calendar = calendar
+        self.tasks = {task['id']: task for task in tasks}
+        self.successors = {task_id: [] for task_id in self.tasks}
+        self.predecessors = {task_id: [] for task_id in self.tasks}
+
+        for task_id, depends_on_id in edges:
+            if task_id in self.tasks and depends_on_id in self.tasks:
+                self.successors[depends_on_id].append(task_id)
+                self.predecessors[task_id].append(depends_on_id)
+
+        self.order, self.cycles = self._topological_order()
+        self.position = {task_id: index for index, task_id in enumerate(self.order)}
+        self.schedule = {}
+        self.project_start = None
+        self.project_finish = None
+        if not self.cycles and self.tasks:
+            self._critical_path_method()
+
+    @property
+    def has_cycles(self):
+        return bool(self.cycles)
+
+    def _topological_order(self):
+        """Алгоритм Кана; вершины, не попавшие в порядок, принадлежат циклам."""
+        in_degree = {task_id: len(preds) for task_id, preds in self.predecessors.items()}
+        queue = deque(sorted(task_id for task_id, degree in in_degree.items() if degree == 0))
+        order = []
+
+        while queue:
+            task_id = queue.popleft()
+            order.append(task_id)
+            for successor_id in self.successors[task_id]:
+                in_degree[successor_id] -= 1
+                if in_degree[successor_id] == 0:
+                    queue.append(successor_id)
+
+        if len(order) == len(self.tasks):
+            return order, []
+
+        remaining = {task_id for task_id, degree in in_degree.items() if degree > 0}
+        return order, self._find_cycles(remaining)
+
+    def _find_cycles(self, nodes):
+        """Итеративный алгоритм Тарьяна: возвращает компоненты сильной связности длиной > 1."""
+        index_counter = 0
+        indexes, lowlinks = {}, {}
+        stack, on_stack = [], set()
+        cycles = []
+
+        for root in sorted(nodes):
+            if root in indexes:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, child_index = work.pop()
+                if child_index == 0:
+                    indexes[node] = lowlinks[node] = index_counter
+                    index_counter += 1
+                    stack.append(node)
+                    on_stack.add(node)
+
+                successors = [s for s in self.successors[node] if s in nodes]
+                recurse = False
+                for i in range(child_index, len(successors)):
+                    successor = successors[i]
+                    if successor not in indexes:
+                        work.append((node, i + 1))
+                        work.append((successor, 0))
+                        recurse = True
+                        break
+                    if successor in on_stack:
+                        lowlinks[node] = min(lowlinks[node], indexes[successor])
+                if recurse:
+                    continue
+
+                if lowlinks[node] == indexes[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        cycles.append(sorted(component))
+
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+
+        return cycles
+
+    def _critical_path_method(self):
+        """
+        Прямой и обратный проход CPM в рабочих днях от начала проекта по календарю проекта.
+        Длительность задачи - число рабочих дней между граничными датами включительно;
+        плановая дата начала задачи трактуется как ограничение «не раньше».
+        """
+        calendar = self.calendar
+        self._start_index = min(calendar.working_day_index(task['start_date']) for task in self.tasks.values())
+        self.project_start = self.to_date(0)
+        earliest_start, earliest_finish, duration = {}, {}, {}
+
+        for task_id in self.order:
+            task = self.tasks[task_id]
+            duration[task_id] = max(1, calendar.working_days_between(task['start_date'], task['end_date']))
+            start = calendar.working_day_index(task['start_date']) - self._start_index
+            for predecessor_id in self.predecessors[task_id]:
+                start = max(start, earliest_finish[predecessor_id])
+            earliest_start[task_id] = start
+            earliest_finish[task_id] = start + duration[task_id]
+
+        finish = max(earliest_finish.values())
+        latest_start, latest_finish = {}, {}
+        for task_id in reversed(self.order):
+            late_finish = finish
+            for successor_id in self.successors[task_id]:
+                late_finish = min(late_finish, latest_start[successor_id])
+            latest_finish[task_id] = late_finish
+            latest_start[task_id] = late_finish - duration[task_id]
+
+        self.project_finish = self.to_date(finish - 1)
+        for task_id in self.order:
+            slack = latest_start[task_id] - earliest_start[task_id]
+            self.schedule[task_id] = {
+                'earliest_start': earliest_start[task_id],
+                'earliest_finish': earliest_finish[task_id],
+                'latest_start': latest_start[task_id],
+                'latest_finish': latest_finish[task_id],
+                'duration': duration[task_id],
+                'total_slack': slack,
+                'is_critical': slack == 0
+            }
+
+    def to_date(self, day_offset):
+        """Дата рабочего дня с номером day_offset от начала проекта."""
+        return date.fromisoformat(str(self.calendar.working_day_dates([self._start_index + day_offset])[0]))
+
+    def critical_path(self):
+        return [task_id for task_id in self.order if self.schedule[task_id]['is_critical']]
+
+    def reaches(self, source_id, target_id):
+        """Проверяет, достижима ли target_id из source_id по цепочке последователей."""
+        if source_id == target_id:
+            return True
+        visited = {source_id}
+        queue = deque([source_id])
+        while queue:
+            for successor_id in self.successors.get(queue.popleft(), ()):
+                if successor_id == target_id:
+                    return True
+                if successor_id not in visited:
+                    visited.add(successor_id)
+                    queue.append(successor_id)
+        return False
+
+    def to_dict(self):
+        result = {
+            'project_id': self.project_id,
+            'revision': self.revision,
+            'has_cycles': self.has_cycles,
+            'cycles': self.cycles,
+            'tasks_count': len(self.tasks),
+            'edges_count': sum(len(preds) for preds in self.predecessors.values()),
+            'calendar_id': self.calendar.calendar_id,
+        }
+        if self.has_cycles or not self.tasks:
+            return result
+
+        tasks = []
+        for task_id in self.order:
+            task = self.tasks[task_id]
+            cpm = self.schedule[task_id]
+            tasks.append({
+                'id': task_id,
+                'name': task['name'],
+                'work_plan_item_id': task['work_plan_item_id'],
+                'status': task['status'],
+                'start_date': task['start_date'].isoformat(),
+                'end_date': task['end_date'].isoformat(),
+                'duration_days': cpm['duration'],
+                'earliest_start': self.to_date(cpm['earliest_start']).isoformat(),
+                'earliest_finish': self.to_date(cpm['earliest_finish'] - 1).isoformat(),
+                'latest_start': self.to_date(cpm['latest_start']).isoformat(),
+                'latest_finish': self.to_date(cpm['latest_finish'] - 1).isoformat(),
+                'total_slack_days': cpm['total_slack'],
+                'is_critical': cpm['is_critical'],
+                'depends_on': sorted(self.predecessors[task_id])
+            })
+
+        result.update({
+            'project_start': self.project_start.isoformat(),
+            'project_finish': self.project_finish.isoformat(),
+            'critical_path': self.critical_path(),
+            'tasks': tasks
+        })
+        return result
+
+
+def bump_schedule_revision(project_id):
+    """Увеличивает ревизию графика проекта в текущей транзакции, инвалидируя кэш графа."""
+    db.session.info.setdefault('schedule_revision_bumped', set()).add(project_id)
+    db.session.execute(
+        update(Project).where(Project.id == project_id)
+        .values(schedule_revision=Project.schedule_revision + 1),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def _load_graph(project_id, revision, calendar):
+    tasks = db.session.query(
+        Task.id, Task.name, Task.work_plan_item_id, Task.status, Task.start_date, Task.end_date
+    ).filter(Task.project_id == project_id).all()
+
+    edges = db.session.query(
+        task_dependencies.c.task_id, task_dependencies.c.depends_on_id
+    ).join(Task, Task.id == task_dependencies.c.task_id) \
+     .filter(Task.project_id == project_id).all()
+
+    return DependencyGraph(project_id, revision, [row._asdict() for row in tasks], edges, calendar)
+
+
+def get_project_graph(project_id):
+    """
+    Возвращает граф зависимостей проекта из кэша процесса.
+    Граф перестраивается только при изменении ревизии графика проекта или рабочего календаря
+    (get_calendar возвращает новый объект календаря после его изменения). Граф, построенный по незафиксированным изменениям текущей сессии, в кэш не попадает.
+    Возвращает None, если проект не найден.
+    """
+    revision = db.session.query(Project.schedule_revision).filter(Project.id == project_id).scalar()
+    if revision is None:
+        return None
+
+    calendar = get_project_calendar(project_id)
+    if project_id in db.session.info.get('schedule_revision_bumped', ()):
+        return _load_graph(project_id, revision, calendar)
+
+    with _graph_cache_lock:
+        cached = _graph_cache.get(project_id)
+    if cached is not None and cached.revision == revision and cached.calendar is calendar:
+        return cached
+
+    graph = _load_graph(project_id, revision, calendar)
+    with _graph_cache_lock:
+        _graph_cache[project_id] = graph
+    return graph
@@ -0,0 +1,167 @@
+import heapq
+from datetime import date
+from sqlalchemy import update
+from models import db, Task
+from progress_service import COMPLETED_TASK_STATUSES
+from schedule_graph import get_project_graph
+
+
+def _downstream_closure(graph, source_ids):
+    """Все задачи, достижимые из источников по цепочке последователей (включая сами источники)."""
+    closure = set(source_ids)
+    stack = list(source_ids)
+    while stack:
+        for successor_id in graph.successors.get(stack.pop(), ()):
+            if successor_id not in closure:
+                closure.add(successor_id)
+                stack.append(successor_id)
+    return closure
+
+
+def _effective_finish(row, today):
+    """Прогнозная дата окончания задачи без пересчета: прогноз, если есть, иначе план."""
+    if row.status in COMPLETED_TASK_STATUSES:
+        return row.end_date
+    finish = row.projected_end_date or row.end_date
+    return max(finish, today)
+
+
+def _project_dates(row, predecessor_finishes, today, calendar):
+    """
+    Пересчитывает прогнозные даты задачи по окончаниям предшественников: задача начинается
+    в следующий рабочий день после окончания последнего из них и сохраняет плановую
+    длительность в рабочих днях. Выполненные задачи не сдвигаются: их сроки уже зафиксированы.
+    """
+    if row.status in COMPLETED_TASK_STATUSES:
+        return row.start_date, row.end_date
+
+    start = row.start_date
+    for finish in predecessor_finishes:
+        start = max(start, calendar.add_working_days(finish, 1))
+    if start == row.start_date:
+        end = row.end_date
+    else:
+        duration = calendar.working_days_between(row.start_date, row.end_date)
+        end = calendar.add_working_days(start, duration - 1) if duration else start
+    return start, max(end, today)
+
+
+def propagate_schedule_slip(project_id, task_ids, graph=None, today=None):
+    """
+    Распространяет сдвиг сроков от измененных задач на зависимые.
+    Обходит только нисходящий подграф источников в топологическом порядке,
+    останавливаясь на задачах, прогноз которых не изменился.
+    Прогнозные даты сохраняются одним пакетным UPDATE в текущей транзакции.
+    Граф можно передать заранее: структура зависимостей при смене дат не меняется.
+    """
+    today = today or date.today()
+    graph = graph or get_project_graph(project_id)
+    empty_report = {'project_id': project_id, 'updated_tasks': [], 'impacted_work_plan_items': []}
+    if graph is None or graph.has_cycles:
+        return empty_report
+
+    source_ids = [task_id for task_id in task_ids if task_id in graph.position]
+    if not source_ids:
+        return empty_report
+
+    closure = _downstream_closure(graph, source_ids)
+    needed_ids = set(closure)
+    for task_id in closure:
+        needed_ids.update(graph.predecessors[task_id])
+
+    rows = {
+        row.id: row for row in db.session.query(
+            Task.id, Task.work_plan_item_id, Task.status, Task.start_date, Task.end_date,
+            Task.projected_start_date, Task.projected_end_date
+        ).filter(Task.id.in_(needed_ids)).all()
+    }
+
+    finishes = {task_id: _effective_finish(row, today) for task_id, row in rows.items()}
+    heap = [(graph.position[task_id], task_id) for task_id in set(source_ids) if task_id in rows]
+    heapq.heapify(heap)
+    queued = {task_id for _, task_id in heap}
+    sources = set(queued)
+    changes = []
+
+    while heap:
+        _, task_id = heapq.heappop(heap)
+        row = rows[task_id]
+        start, end = _project_dates(
+            row, [finishes[pred_id] for pred_id in graph.predecessors[task_id] if pred_id in finishes], today,
+            graph.calendar
+        )
+
+        current_start = row.projected_start_date or row.start_date
+        current_end = row.projected_end_date or row.end_date
+        if (start, end) == (current_start, current_end) and task_id not in sources:
+            continue
+
+        finishes[task_id] = end
+        if (start, end) != (current_start, current_end):
+            changes.append({
+                'id': task_id,
+                'projected_start_date': start,
+                'projected_end_date': end
+            })
+
+        for successor_id in graph.successors[task_id]:
+            if successor_id not in queued and successor_id in rows:
+                queued.add(successor_id)
+                heapq.heappush(heap, (graph.position[successor_id], successor_id))
+
+    if changes:
+        db.session.execute(update(Task), changes)
+
+    impacted_items = {}
+    updated_tasks = []
+    for change in changes:
+        row = rows[change['id']]
+        slip_days = (change['projected_end_date'] - row.end_date).days
+        updated_tasks.append({
+            'task_id': change['id'],
+            'work_plan_item_id': row.work_plan_item_id,
+            'projected_start_date': change['projected_start_date'].isoformat(),
+            'projected_end_date': change['projected_end_date'].isoformat(),
+            'slip_days': slip_days
+        })
+        item = impacted_items.setdefault(row.work_plan_item_id, {
+            'work_plan_item_id': row.work_plan_item_id,
+            'tasks_affected': 0,
+            'max_slip_days': 0,
+            'projected_end_date': None
+        })
+        item['tasks_affected'] += 1
+        item['max_slip_days'] = max(item['max_slip_days'], slip_days)
+        projected_end = change['projected_end_date'].isoformat()
+        if item['projected_end_date'] is None or projected_end > item['projected_end_date']:
+            item['projected_end_date'] = projected_end
+
+    return {
+        'project_id': project_id,
+        'updated_tasks': updated_tasks,
+        'impacted_work_plan_items': sorted(impacted_items.values(), key=lambda x: x['work_plan_item_id'])
+    }
+
+
+def propagate_overdue_slips(today=None):
+    """
+    Находит незавершенные задачи с истекшим сроком и распространяет их сдвиг
+    на зависимые задачи, группируя источники по проектам.
+    """
+    today = today or date.today()
+    overdue = db.session.query(Task.project_id, Task.id).filter(
+        Task.status.notin_(COMPLETED_TASK_STATUSES),
+        Task.end_date < today
+    ).all()
+
+    by_project = {}
+    for project_id, task_id in overdue:
+        by_project.setdefault(project_id, []).append(task_id)
+
+    reports = []
+    for project_id, task_ids in by_project.items():
+        report = propagate_schedule_slip(project_id, task_ids, today=today)
+        if report['updated_tasks']:
+            reports.append(report)
+    db.session.commit()
+    return reports
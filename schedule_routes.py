@@ -1,8 +1,14 @@
 
+import os
 from flask import Blueprint, request, jsonify
-from models import db, Project, Task, Material, TaskMaterial, task_dependencies
+from models import db, Project, Task, Material, TaskMaterial, ScheduleSimulation, task_dependencies
 from auth import token_required, role_required
 from datetime import datetime
+from progress_service import on_task_created, on_task_deleted
+from project_access import require_project_access
+from schedule_graph import get_project_graph, bump_schedule_revision
+from schedule_propagation import propagate_schedule_slip
+from simulation_service import DEFAULT_ITERATIONS, MAX_ITERATIONS
 
 schedule_bp = Blueprint('schedule_bp_v2', __name__)
 
@@ -26,6 +32,9 @@ def add_task_to_project(project_id):
             end_date=datetime.strptime(data['end_date'], '%Y-%m-%d').date(),
         )
         db.session.add(new_task)
+        db.session.flush()
+        on_task_created(new_task)
+        bump_schedule_revision(project.id)
         db.session.commit()
         return jsonify({'message': 'Задача успешно создана', 'task_id': new_task.id}), 201
     except (ValueError, KeyError) as e:
@@ -42,6 +51,8 @@ def get_task(task_id):
         'name': task.name,
         'start_date': task.start_date.isoformat(),
         'end_date': task.end_date.isoformat(),
+        'projected_start_date': task.projected_start_date.isoformat() if task.projected_start_date else None,
+        'projected_end_date': task.projected_end_date.isoformat() if task.projected_end_date else None,
         'status': task.status
     }
     return jsonify(task_data), 200
@@ -50,16 +61,32 @@ def get_task(task_id):
 @token_required
 @role_required('client')
 def update_task(task_id):
-    """Обновляет данные задачи (название, даты)."""
+    """
+    Обновляет данные задачи (название, даты).
+    При изменении дат пересчитывает прогнозные сроки зависимых задач
+    и возвращает затронутые пункты плана работ.
+    """
     task = Task.query.get_or_404(task_id)
     data = request.get_json()
 
     try:
+        old_dates = (task.start_date, task.end_date)
+        old_name = task.name
+        graph = get_project_graph(task.project_id)
+
         if 'name' in data: task.name = data['name']
         if 'start_date' in data: task.start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
         if 'end_date' in data: task.end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date()
+
+        schedule_impact = None
+        if task.name != old_name:
+            bump_schedule_revision(task.project_id)
+        if (task.start_date, task.end_date) != old_dates:
+            bump_schedule_revision(task.project_id)
+            schedule_impact = propagate_schedule_slip(task.project_id, [task.id], graph=graph)
+
         db.session.commit()
-        return jsonify({'message': 'Задача успешно обновлена'}), 200
+        return jsonify({'message': 'Задача успешно обновлена', 'schedule_impact': schedule_impact}), 200
     except (ValueError) as e:
         return jsonify({'message': f'Ошибка в данных: {e}'}), 400
 
@@ -69,6 +96,8 @@ def update_task(task_id):
 def delete_task(task_id):
     """Удаляет задачу."""
     task = Task.query.get_or_404(task_id)
+    on_task_deleted(task)
+    bump_schedule_revision(task.project_id)
     db.session.delete(task)
     db.session.commit()
     return jsonify({'message': 'Задача удалена'}), 200
@@ -125,10 +154,18 @@ def add_task_dependency(task_id):
     if task.id == dependency_task.id:
         return jsonify({'message': 'Задача не может зависеть от самой себя'}), 400
     
-    if dependency_task in task.dependents:
-         return jsonify({'message': 'Обнаружена циклическая зависимость'}), 400
+    if task.project_id != dependency_task.project_id:
+        return jsonify({'message': 'Зависимость возможна только между задачами одного проекта'}), 400
+
+    if dependency_task in task.dependencies:
+        return jsonify({'message': 'Зависимость уже существует'}), 409
+
+    graph = get_project_graph(task.project_id)
+    if graph.reaches(task.id, dependency_task.id):
+        return jsonify({'message': 'Обнаружена циклическая зависимость'}), 400
 
     task.dependencies.append(dependency_task)
+    bump_schedule_revision(task.project_id)
     db.session.commit()
     return jsonify({'message': 'Зависимость добавлена'}), 201
 
@@ -142,7 +179,103 @@ def remove_task_dependency(task_id, depends_on_id):
 
     if dependency_to_remove in task.dependencies:
         task.dependencies.remove(dependency_to_remove)
+        bump_schedule_revision(task.project_id)
         db.session.commit()
         return jsonify({'message': 'Зависимость удалена'}), 200
     else:
         return jsonify({'message': 'Зависимость не найдена'}), 404
+
+
+@schedule_bp.route('/api/projects/<int:project_id>/schedule/critical-path', methods=['GET'])
+@token_required
+def get_critical_path(project_id):
+    """
+    Возвращает расчет графика по зависимостям задач: топологический порядок,
+    ранние/поздние сроки, резервы времени и критический путь.
+    При наличии циклов возвращает список задач, образующих циклы.
+    """
+    current_user = request.current_user
+
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+
+    graph = get_project_graph(project_id)
+    if graph is None:
+        return jsonify({'message': 'Проект не найден'}), 404
+
+    return jsonify(graph.to_dict()), 200
+
+
+@schedule_bp.route('/api/projects/<int:project_id>/schedule/simulations', methods=['POST'])
+@token_required
+@role_required('client')
+def start_schedule_simulation(project_id):
+    """
+    Запускает фоновое моделирование сроков завершения плана работ (Монте-Карло).
+    Необязательные поля: iterations (по умолчанию 5000), seed.
+    """
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    db.get_or_404(Project, project_id)
+    data = request.get_json(silent=True) or {}
+    try:
+        iterations = int(data.get('iterations', DEFAULT_ITERATIONS))
+        seed = int(data['seed']) if data.get('seed') is not None else None
+    except (ValueError, TypeError):
+        return jsonify({'message': 'iterations и seed должны быть числами'}), 400
+    if not 1 <= iterations <= MAX_ITERATIONS:
+        return jsonify({'message': f'iterations должно быть от 1 до {MAX_ITERATIONS}'}), 400
+
+    simulation = ScheduleSimulation(
+        project_id=project_id,
+        requested_by_id=request.current_user['id'],
+        iterations=iterations,
+        seed=seed if seed is not None else int.from_bytes(os.urandom(4), 'big') >> 1,
+        status='pending'
+    )
+    db.session.add(simulation)
+    db.session.commit()
+
+    try:
+        from tasks import run_schedule_simulation_task
+        task = run_schedule_simulation_task.delay(simulation.id)
+        simulation.celery_task_id = task.id
+        db.session.commit()
+    except Exception as e:
+        simulation.status = 'failed'
+        simulation.error = str(e)
+        db.session.commit()
+        return jsonify({'message': f'Ошибка при запуске моделирования: {e}'}), 500
+
+    return jsonify({
+        'message': 'Моделирование запущено в фоновой задаче',
+        'simulation': simulation.to_dict()
+    }), 202
+
+
+@schedule_bp.route('/api/projects/<int:project_id>/schedule/simulations', methods=['GET'])
+@token_required
+def get_schedule_simulations(project_id):
+    """Возвращает историю моделирований сроков проекта (последние 20)."""
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    simulations = ScheduleSimulation.query.filter_by(project_id=project_id) \
+        .order_by(ScheduleSimulation.id.desc()).limit(20).all()
+    return jsonify([simulation.to_dict() for simulation in simulations]), 200
+
+
+@schedule_bp.route('/api/projects/<int:project_id>/schedule/simulations/<int:simulation_id>', methods=['GET'])
+@token_required
+def get_schedule_simulation(project_id, simulation_id):
+    """Статус и прогресс моделирования; для завершенного - процентили сроков по пунктам плана."""
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    simulation = ScheduleSimulation.query.filter_by(id=simulation_id, project_id=project_id).first_or_404()
+    return jsonify(simulation.to_dict(include_items=simulation.status == 'completed')), 200
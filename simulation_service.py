@@ -0,0 +1,342 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from sqlalchemy.orm import aliased
+from models import (db, Task, WorkPlan, WorkPlanItem, ScheduleSimulation, ScheduleSimulationItem,
+                    task_dependencies)
+from progress_service import COMPLETED_TASK_STATUSES
+from work_calendar import get_project_calendar
+
+DEFAULT_ITERATIONS = 5000
+MAX_ITERATIONS = 20000
+CHUNK_ITERATIONS = 1000
+# Размер задачи (итерации x пункты плана), начиная с которого расчет распределяется по процессам
+PARALLEL_THRESHOLD = 2000000
+MIN_ITEM_SAMPLES = 10
+MIN_POOL_SAMPLES = 20
+GLOBAL_SAMPLE_LIMIT = 5000
+LATENESS_RATIO_BOUNDS = (0.25, 5.0)
+# Распределение по умолчанию (треугольное), если истории выполнения задач недостаточно
+DEFAULT_LATENESS = (0.9, 1.0, 1.6)
+PERCENTILES = (10, 50, 80, 90)
+
+
+def _lateness_ratios(rows, calendar):
+    """Отношение фактической длительности задачи к плановой в рабочих днях."""
+    ratios = []
+    for row in rows:
+        completed_on = row.completed_at.date() if isinstance(row.completed_at, datetime) else row.completed_at
+        planned = max(1, calendar.working_days_between(row.start_date, row.end_date))
+        actual = max(1, calendar.working_days_between(row.start_date, completed_on))
+        ratios.append(actual / planned)
+    return np.clip(np.array(ratios, dtype=float), *LATENESS_RATIO_BOUNDS)
+
+
+def _history_query():
+    return db.session.query(
+        Task.work_plan_item_id, Task.start_date, Task.end_date, Task.completed_at
+    ).filter(
+        Task.status.in_(COMPLETED_TASK_STATUSES),
+        Task.completed_at.isnot(None)
+    )
+
+
+def _item_order(item_count, edges, planned_rank):
+    """
+    Топологический порядок пунктов плана. Зависимости между пунктами выводятся из
+    зависимостей задач и могут образовать цикл; в этом случае остаются только ребра,
+    согласованные с плановым порядком работ.
+    """
+    def kahn(edge_list):
+        successors = [[] for _ in range(item_count)]
+        in_degree = np.zeros(item_count, dtype=int)
+        for pred, succ in edge_list:
+            successors[pred].append(succ)
+            in_degree[succ] += 1
+        queue = deque(sorted((i for i in range(item_count) if in_degree[i] == 0), key=planned_rank.__getitem__))
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for succ in successors[node]:
+                in_degree[succ] -= 1
+                if in_degree[succ] == 0:
+                    queue.append(succ)
+        return order
+
+    order = kahn(edges)
+    if len(order) == item_count:
+        return order, edges
+
+    edges = [(pred, succ) for pred, succ in edges if planned_rank[pred] < planned_rank[succ]]
+    return kahn(edges), edges
+
+
+def build_simulation_model(project_id, today=None):
+    """
+    Собирает входные данные моделирования: пункты плана в рабочих днях календаря проекта,
+    связи между пунктами и выборки отношения фактической длительности к плановой.
+    Возвращает словарь из массивов NumPy, пригодный для передачи в другие процессы,
+    или None, если план работ пуст.
+    """
+    today = today or date.today()
+    calendar = get_project_calendar(project_id)
+
+    items = db.session.query(
+        WorkPlanItem.id, WorkPlanItem.start_date, WorkPlanItem.end_date,
+        WorkPlanItem.status, WorkPlanItem.progress, WorkPlanItem.order
+    ).join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id) \
+     .filter(WorkPlan.project_id == project_id) \
+     .order_by(WorkPlanItem.order, WorkPlanItem.id).all()
+    if not items:
+        return None
+
+    index_of = {item.id: index for index, item in enumerate(items)}
+    item_count = len(items)
+    today_index = calendar.working_day_index(today)
+
+    successor_task = aliased(Task)
+    predecessor_task = aliased(Task)
+    dependency_rows = db.session.query(
+        predecessor_task.work_plan_item_id, successor_task.work_plan_item_id
+    ).select_from(task_dependencies) \
+     .join(successor_task, successor_task.id == task_dependencies.c.task_id) \
+     .join(predecessor_task, predecessor_task.id == task_dependencies.c.depends_on_id) \
+     .filter(successor_task.project_id == project_id).distinct().all()
+    edges = [
+        (index_of[pred], index_of[succ]) for pred, succ in dependency_rows
+        if pred in index_of and succ in index_of and pred != succ
+    ]
+
+    planned_rank = {index: (item.start_date, item.order, item.id) for index, item in enumerate(items)}
+    order, edges = _item_order(item_count, edges, planned_rank)
+    predecessors = [[] for _ in range(item_count)]
+    for pred, succ in edges:
+        predecessors[succ].append(pred)
+
+    earliest_start = np.empty(item_count, dtype=np.int64)
+    remaining = np.empty(item_count, dtype=float)
+    fixed_finish = np.full(item_count, -1, dtype=np.int64)
+    for index, item in enumerate(items):
+        if item.status == 'completed' or (item.progress or 0) >= 100:
+            fixed_finish[index] = calendar.working_day_index(item.end_date + timedelta(days=1))
+        planned_days = max(1, calendar.working_days_between(item.start_date, item.end_date))
+        remaining[index] = max(1.0, planned_days * (1.0 - (item.progress or 0.0) / 100.0))
+        earliest_start[index] = max(calendar.working_day_index(item.start_date), today_index)
+
+    project_history = _history_query().filter(Task.project_id == project_id).all()
+    by_item = {}
+    for row in project_history:
+        by_item.setdefault(row.work_plan_item_id, []).append(row)
+
+    pools = [None]
+    fallback_pool = 0
+    project_ratios = _lateness_ratios(project_history, calendar)
+    if project_ratios.size >= MIN_POOL_SAMPLES:
+        pools.append(project_ratios)
+        fallback_pool = len(pools) - 1
+    else:
+        global_history = _history_query().order_by(Task.completed_at.desc()).limit(GLOBAL_SAMPLE_LIMIT).all()
+        global_ratios = _lateness_ratios(global_history, calendar)
+        if global_ratios.size >= MIN_POOL_SAMPLES:
+            pools.append(global_ratios)
+            fallback_pool = len(pools) - 1
+
+    pool_of = np.full(item_count, fallback_pool, dtype=np.int64)
+    for item_id, rows in by_item.items():
+        if item_id in index_of and len(rows) >= MIN_ITEM_SAMPLES:
+            pools.append(_lateness_ratios(rows, calendar))
+            pool_of[index_of[item_id]] = len(pools) - 1
+
+    return {
+        'item_ids': np.array([item.id for item in items], dtype=np.int64),
+        'order': np.array(order, dtype=np.int64),
+        'predecessors': [np.array(preds, dtype=np.int64) for preds in predecessors],
+        'earliest_start': earliest_start,
+        'remaining': remaining,
+        'fixed_finish': fixed_finish,
+        'pools': pools,
+        'pool_of': pool_of,
+        'today_index': today_index,
+        'planned_finish_index': max(calendar.working_day_index(item.end_date + timedelta(days=1)) for item in items),
+        'history_samples': int(project_ratios.size)
+    }
+
+
+def simulate_chunk(model, iterations, seed):
+    """
+    Моделирует iterations вариантов выполнения плана. Пункты плана обходятся в
+    топологическом порядке, все итерации обрабатываются одновременно векторно.
+    Возвращает номера рабочих дней окончания (исключительно) по пунктам и
+    число итераций, в которых пункт оказался на критическом пути.
+    """
+    rng = np.random.default_rng(seed)
+    item_count = len(model['item_ids'])
+    rows = np.arange(iterations)
+    finish = np.empty((iterations, item_count), dtype=np.int64)
+    driver = np.full((iterations, item_count), -1, dtype=np.int64)
+
+    for j in model['order']:
+        if model['fixed_finish'][j] >= 0:
+            finish[:, j] = model['fixed_finish'][j]
+            continue
+
+        start = np.full(iterations, model['earliest_start'][j], dtype=np.int64)
+        preds = model['predecessors'][j]
+        if preds.size:
+            pred_finish = finish[:, preds]
+            driving = pred_finish.argmax(axis=1)
+            latest = pred_finish[rows, driving]
+            is_driven = latest > start
+            start = np.where(is_driven, latest, start)
+            driver[:, j] = np.where(is_driven, preds[driving], -1)
+
+        pool = model['pools'][model['pool_of'][j]]
+        if pool is None:
+            ratios = rng.triangular(*DEFAULT_LATENESS, size=iterations)
+        else:
+            ratios = rng.choice(pool, size=iterations)
+        duration = np.maximum(1, np.ceil(model['remaining'][j] * ratios)).astype(np.int64)
+        finish[:, j] = start + duration
+
+    critical = np.zeros((iterations, item_count), dtype=bool)
+    critical[rows, finish.argmax(axis=1)] = True
+    for j in model['order'][::-1]:
+        marked = np.flatnonzero(critical[:, j] & (driver[:, j] >= 0))
+        if marked.size:
+            critical[marked, driver[marked, j]] = True
+
+    return finish.astype(np.int32), critical.sum(axis=0)
+
+
+def _chunk_sizes(total, parts):
+    base, extra = divmod(total, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts) if base + (1 if i < extra else 0)]
+
+
+def run_simulation(model, iterations, seed, progress_callback=None, workers=None):
+    """
+    Выполняет моделирование частями. Для больших планов части считаются в пуле процессов;
+    если пул недоступен (например, внутри демонизированного воркера), расчет идет в текущем процессе.
+    progress_callback(iterations_done) вызывается после каждой части.
+    """
+    item_count = len(model['item_ids'])
+    workers = workers or int(os.environ.get('SIMULATION_WORKERS', os.cpu_count() or 1))
+    seeds = np.random.SeedSequence(seed)
+    finishes, critical_total, done = [], np.zeros(item_count, dtype=np.int64), 0
+
+    if workers > 1 and iterations * item_count >= PARALLEL_THRESHOLD:
+        sizes = _chunk_sizes(iterations, max(workers, iterations // CHUNK_ITERATIONS))
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(simulate_chunk, model, size, child): size
+                    for size, child in zip(sizes, seeds.spawn(len(sizes)))
+                }
+                for future in as_completed(futures):
+                    finish, critical = future.result()
+                    finishes.append(finish)
+                    critical_total += critical
+                    done += futures[future]
+                    if progress_callback:
+                        progress_callback(done)
+            return np.concatenate(finishes), critical_total
+        except (OSError, AssertionError, RuntimeError) as e:
+            print(f"[Simulation] Пул процессов недоступен, расчет в текущем процессе: {e}")
+            finishes, critical_total, done = [], np.zeros(item_count, dtype=np.int64), 0
+
+    sizes = _chunk_sizes(iterations, max(1, -(-iterations // CHUNK_ITERATIONS)))
+    for size, child in zip(sizes, seeds.spawn(len(sizes))):
+        finish, critical = simulate_chunk(model, size, child)
+        finishes.append(finish)
+        critical_total += critical
+        done += size
+        if progress_callback:
+            progress_callback(done)
+    return np.concatenate(finishes), critical_total
+
+
+def _to_dates(calendar, finish_indexes):
+    """Переводит исключительные номера рабочих дней окончания в даты последнего рабочего дня."""
+    return [
+        date.fromisoformat(str(day))
+        for day in calendar.working_day_dates(np.asarray(finish_indexes, dtype=np.int64) - 1)
+    ]
+
+
+def summarize_simulation(model, calendar, finish, critical_total):
+    iterations = finish.shape[0]
+    project_finish = finish.max(axis=1)
+    project_dates = _to_dates(calendar, np.percentile(project_finish, PERCENTILES, method='higher'))
+    item_dates = _to_dates(
+        calendar, np.percentile(finish, (50, 80, 90), axis=0, method='higher').ravel()
+    )
+    item_count = finish.shape[1]
+
+    items = []
+    for j, item_id in enumerate(model['item_ids']):
+        items.append({
+            'work_plan_item_id': int(item_id),
+            'p50_finish': item_dates[j],
+            'p80_finish': item_dates[item_count + j],
+            'p90_finish': item_dates[2 * item_count + j],
+            'criticality_index': round(float(critical_total[j]) / iterations, 4)
+        })
+
+    planned_finish = _to_dates(calendar, [model['planned_finish_index']])[0]
+    result = {
+        'planned_finish': planned_finish.isoformat(),
+        'mean_finish': _to_dates(calendar, [int(np.ceil(project_finish.mean()))])[0].isoformat(),
+        'on_time_probability': round(float((project_finish <= model['planned_finish_index']).mean()), 4),
+        'history_samples': model['history_samples']
+    }
+    for percentile, finish_date in zip(PERCENTILES, project_dates):
+        result[f'p{percentile}_finish'] = finish_date.isoformat()
+    return result, items
+
+
+def run_schedule_simulation(simulation_id, progress_callback=None):
+    """
+    Выполняет сохраненный запрос на моделирование и записывает результаты:
+    процентили даты окончания проекта и пунктов плана и индексы критичности.
+    """
+    simulation = db.session.get(ScheduleSimulation, simulation_id)
+    if not simulation:
+        return None
+
+    try:
+        simulation.status = 'running'
+        simulation.iterations_done = 0
+        db.session.commit()
+
+        model = build_simulation_model(simulation.project_id)
+        if model is None:
+            raise ValueError('План работ проекта пуст')
+        calendar = get_project_calendar(simulation.project_id)
+
+        def on_progress(done):
+            simulation.iterations_done = done
+            db.session.commit()
+            if progress_callback:
+                progress_callback(done, simulation.iterations)
+
+        finish, critical_total = run_simulation(model, simulation.iterations, simulation.seed, on_progress)
+        result, items = summarize_simulation(model, calendar, finish, critical_total)
+
+        ScheduleSimulationItem.query.filter_by(simulation_id=simulation.id).delete()
+        db.session.add_all(ScheduleSimulationItem(simulation_id=simulation.id, **item) for item in items)
+        simulation.result = result
+        simulation.status = 'completed'
+        simulation.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        simulation = db.session.get(ScheduleSimulation, simulation_id)
+        simulation.status = 'failed'
+        simulation.error = str(e)
+        simulation.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+    return simulation
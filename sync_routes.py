@@ -0,0 +1,47 @@
+from flask import Blueprint, request, jsonify
+from auth import token_required
+from sync_service import sync_changes, SyncError, SYNC_ENTITIES, DEFAULT_SYNC_LIMIT
+
+sync_bp = Blueprint('sync_bp', __name__)
+
+
+@sync_bp.route('/api/sync', methods=['POST'])
+@token_required
+def sync():
+    """
+    Дельта-синхронизация для офлайн-клиентов.
+    Тело: cursors ({сущность: курсор} из предыдущего ответа), entities (по умолчанию все), limit.
+    Для каждой сущности возвращаются созданные/измененные строки (changed), id удаленных (deleted),
+    новый курсор и has_more (повторить запрос с новым курсором, чтобы дочитать изменения).
+    """
+    current_user = request.current_user
+    data = request.get_json(silent=True) or {}
+
+    try:
+        result = sync_changes(current_user['id'], current_user['role'], data.get('cursors') or {},
+                              entities=data.get('entities'), limit=data.get('limit', DEFAULT_SYNC_LIMIT))
+    except SyncError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify({'entities': result}), 200
+
+
+@sync_bp.route('/api/sync', methods=['GET'])
+@token_required
+def sync_query():
+    """
+    То же, что POST /api/sync, с курсорами в параметрах запроса: ?tasks=120&issues=98&limit=500.
+    Параметр entities (через запятую) ограничивает набор сущностей.
+    """
+    current_user = request.current_user
+    entities_param = request.args.get('entities')
+    entities = [entity.strip() for entity in entities_param.split(',') if entity.strip()] if entities_param else None
+    cursors = {entity: request.args[entity] for entity in SYNC_ENTITIES if entity in request.args}
+
+    try:
+        result = sync_changes(current_user['id'], current_user['role'], cursors, entities=entities,
+                              limit=request.args.get('limit', DEFAULT_SYNC_LIMIT))
+    except SyncError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify({'entities': result}), 200
@@ -0,0 +1,183 @@
+from sqlalchemy import func, select
+from models import db, Task, Issue, DailyReport, ChecklistCompletion, WorkPlan, WorkPlanItem, Notification, \
+    SyncTombstone
+from project_access import accessible_project_ids
+from sync_tracking import safe_change_seq
+
+DEFAULT_SYNC_LIMIT = 500
+MAX_SYNC_LIMIT = 2000
+TASK_SYNC_FIELDS = (
+    'id', 'project_id', 'work_plan_item_id', 'name', 'status', 'start_date', 'end_date', 'completed_at',
+    'completion_comment', 'completion_photos', 'actual_quantity', 'projected_start_date', 'projected_end_date'
+)
+
+
+class SyncError(ValueError):
+    """Некорректный запрос синхронизации (ответ 400)."""
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _task_dict(task):
+    result = {}
+    for field in TASK_SYNC_FIELDS:
+        value = getattr(task, field)
+        if field == 'completion_photos':
+            value = value or []
+        elif field in ('start_date', 'end_date', 'completed_at', 'projected_start_date', 'projected_end_date'):
+            value = _isoformat(value)
+        result[field] = value
+    return result
+
+
+def _daily_report_dict(report):
+    return {
+        'id': report.id,
+        'project_id': report.project_id,
+        'author_id': report.author_id,
+        'report_date': _isoformat(report.report_date),
+        'notes': report.notes,
+        'equipment': report.equipment,
+        'weather_conditions': report.weather_conditions,
+        'workers_count': report.workers_count,
+        'geolocation': report.geolocation,
+        'created_at': _isoformat(report.created_at)
+    }
+
+
+def _work_plan_item_dict(item, project_id):
+    return {**item.to_dict(), 'project_id': project_id}
+
+
+def _project_filter(column):
+    return lambda scope: column.in_(scope['project_ids']) if scope['project_ids'] is not None else None
+
+
+# Сущность -> (модель, условие области видимости, сериализатор)
+SYNC_ENTITIES = {
+    'tasks': (Task, _project_filter(Task.project_id), _task_dict),
+    'issues': (Issue, _project_filter(Issue.project_id), Issue.to_dict),
+    'daily_reports': (DailyReport, _project_filter(DailyReport.project_id), _daily_report_dict),
+    'checklist_completions': (ChecklistCompletion, _project_filter(ChecklistCompletion.project_id),
+                              ChecklistCompletion.to_dict),
+    'work_plan_items': (WorkPlanItem, _project_filter(WorkPlan.project_id), _work_plan_item_dict),
+    'notifications': (Notification, lambda scope: Notification.user_id == scope['user_id'], Notification.to_dict)
+}
+
+
+def _rows_query(entity, scope):
+    model, scope_filter, _ = SYNC_ENTITIES[entity]
+    if model is WorkPlanItem:
+        query = select(WorkPlanItem, WorkPlan.project_id).join(WorkPlan, WorkPlan.id == WorkPlanItem.work_plan_id)
+    else:
+        query = select(model)
+    condition = scope_filter(scope)
+    if condition is not None:
+        query = query.where(condition)
+    return query
+
+
+def _tombstones_query(entity, scope):
+    query = select(SyncTombstone.entity_id, SyncTombstone.change_seq).where(SyncTombstone.entity == entity)
+    if entity == 'notifications':
+        return query.where(SyncTombstone.user_id == scope['user_id'])
+    if scope['project_ids'] is not None:
+        query = query.where(SyncTombstone.project_id.in_(scope['project_ids']))
+    return query
+
+
+def _fetch_changes(entity, scope, seq_condition, limit=None):
+    """Измененные строки и удаления сущности в порядке change_seq: список (seq, 'changed'|'deleted', данные)."""
+    model, _, serializer = SYNC_ENTITIES[entity]
+
+    rows_query = _rows_query(entity, scope).where(seq_condition(model.change_seq))
+    tombstones_query = _tombstones_query(entity, scope).where(seq_condition(SyncTombstone.change_seq))
+    if scope['safe_seq'] is not None:
+        # Изменения после номера, который еще может занять незавершенная транзакция, придут следующим запросом
+        rows_query = rows_query.where(model.change_seq <= scope['safe_seq'])
+        tombstones_query = tombstones_query.where(SyncTombstone.change_seq <= scope['safe_seq'])
+    rows_query = rows_query.order_by(model.change_seq, model.id)
+    tombstones_query = tombstones_query.order_by(SyncTombstone.change_seq, SyncTombstone.id)
+    if limit is not None:
+        rows_query = rows_query.limit(limit)
+        tombstones_query = tombstones_query.limit(limit)
+
+    changes = []
+    for row in db.session.execute(rows_query):
+        obj = row[0]
+        data = serializer(obj, row[1]) if model is WorkPlanItem else serializer(obj)
+        changes.append((obj.change_seq, 'changed', data))
+    for entity_id, change_seq in db.session.execute(tombstones_query):
+        changes.append((change_seq, 'deleted', entity_id))
+    changes.sort(key=lambda change: change[0])
+    return changes
+
+
+def _full_sync(entity, scope):
+    """Первичная синхронизация: все видимые строки без журнала удалений, курсор - текущий максимум."""
+    model, _, serializer = SYNC_ENTITIES[entity]
+    # Курсор берется до чтения строк: изменения, записанные во время выгрузки, придут следующим запросом
+    cursor = max(db.session.query(func.max(model.change_seq)).scalar() or 0,
+                 db.session.query(func.max(SyncTombstone.change_seq)).scalar() or 0)
+    if scope['safe_seq'] is not None:
+        # Строки с номерами выше границы повторно придут инкрементальной синхронизацией
+        cursor = min(cursor, scope['safe_seq'])
+    changed = []
+    for row in db.session.execute(_rows_query(entity, scope).order_by(model.id)):
+        changed.append(serializer(row[0], row[1]) if model is WorkPlanItem else serializer(row[0]))
+    return {'changed': changed, 'deleted': [], 'cursor': cursor, 'has_more': False}
+
+
+def sync_entity(entity, cursor, scope, limit=DEFAULT_SYNC_LIMIT):
+    """
+    Изменения сущности после курсора: созданные и измененные строки целиком, удаленные - по id.
+    Выборка - два диапазонных запроса по индексу change_seq (строки и журнал удалений).
+    Страница не разрывает группу строк с одинаковым change_seq (пакетное обновление),
+    поэтому следующий запрос с возвращенным курсором ничего не пропустит.
+    """
+    if not cursor:
+        return _full_sync(entity, scope)
+
+    changes = _fetch_changes(entity, scope, lambda column: column > cursor, limit=limit + 1)
+    has_more = len(changes) > limit
+    if has_more:
+        boundary = changes[limit - 1][0]
+        changes = [change for change in changes[:limit] if change[0] < boundary]
+        changes += _fetch_changes(entity, scope, lambda column: column == boundary)
+
+    return {
+        'changed': [data for _, kind, data in changes if kind == 'changed'],
+        'deleted': [data for _, kind, data in changes if kind == 'deleted'],
+        'cursor': changes[-1][0] if changes else cursor,
+        'has_more': has_more
+    }
+
+
+def sync_changes(user_id, role, cursors, entities=None, limit=DEFAULT_SYNC_LIMIT):
+    """
+    Дельта-синхронизация по сущностям. cursors - {сущность: последний полученный change_seq},
+    отсутствующий или нулевой курсор означает первичную загрузку.
+    Возвращает {сущность: {changed, deleted, cursor, has_more}}.
+    """
+    entities = list(entities or SYNC_ENTITIES)
+    unknown = [entity for entity in entities if entity not in SYNC_ENTITIES]
+    if unknown:
+        raise SyncError(f"Неизвестные сущности: {', '.join(unknown)}")
+    if not isinstance(cursors, dict):
+        raise SyncError('cursors должен быть объектом {сущность: курсор}')
+
+    try:
+        limit = min(max(int(limit), 1), MAX_SYNC_LIMIT)
+        cursors = {entity: int(cursors.get(entity) or 0) for entity in entities}
+    except (TypeError, ValueError):
+        raise SyncError('Курсоры и limit должны быть целыми числами')
+
+    scope = {
+        'user_id': user_id,
+        'project_ids': accessible_project_ids(user_id, role),
+        # Граница берется до чтения строк (см. safe_change_seq)
+        'safe_seq': safe_change_seq(db.session)
+    }
+    return {entity: sync_entity(entity, cursors[entity], scope, limit) for entity in entities}
@@ -0,0 +1,131 @@
+from sqlalchemy import DDL, BigInteger, event, insert, select, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
+
+SYNC_SEQUENCE_NAME = 'sync_change_seq'
+SYNC_SEQUENCE_FUNCTION = 'sync_next_change_seq'
+TOMBSTONES_TABLE = 'sync_tombstones'
+# Пространство ключей advisory-блокировок незафиксированных номеров изменений (старшие 16 бит ключа)
+IN_FLIGHT_LOCK_NAMESPACE = 0x5359
+IN_FLIGHT_SEQ_MASK = (1 << 48) - 1
+
+# В PostgreSQL номер выдается при записи, а не при фиксации, и транзакция с меньшим номером может
+# зафиксироваться позже. Поэтому при первом номере транзакция берет разделяемую advisory-блокировку
+# с ключом не больше своего номера (last_value + 1 до nextval); блокировка держится до конца транзакции,
+# и по pg_locks читатель находит наименьший номер, который еще может появиться (см. safe_change_seq).
+SYNC_SEQUENCE_FUNCTION_DDL = DDL(f"""
+CREATE OR REPLACE FUNCTION {SYNC_SEQUENCE_FUNCTION}() RETURNS bigint AS $$
+BEGIN
+    IF current_setting('sync.in_flight', true) IS DISTINCT FROM '1' THEN
+        PERFORM pg_advisory_xact_lock_shared(
+            ({IN_FLIGHT_LOCK_NAMESPACE}::bigint << 48) | ((SELECT last_value FROM {SYNC_SEQUENCE_NAME}) + 1)
+        );
+        PERFORM set_config('sync.in_flight', '1', true);
+    END IF;
+    RETURN nextval('{SYNC_SEQUENCE_NAME}');
+END;
+$$ LANGUAGE plpgsql
+""")
+
+# Таблицы, строки которых получают номер изменения (change_seq); заполняется в track_changes
+SYNCED_TABLES = []
+# Класс модели -> (имя сущности, функция построения запроса области видимости удаляемых строк)
+_tracked_models = {}
+
+
+class next_change_seq(FunctionElement):
+    """
+    Следующий номер изменения для синхронизации. В PostgreSQL - значение общей последовательности;
+    в остальных СУБД (SQLite сериализует запись) - максимум по всем отслеживаемым таблицам и
+    журналу удалений плюс один. Номер монотонно растет и не переиспользуется после удаления строк.
+    """
+    type = BigInteger()
+    inherit_cache = True
+    name = 'next_change_seq'
+
+
+@compiles(next_change_seq)
+def _compile_next_change_seq(element, compiler, **kw):
+    maxima = ' UNION ALL '.join(
+        f'SELECT COALESCE(MAX(change_seq), 0) AS seq FROM {table}'
+        for table in SYNCED_TABLES + [TOMBSTONES_TABLE]
+    )
+    return f'(SELECT MAX(seq) + 1 FROM ({maxima}) AS sync_sequences)'
+
+
+@compiles(next_change_seq, 'postgresql')
+def _compile_next_change_seq_postgresql(element, compiler, **kw):
+    return f"{SYNC_SEQUENCE_FUNCTION}()"
+
+
+def register_sequence_function(metadata):
+    """Создает функцию выдачи номеров изменений при create_all (только PostgreSQL)."""
+    event.listen(metadata, 'after_create', SYNC_SEQUENCE_FUNCTION_DDL.execute_if(dialect='postgresql'))
+
+
+def safe_change_seq(session):
+    """
+    Наибольший номер изменения, до которого все транзакции уже зафиксированы: курсор синхронизации
+    не должен его превышать, иначе строки незавершенных транзакций с меньшими номерами будут пропущены.
+    Для СУБД, сериализующих запись (SQLite), - None (ограничение не нужно).
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return None
+    # Сначала значение последовательности, затем блокировки: транзакция, начавшая запись позже,
+    # получит номер больше прочитанного значения
+    last_value = session.execute(text(f"SELECT last_value FROM {SYNC_SEQUENCE_NAME}")).scalar()
+    oldest_in_flight = session.execute(text("""
+        SELECT MIN(((classid::bigint << 32) | objid::bigint) & :mask)
+        FROM pg_locks
+        WHERE locktype = 'advisory' AND objsubid = 1 AND (classid::bigint >> 16) = :namespace
+          AND pid <> pg_backend_pid()
+    """), {'mask': IN_FLIGHT_SEQ_MASK, 'namespace': IN_FLIGHT_LOCK_NAMESPACE}).scalar()
+    if oldest_in_flight is not None:
+        return min(last_value, oldest_in_flight - 1)
+    return last_value
+
+
+def track_changes(model, entity, scope_query):
+    """
+    Подключает модель к синхронизации: строки получают change_seq при вставке и изменении
+    (значение по умолчанию колонки), а удаления записываются в журнал удалений - как при
+    удалении через ORM, так и пакетным DELETE. scope_query(ids) возвращает SELECT
+    (id, project_id, user_id) для удаляемых строк.
+    """
+    SYNCED_TABLES.append(model.__tablename__)
+    _tracked_models[model] = (entity, scope_query)
+
+    @event.listens_for(model, 'before_delete')
+    def _record_orm_delete(mapper, connection, target):
+        _insert_tombstones(connection, model, [target.id])
+
+
+def _insert_tombstones(connection, model, ids):
+    if not ids:
+        return
+    entity, scope_query = _tracked_models[model]
+    rows = connection.execute(scope_query(ids)).all()
+    if rows:
+        tombstones = model.metadata.tables[TOMBSTONES_TABLE]
+        connection.execute(insert(tombstones), [
+            {'entity': entity, 'entity_id': row[0], 'project_id': row[1], 'user_id': row[2]}
+            for row in rows
+        ])
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_bulk_delete(orm_execute_state):
+    """Пакетный DELETE по отслеживаемой модели: до удаления фиксирует удаляемые строки в журнале."""
+    if not orm_execute_state.is_delete:
+        return
+    mapper = orm_execute_state.bind_mapper
+    model = mapper.class_ if mapper is not None else None
+    if model not in _tracked_models:
+        return
+    statement = orm_execute_state.statement
+    ids_query = select(model.id)
+    if statement.whereclause is not None:
+        ids_query = ids_query.where(statement.whereclause)
+    connection = orm_execute_state.session.connection()
+    _insert_tombstones(connection, model, connection.execute(ids_query).scalars().all())
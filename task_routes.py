@@ -1,40 +1,42 @@
 from flask import Blueprint, request, jsonify
+from collections import Counter
 from datetime import datetime
 from werkzeug.utils import secure_filename
-import os
-import uuid
-from models import db, Task, WorkPlanItem, TaskMaterialUsage, Material, Project, ProjectUser, User
+from sqlalchemy import or_, and_, insert, update
+from sqlalchemy.orm import selectinload
+from models import db, Task, WorkPlan, WorkPlanItem, TaskMaterialUsage, Material, Project, ProjectUser, User
 from auth import token_required, role_required
 from project_access import require_project_access
 from risk_calculator import recalculate_project_risk
-from notification_service import create_notification
+from notification_service import create_notification, create_notifications
+from progress_service import on_task_created, on_task_changed, add_task_delta, apply_counter_deltas
+from schedule_graph import bump_schedule_revision
+from upload_store import store_upload, release_uploads
 
 task_bp = Blueprint('task_bp', __name__)
 
-UPLOAD_FOLDER = 'uploads/task_photos'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+MAX_TASKS_PAGE_SIZE = 500
+MAX_BULK_TASKS = 500
+# Статусы, которые прораб может выставить пакетно (verified - только через верификацию)
+BULK_TASK_STATUSES = ('pending', 'in_progress', 'completed')
+TASK_LIST_FIELDS = (
+    'id', 'project_id', 'work_plan_item_id', 'work_plan_item', 'name', 'status',
+    'start_date', 'end_date', 'completed_at', 'completion_comment', 'completion_photos',
+    'actual_quantity', 'material_usage', 'projected_start_date', 'projected_end_date'
+)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def _update_work_plan_item_progress(work_plan_item):
-    if work_plan_item:
-        total_tasks = Task.query.filter_by(work_plan_item_id=work_plan_item.id).count()
-        if total_tasks > 0:
-            completed_tasks = Task.query.filter(
-                Task.work_plan_item_id == work_plan_item.id,
-                Task.status.in_(['completed', 'verified'])
-            ).count()
-            work_plan_item.progress = (completed_tasks / total_tasks) * 100
-        else:
-            work_plan_item.progress = 0
-
 @task_bp.route('/api/tasks', methods=['GET'])
 @token_required
 def get_tasks():
     """
     Возвращает список задач с возможностью фильтрации.
     Поддерживает фильтры: `status`, `assignee_id`, `project_id`.
+    Поддерживает keyset-пагинацию (`limit`, `cursor`) и выборочные поля (`fields=id,name,...`).
+    Курсор следующей страницы возвращается в заголовке `X-Next-Cursor`.
     """
     current_user = request.current_user
     query = Task.query
@@ -54,25 +56,82 @@ def get_tasks():
     if assignee_id:
         query = query.filter(Task.completed_by_id == assignee_id)
 
-    tasks = query.order_by(Task.end_date).all()
-
-    tasks_list = [{
-        'id': task.id,
-        'project_id': task.project_id,
-        'work_plan_item_id': task.work_plan_item_id,
-        'work_plan_item': task.work_plan_item.to_dict() if task.work_plan_item else None,
-        'name': task.name,
-        'status': task.status,
-        'start_date': task.start_date.isoformat(),
-        'end_date': task.end_date.isoformat(),
-        'completed_at': task.completed_at.isoformat() if task.completed_at else None,
-        'completion_comment': task.completion_comment,
-        'completion_photos': task.completion_photos or [],
-        'actual_quantity': task.actual_quantity,
-        'material_usage': [mu.to_dict() for mu in task.material_usage] if hasattr(task, 'material_usage') else []
-    } for task in tasks]
-
-    return jsonify(tasks_list), 200
+    fields = None
+    fields_param = request.args.get('fields')
+    if fields_param:
+        fields = {f.strip() for f in fields_param.split(',') if f.strip()}
+        unknown_fields = fields - set(TASK_LIST_FIELDS)
+        if unknown_fields:
+            return jsonify({'message': f"Неизвестные поля: {', '.join(sorted(unknown_fields))}"}), 400
+
+    include_work_item = fields is None or 'work_plan_item' in fields
+    include_material_usage = fields is None or 'material_usage' in fields
+
+    if include_work_item:
+        query = query.options(selectinload(Task.work_plan_item))
+    if include_material_usage:
+        query = query.options(selectinload(Task.material_usage).selectinload(TaskMaterialUsage.material))
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_end_date, cursor_id = _decode_task_cursor(cursor)
+        except (ValueError, TypeError):
+            return jsonify({'message': 'Неверный формат курсора'}), 400
+        query = query.filter(or_(
+            Task.end_date > cursor_end_date,
+            and_(Task.end_date == cursor_end_date, Task.id > cursor_id)
+        ))
+
+    limit = request.args.get('limit', type=int)
+    query = query.order_by(Task.end_date, Task.id)
+    if limit:
+        limit = max(1, min(limit, MAX_TASKS_PAGE_SIZE))
+        tasks = query.limit(limit + 1).all()
+    else:
+        tasks = query.all()
+
+    next_cursor = None
+    if limit and len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = _encode_task_cursor(tasks[-1])
+
+    tasks_list = [_serialize_task(task, fields) for task in tasks]
+
+    response = jsonify(tasks_list)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+
+def _encode_task_cursor(task):
+    return f"{task.end_date.isoformat()}_{task.id}"
+
+
+def _decode_task_cursor(cursor):
+    end_date_str, task_id = cursor.split('_', 1)
+    return datetime.fromisoformat(end_date_str).date(), int(task_id)
+
+
+def _serialize_task(task, fields=None):
+    task_dict = {}
+    for field in TASK_LIST_FIELDS:
+        if fields is not None and field not in fields:
+            continue
+        if field == 'work_plan_item':
+            task_dict[field] = task.work_plan_item.to_dict() if task.work_plan_item else None
+        elif field == 'material_usage':
+            task_dict[field] = [mu.to_dict() for mu in task.material_usage]
+        elif field in ('start_date', 'end_date'):
+            task_dict[field] = getattr(task, field).isoformat()
+        elif field in ('completed_at', 'projected_start_date', 'projected_end_date'):
+            value = getattr(task, field)
+            task_dict[field] = value.isoformat() if value else None
+        elif field == 'completion_photos':
+            task_dict[field] = task.completion_photos or []
+        else:
+            task_dict[field] = getattr(task, field)
+    return task_dict
 
 @task_bp.route('/api/tasks', methods=['POST'])
 @token_required
@@ -129,6 +188,9 @@ def create_task():
     )
 
     db.session.add(new_task)
+    db.session.flush()
+    on_task_created(new_task)
+    bump_schedule_revision(project_id)
     db.session.commit()
 
     recalculate_project_risk(project_id, triggering_user_id=request.current_user['id'])
@@ -167,21 +229,18 @@ def update_task_status(project_id, task_id):
             return jsonify({'message': 'Статус не указан'}), 400
 
         new_status = request.form.get('status')
+        old_status = task.status
+        old_actual_quantity = task.actual_quantity
         
         if new_status == 'completed':
             photos = request.files.getlist('photos')
             
-            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-            
             photo_urls = []
             if photos and len(photos) > 0:
                 for photo in photos:
                     if photo and allowed_file(photo.filename):
-                        ext = photo.filename.rsplit('.', 1)[1].lower()
-                        filename = f"{uuid.uuid4()}.{ext}"
-                        filepath = os.path.join(UPLOAD_FOLDER, filename)
-                        photo.save(filepath)
-                        photo_urls.append(f"/uploads/task_photos/{filename}")
+                        photo_urls.append(store_upload(photo).url)
+            release_uploads(task.completion_photos)
             
             task.status = 'completed'
             task.completed_by_id = request.current_user['id']
@@ -212,7 +271,9 @@ def update_task_status(project_id, task_id):
         else:
             task.status = new_status
 
-        _update_work_plan_item_progress(task.work_plan_item)
+        on_task_changed(task, old_status, old_actual_quantity)
+        # Статус входит в кэшированный граф зависимостей
+        bump_schedule_revision(task.project_id)
 
         db.session.commit()
         
@@ -264,6 +325,9 @@ def verify_task(project_id, task_id):
     if new_status not in ['verified', 'rejected']:
         return jsonify({'message': 'Статус должен быть \'verified\' или \'rejected\''}), 400
 
+    old_status = task.status
+    old_actual_quantity = task.actual_quantity
+
     if new_status == 'verified':
         task.status = 'verified'
         task.verified_by_id = request.current_user['id']
@@ -272,7 +336,8 @@ def verify_task(project_id, task_id):
         task.completed_by_id = None
         task.completed_at = None
 
-    _update_work_plan_item_progress(task.work_plan_item)
+    on_task_changed(task, old_status, old_actual_quantity)
+    bump_schedule_revision(task.project_id)
 
     db.session.commit()
     
@@ -295,3 +360,366 @@ def verify_task(project_id, task_id):
             )
     
     return jsonify({'message': f'Статус задачи обновлен на {task.status}'}), 200
+
+
+def _find_project_user(project_id, role):
+    return db.session.query(ProjectUser).join(User).filter(
+        ProjectUser.project_id == project_id,
+        User.role == role
+    ).first()
+
+
+def _validate_bulk_items(items):
+    if not isinstance(items, list) or not items:
+        return jsonify({'message': 'Требуется непустой массив tasks'}), 400
+    if len(items) > MAX_BULK_TASKS:
+        return jsonify({'message': f'За один запрос можно обработать не более {MAX_BULK_TASKS} задач'}), 400
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({'message': 'Каждый элемент tasks должен быть объектом'}), 400
+    return None
+
+
+def _bulk_task_ids(items):
+    """Возвращает (множество id задач, None) или (None, ответ 400) для нечисловых и повторяющихся id."""
+    try:
+        task_ids = [int(item['id']) for item in items]
+    except (KeyError, ValueError, TypeError):
+        return None, (jsonify({'message': 'id задач должны быть целыми числами'}), 400)
+
+    duplicates = sorted(task_id for task_id, count in Counter(task_ids).items() if count > 1)
+    if duplicates:
+        return None, (jsonify({'message': 'Задачи указаны в пакете повторно', 'task_ids': duplicates}), 400)
+    return set(task_ids), None
+
+
+def _bulk_completion_values(items):
+    """
+    Проверяет и приводит к типам actual_quantity и materials задач, закрываемых в пакете.
+    Возвращает ({id задачи: (actual_quantity или None, [(material_id, quantity)])}, None)
+    или (None, ответ 400) с указанием задачи.
+    """
+    values = {}
+    for item in items:
+        if item['status'] != 'completed':
+            continue
+        task_id = int(item['id'])
+        quantity = None
+        if item.get('actual_quantity') not in (None, ''):
+            try:
+                quantity = float(item['actual_quantity'])
+            except (TypeError, ValueError):
+                return None, (jsonify({'message': f'Задача {task_id}: actual_quantity должно быть числом'}), 400)
+
+        materials = item.get('materials') or []
+        if not isinstance(materials, list) or not all(isinstance(mat, dict) for mat in materials):
+            return None, (jsonify({'message': f'Задача {task_id}: materials должен быть массивом объектов'}), 400)
+        usages = []
+        for mat in materials:
+            if not mat.get('material_id') or not mat.get('quantity'):
+                continue
+            try:
+                usages.append((int(mat['material_id']), float(mat['quantity'])))
+            except (TypeError, ValueError):
+                return None, (jsonify({
+                    'message': f'Задача {task_id}: material_id должен быть целым числом, quantity - числом'
+                }), 400)
+        values[task_id] = (quantity, usages)
+
+    material_ids = {material_id for _, usages in values.values() for material_id, _ in usages}
+    if material_ids:
+        known = {material_id for (material_id,) in
+                 db.session.query(Material.id).filter(Material.id.in_(material_ids))}
+        if material_ids - known:
+            return None, (jsonify({'message': 'Материалы не найдены',
+                                   'material_ids': sorted(material_ids - known)}), 400)
+    return values, None
+
+
+@task_bp.route('/api/tasks/bulk', methods=['POST'])
+@token_required
+@role_required('client')
+def bulk_create_tasks():
+    """
+    Пакетное создание плановых задач одного проекта.
+    Принимает project_id и массив tasks с полями work_plan_item_id, name, start_date, end_date.
+    Все задачи вставляются одной транзакцией; прогресс пунктов плана и риск проекта
+    пересчитываются один раз на весь пакет.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "Пустое тело запроса"}), 400
+
+    try:
+        project_id = int(data.get('project_id'))
+    except (ValueError, TypeError):
+        return jsonify({"message": "project_id должен быть числом"}), 400
+
+    items = data.get('tasks')
+    validation_error = _validate_bulk_items(items)
+    if validation_error:
+        return validation_error
+
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    project = db.get_or_404(Project, project_id)
+    if project.status != 'active':
+        return jsonify({'message': 'Нельзя создавать задачи для неактивного проекта'}), 403
+
+    rows = []
+    for index, item in enumerate(items):
+        if not all([item.get('work_plan_item_id'), item.get('name'), item.get('start_date'), item.get('end_date')]):
+            return jsonify({"message": f"Задача {index + 1}: необходимые поля work_plan_item_id, name, start_date, end_date"}), 400
+        try:
+            work_plan_item_id = int(item['work_plan_item_id'])
+            start_date = datetime.fromisoformat(str(item['start_date']).split('T')[0]).date()
+            end_date = datetime.fromisoformat(str(item['end_date']).split('T')[0]).date()
+        except (ValueError, TypeError):
+            return jsonify({"message": f"Задача {index + 1}: неверный формат work_plan_item_id или даты"}), 400
+        rows.append({
+            'project_id': project_id,
+            'work_plan_item_id': work_plan_item_id,
+            'name': item['name'],
+            'start_date': start_date,
+            'end_date': end_date,
+            'status': 'pending'
+        })
+
+    requested_item_ids = {row['work_plan_item_id'] for row in rows}
+    valid_item_ids = {
+        item_id for (item_id,) in db.session.query(WorkPlanItem.id)
+        .join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id)
+        .filter(WorkPlan.project_id == project_id, WorkPlanItem.id.in_(requested_item_ids))
+    }
+    invalid_item_ids = requested_item_ids - valid_item_ids
+    if invalid_item_ids:
+        return jsonify({
+            "message": "Пункты плана не найдены или не принадлежат данному проекту",
+            "work_plan_item_ids": sorted(invalid_item_ids)
+        }), 400
+
+    try:
+        task_ids = db.session.scalars(
+            insert(Task).returning(Task.id, sort_by_parameter_order=True), rows
+        ).all()
+
+        deltas = {}
+        for row in rows:
+            add_task_delta(deltas, row['work_plan_item_id'], new_state=(row['status'], None))
+        apply_counter_deltas(deltas)
+        bump_schedule_revision(project_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Ошибка при пакетном создании задач', 'error': str(e)}), 500
+
+    recalculate_project_risk(project_id, triggering_user_id=request.current_user['id'])
+
+    return jsonify({
+        'message': f'Создано задач: {len(task_ids)}',
+        'task_ids': task_ids
+    }), 201
+
+
+@task_bp.route('/api/projects/<int:project_id>/tasks/bulk-status', methods=['POST'])
+@token_required
+@role_required('foreman')
+def bulk_update_task_status(project_id):
+    """
+    Пакетное обновление статусов задач прорабом (например, закрытие смены).
+    Принимает массив tasks с полями id, status и для 'completed' - необязательными
+    actual_quantity, comment, geolocation, materials [{material_id, quantity}].
+    Изменения и расход материалов записываются одной транзакцией, клиенту
+    отправляется одно сводное уведомление.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "Пустое тело запроса"}), 400
+
+    items = data.get('tasks')
+    validation_error = _validate_bulk_items(items)
+    if validation_error:
+        return validation_error
+
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    if any(not item.get('id') or not item.get('status') for item in items):
+        return jsonify({'message': 'Для каждой задачи требуются id и status'}), 400
+    if any(item['status'] not in BULK_TASK_STATUSES for item in items):
+        return jsonify({'message': f"Допустимые статусы: {', '.join(BULK_TASK_STATUSES)}"}), 400
+
+    requested_ids, ids_error = _bulk_task_ids(items)
+    if ids_error:
+        return ids_error
+    current = {
+        row.id: row for row in db.session.query(
+            Task.id, Task.work_plan_item_id, Task.status, Task.actual_quantity
+        ).filter(Task.project_id == project_id, Task.id.in_(requested_ids))
+    }
+    missing_ids = requested_ids - set(current)
+    if missing_ids:
+        return jsonify({'message': 'Задачи не найдены в проекте', 'task_ids': sorted(missing_ids)}), 404
+    completion_values, values_error = _bulk_completion_values(items)
+    if values_error:
+        return values_error
+
+    user_id = request.current_user['id']
+    now = datetime.utcnow()
+    updates, usages, deltas = [], [], {}
+    completed_count = 0
+
+    try:
+        for item in items:
+            task_id = int(item['id'])
+            row = current[task_id]
+            new_status = item['status']
+            change = {'id': task_id, 'status': new_status}
+            new_quantity = row.actual_quantity
+
+            if new_status == 'completed':
+                completed_count += 1
+                change.update({
+                    'completed_by_id': user_id,
+                    'completed_at': now,
+                    'completion_comment': item.get('comment', ''),
+                    'completion_geolocation': item.get('geolocation')
+                })
+                actual_quantity, material_usages = completion_values[task_id]
+                if actual_quantity is not None:
+                    new_quantity = actual_quantity
+                    change['actual_quantity'] = new_quantity
+                for material_id, quantity in material_usages:
+                    usages.append({
+                        'task_id': task_id,
+                        'material_id': material_id,
+                        'quantity_used': quantity,
+                        'recorded_by_id': user_id,
+                        'recorded_at': now
+                    })
+
+            updates.append(change)
+            add_task_delta(deltas, row.work_plan_item_id,
+                           old_state=(row.status, row.actual_quantity),
+                           new_state=(new_status, new_quantity))
+
+        db.session.execute(update(Task), updates)
+        if usages:
+            db.session.execute(insert(TaskMaterialUsage), usages)
+        apply_counter_deltas(deltas)
+        bump_schedule_revision(project_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Внутренняя ошибка сервера при обновлении задач', 'error': str(e)}), 500
+
+    recalculate_project_risk(project_id, triggering_user_id=user_id)
+
+    if completed_count:
+        project = db.session.get(Project, project_id)
+        client_assignment = _find_project_user(project_id, 'client')
+        if client_assignment:
+            create_notification(
+                user_id=client_assignment.user_id,
+                message=f"В проекте '{project.name}' выполнено задач: {completed_count}. Задачи ожидают верификации",
+                link=f"/projects/{project_id}"
+            )
+
+    return jsonify({
+        'message': f'Обновлено задач: {len(updates)}',
+        'task_ids': [change['id'] for change in updates]
+    }), 200
+
+
+@task_bp.route('/api/projects/<int:project_id>/tasks/bulk-verify', methods=['POST'])
+@token_required
+@role_required('client')
+def bulk_verify_tasks(project_id):
+    """
+    Пакетная верификация выполненных задач.
+    Принимает массив tasks с полями id и status ('verified' или 'rejected').
+    Все задачи должны находиться в статусе completed, иначе пакет отклоняется целиком.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "Пустое тело запроса"}), 400
+
+    items = data.get('tasks')
+    validation_error = _validate_bulk_items(items)
+    if validation_error:
+        return validation_error
+
+    access_error = require_project_access(project_id, request.current_user['id'], request.current_user['role'])
+    if access_error:
+        return access_error
+
+    if any(not item.get('id') or item.get('status') not in ('verified', 'rejected') for item in items):
+        return jsonify({'message': 'Для каждой задачи требуются id и статус \'verified\' или \'rejected\''}), 400
+
+    requested_ids, ids_error = _bulk_task_ids(items)
+    if ids_error:
+        return ids_error
+    current = {
+        row.id: row for row in db.session.query(
+            Task.id, Task.work_plan_item_id, Task.status, Task.actual_quantity
+        ).filter(Task.project_id == project_id, Task.id.in_(requested_ids))
+    }
+    missing_ids = requested_ids - set(current)
+    if missing_ids:
+        return jsonify({'message': 'Задачи не найдены в проекте', 'task_ids': sorted(missing_ids)}), 404
+
+    not_completed = sorted(task_id for task_id, row in current.items() if row.status != 'completed')
+    if not_completed:
+        return jsonify({
+            'message': 'Задачу можно верифицировать только в статусе completed',
+            'task_ids': not_completed
+        }), 409
+
+    user_id = request.current_user['id']
+    updates, deltas = [], {}
+    counts = {'verified': 0, 'rejected': 0}
+
+    for item in items:
+        task_id = int(item['id'])
+        row = current[task_id]
+        counts[item['status']] += 1
+        if item['status'] == 'verified':
+            change = {'id': task_id, 'status': 'verified', 'verified_by_id': user_id}
+        else:
+            change = {'id': task_id, 'status': 'pending', 'completed_by_id': None, 'completed_at': None}
+        updates.append(change)
+        add_task_delta(deltas, row.work_plan_item_id,
+                       old_state=(row.status, row.actual_quantity),
+                       new_state=(change['status'], row.actual_quantity))
+
+    try:
+        db.session.execute(update(Task), updates)
+        apply_counter_deltas(deltas)
+        bump_schedule_revision(project_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Внутренняя ошибка сервера при верификации задач', 'error': str(e)}), 500
+
+    recalculate_project_risk(project_id, triggering_user_id=user_id)
+
+    project = db.session.get(Project, project_id)
+    foreman_assignment = _find_project_user(project_id, 'foreman')
+    if foreman_assignment:
+        create_notifications([
+            {
+                'user_id': foreman_assignment.user_id,
+                'message': f"В проекте '{project.name}' {label}: {counts[status]}",
+                'link': f"/projects/{project_id}"
+            }
+            for status, label in (('verified', 'принято задач'), ('rejected', 'отклонено задач'))
+            if counts[status]
+        ])
+
+    return jsonify({
+        'message': f"Принято: {counts['verified']}, отклонено: {counts['rejected']}",
+        'verified': counts['verified'],
+        'rejected': counts['rejected']
+    }), 200
@@ -3,6 +3,7 @@ import os
 import json
 from datetime import datetime
 from celery import Celery
+from celery.schedules import crontab
 from flask import Flask
 
 app = Flask(__name__)
@@ -20,6 +21,35 @@ celery = Celery(
     broker=app.config['CELERY_BROKER_URL']
 )
 celery.conf.update(app.config)
+celery.conf.CELERYBEAT_SCHEDULE = {
+    'reconcile-work-item-counters': {
+        'task': 'tasks.reconcile_work_item_counters_task',
+        'schedule': crontab(hour=3, minute=0),
+        'kwargs': {'fix': True}
+    },
+    'reconcile-checklist-compliance-rollups': {
+        'task': 'tasks.reconcile_compliance_rollups_task',
+        'schedule': crontab(hour=3, minute=30, day_of_week=0),
+        'kwargs': {'fix': True}
+    },
+    'requeue-stalled-checklist-completions': {
+        'task': 'tasks.requeue_stalled_checklist_completions_task',
+        'schedule': crontab(minute='*/15')
+    },
+    'collect-upload-garbage': {
+        'task': 'tasks.collect_upload_garbage_task',
+        'schedule': crontab(hour=4, minute=0)
+    },
+    'propagate-overdue-task-slips': {
+        'task': 'tasks.propagate_overdue_slips_task',
+        'schedule': crontab(hour=0, minute=30)
+    }
+}
+# Построение превью - отдельная очередь со своим пулом процессов (сервис celery_preview_worker),
+# чтобы обработка изображений не задерживала остальные задачи
+celery.conf.CELERY_ROUTES = {
+    'tasks.generate_upload_variants_task': {'queue': 'previews'}
+}
 
 class ContextTask(celery.Task):
     def __call__(self, *args, **kwargs):
@@ -221,3 +251,196 @@ For each document set, create a JSON object with the following deeply nested str
                 api_client.delete_chat(chat_session)
             except Exception as e:
                 print(f"[Celery] Ошибка при удалении чата: {e}")
+
+
+@celery.task
+def reconcile_work_item_counters_task(project_id=None, fix=False):
+    """
+    Фоновая сверка счетчиков прогресса пунктов плана работ с задачами.
+    Логирует найденные расхождения и при fix=True исправляет их.
+    """
+    from progress_service import reconcile_work_item_counters
+
+    drift = reconcile_work_item_counters(project_id=project_id, fix=fix)
+    for entry in drift:
+        print(f"[Celery] Расхождение счетчиков пункта плана {entry['work_plan_item_id']}: "
+              f"сохранено {entry['stored']}, фактически {entry['actual']}")
+
+    return {
+        'status': 'completed',
+        'drift_count': len(drift),
+        'fixed': fix,
+        'drift': drift
+    }
+
+
+@celery.task
+def reconcile_compliance_rollups_task(project_id=None, fix=False):
+    """
+    Фоновая сверка недельных сводок соблюдения чек-листов с ответами.
+    Логирует найденные расхождения и при fix=True исправляет их.
+    """
+    from compliance_service import reconcile_compliance_rollups
+
+    drift = reconcile_compliance_rollups(project_id=project_id, fix=fix)
+    for entry in drift:
+        print(f"[Celery] Расхождение сводки пункта чек-листа {entry['checklist_item_id']} "
+              f"(проект {entry['project_id']}, неделя {entry['week_start']}): "
+              f"сохранено {entry['stored']}, фактически {entry['actual']}")
+
+    return {
+        'status': 'completed',
+        'drift_count': len(drift),
+        'fixed': fix,
+        'drift': drift
+    }
+
+
+@celery.task
+def collect_upload_garbage_task():
+    """
+    Удаляет из хранилища загрузок файлы, на которые не осталось ссылок,
+    и архивы выгрузок чек-листов с истекшим сроком хранения.
+    """
+    from upload_store import collect_garbage
+    from checklist_export import expire_export_archives
+
+    removed = collect_garbage()
+    print(f"[Celery] Хранилище загрузок: удалено файлов без ссылок: {removed}")
+    expired = expire_export_archives()
+    print(f"[Celery] Выгрузки чек-листов: удалено архивов с истекшим сроком: {expired}")
+    return {'status': 'completed', 'removed': removed, 'expired_exports': expired}
+
+
+@celery.task(bind=True, max_retries=2, default_retry_delay=30)
+def generate_upload_variants_task(self, path):
+    """Строит миниатюру и превью загруженного изображения или первой страницы PDF."""
+    from upload_previews import generate_variants
+
+    try:
+        variants = generate_variants(path)
+    except OSError as e:
+        raise self.retry(exc=e)
+    return {'status': 'completed', 'path': path, 'variants': sorted(variants)}
+
+
+@celery.task
+def propagate_overdue_slips_task():
+    """
+    Ежедневный перенос прогнозных сроков: незавершенные просроченные задачи
+    сдвигают прогноз зависимых задач.
+    """
+    from schedule_propagation import propagate_overdue_slips
+
+    reports = propagate_overdue_slips()
+    for report in reports:
+        print(f"[Celery] Проект {report['project_id']}: обновлен прогноз для "
+              f"{len(report['updated_tasks'])} задач, затронуто пунктов плана: "
+              f"{len(report['impacted_work_plan_items'])}")
+
+    return {
+        'status': 'completed',
+        'projects_affected': len(reports),
+        'reports': reports
+    }
+
+
+@celery.task(bind=True)
+def run_schedule_simulation_task(self, simulation_id):
+    """
+    Моделирование сроков завершения плана работ методом Монте-Карло.
+    Прогресс публикуется в состоянии задачи (PROGRESS) и в записи моделирования.
+    """
+    from simulation_service import run_schedule_simulation
+
+    def report_progress(done, total):
+        self.update_state(state='PROGRESS', meta={
+            'simulation_id': simulation_id,
+            'iterations_done': done,
+            'iterations': total
+        })
+
+    simulation = run_schedule_simulation(simulation_id, progress_callback=report_progress)
+    if simulation is None:
+        print(f"[Celery] Моделирование {simulation_id} не найдено")
+        return {'status': 'error', 'message': 'Simulation not found'}
+
+    print(f"[Celery] Моделирование {simulation_id} проекта {simulation.project_id}: {simulation.status}")
+    return {
+        'status': simulation.status,
+        'simulation_id': simulation_id,
+        'result': simulation.result,
+        'error': simulation.error
+    }
+
+
+@celery.task
+def import_work_plan_task(import_id):
+    """Фоновый импорт плана работ из большого xlsx-файла сметы."""
+    from workplan_import import run_work_plan_import
+
+    job = run_work_plan_import(import_id)
+    if job is None:
+        print(f"[Celery] Импорт плана работ {import_id} не найден")
+        return {'status': 'error', 'message': 'Import not found'}
+
+    print(f"[Celery] Импорт плана работ {import_id}: {job.status}. {job.message}")
+    return {
+        'status': job.status,
+        'import_id': import_id,
+        'work_plan_id': job.work_plan_id,
+        'items_imported': job.items_imported,
+        'errors_count': job.errors_count
+    }
+
+
+@celery.task(bind=True)
+def export_checklists_task(self, export_id):
+    """Фоновая выгрузка заполненных чек-листов проекта в ZIP-архив DOCX."""
+    from checklist_export import run_checklist_export
+
+    def report_progress(processed, total):
+        self.update_state(state='PROGRESS', meta={
+            'export_id': export_id,
+            'processed': processed,
+            'total': total
+        })
+
+    job = run_checklist_export(export_id, progress_callback=report_progress)
+    if job is None:
+        print(f"[Celery] Выгрузка чек-листов {export_id} не найдена")
+        return {'status': 'error', 'message': 'Export not found'}
+
+    print(f"[Celery] Выгрузка чек-листов {export_id} проекта {job.project_id}: {job.status}")
+    return {
+        'status': job.status,
+        'export_id': export_id,
+        'processed': job.processed,
+        'file_size': job.file_size
+    }
+
+
+@celery.task
+def process_checklist_completion_task(completion_id, triggering_user_id=None):
+    """Фоновая обработка заполненного чек-листа: фотографии, пересчет риска, уведомления."""
+    from checklist_ingest import process_completion
+
+    completion = process_completion(completion_id, triggering_user_id=triggering_user_id)
+    if completion is None:
+        print(f"[Celery] Заполнение чек-листа {completion_id} не найдено")
+        return {'status': 'error', 'message': 'Completion not found'}
+
+    return {'status': completion.processing_status, 'completion_id': completion_id, 'photos': len(completion.photos or [])}
+
+
+@celery.task
+def requeue_stalled_checklist_completions_task():
+    """Повторно ставит в очередь обработку заполнений чек-листов, застрявших в pending/failed."""
+    from checklist_ingest import stalled_completion_ids
+
+    stalled = stalled_completion_ids()
+    for completion_id, user_id in stalled:
+        process_checklist_completion_task.delay(completion_id, user_id)
+    if stalled:
+        print(f"[Celery] Повторно поставлено в очередь заполнений чек-листов: {len(stalled)}")
+    return {'status': 'completed', 'requeued': len(stalled)}
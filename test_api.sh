@@ -26,3 +26,22 @@ echo ""
 echo "4. Получение списка задач для проекта 3..."
 curl -s "http://localhost:8501/api/tasks?project_id=3" \
   -H "Authorization: Bearer $TOKEN" | python3 -m json.tool | head -40
+echo ""
+
+echo "5. Вставка работы на заданную позицию (PATCH плана работ проекта 3)..."
+REVISION=$(curl -s http://localhost:8501/api/projects/3/work-plan \
+  -H "Authorization: Bearer $TOKEN" | python3 -c "import sys, json; print(json.load(sys.stdin).get('revision', 0))")
+PATCH_RESPONSE=$(curl -s -X PATCH http://localhost:8501/api/projects/3/work-plan \
+  -H "Authorization: Bearer $TOKEN" \
+  -H "Content-Type: application/json" \
+  -d "{\"revision\": $REVISION, \"operations\": [{\"op\": \"add\", \"client_id\": \"new-1\", \"item\": {\"name\": \"Тестовая работа\", \"unit\": \"м2\", \"quantity\": 10, \"start_date\": \"2025-01-10\", \"end_date\": \"2025-01-20\", \"order\": 2}}]}")
+echo $PATCH_RESPONSE | python3 -m json.tool
+NEW_ITEM_ID=$(echo $PATCH_RESPONSE | python3 -c "import sys, json; print(json.load(sys.stdin)['added'][0]['id'])")
+curl -s http://localhost:8501/api/projects/3/work-plan \
+  -H "Authorization: Bearer $TOKEN" | python3 -c "
+import sys, json
+items = json.load(sys.stdin)['items']
+item = next(i for i in items if i['id'] == $NEW_ITEM_ID)
+assert item['order'] == 2, item
+print('✓ Работа вставлена на позицию', item['order'])
+"
@@ -1,11 +1,11 @@
 import os
 import json
 from flask import Blueprint, request, jsonify, send_file
-from werkzeug.utils import secure_filename
 from auth import token_required
 from models import db, Document, WorkPlan, RequiredMaterial
 from datetime import datetime
 from risk_calculator import recalculate_project_risk
+from upload_store import store_upload
 
 recognition_bp = Blueprint('recognition_bp', __name__)
 
@@ -37,13 +37,10 @@ def recognize_document():
     if file.filename == '':
         return jsonify({"message": "Пустое имя файла"}), 400
 
-    filename = secure_filename(file.filename)
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(file_path)
-
     document = None
     try:
+        # Хранилище по содержимому: одноименные файлы разных пользователей не перезаписывают друг друга
+        file_path = os.path.join(UPLOAD_FOLDER, store_upload(file).path)
         current_user_id = request.current_user['id']
         document = Document(
             project_id=project_id,
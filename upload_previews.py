@@ -0,0 +1,224 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+from functools import lru_cache
+from urllib.parse import quote
+from flask import current_app, jsonify, request, send_file
+from upload_store import UPLOADS_ROOT, CHUNK_SIZE, blob_sha256, upload_abspath
+
+# Вариант -> максимальная сторона в пикселях (пропорции сохраняются)
+VARIANTS = {
+    'thumb': 320,
+    'preview': 1280
+}
+DERIVED_DIR = 'derived'
+JPEG_QUALITY = 82
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'}
+PDF_EXTENSIONS = {'pdf'}
+# Производные файлов из хранилища по хэшу неизменяемы; для старых файлов по пути - короткий срок
+IMMUTABLE_CACHE_CONTROL = 'max-age=31536000, immutable'
+LEGACY_CACHE_CONTROL = 'max-age=86400'
+
+
+def _extension(path):
+    return path.rsplit('.', 1)[1].lower() if '.' in os.path.basename(path) else ''
+
+
+def is_previewable(path):
+    """Можно ли построить превью: изображения и первая страница PDF."""
+    return _extension(path) in IMAGE_EXTENSIONS | PDF_EXTENSIONS
+
+
+def _variant_key(source):
+    """
+    Ключ производных файлов: SHA-256 содержимого для файлов хранилища (вариант неизменяем),
+    для прочих файлов - хэш пути, размера и времени изменения (перезапись файла дает новый ключ).
+    """
+    sha256 = blob_sha256(source)
+    if sha256:
+        return sha256, True
+    stat = os.stat(source)
+    relative = os.path.relpath(source, UPLOADS_ROOT)
+    return hashlib.sha256(f"{relative}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')).hexdigest(), False
+
+
+def variant_abspath(key, variant):
+    return os.path.join(UPLOADS_ROOT, DERIVED_DIR, variant, key[:2], f"{key}.jpg")
+
+
+def _open_source(source, max_size):
+    """Открывает исходный файл как RGB-изображение не меньше max_size по большей стороне."""
+    from PIL import Image, ImageOps
+
+    if _extension(source) in PDF_EXTENSIONS:
+        import pymupdf
+
+        with pymupdf.open(source) as document:
+            if document.page_count == 0:
+                return None
+            page = document[0]
+            zoom = max_size / max(page.rect.width, page.rect.height, 1)
+            pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+    image = Image.open(source)
+    # Для JPEG декодер сразу уменьшает изображение кратно 1/2..1/8 - основная экономия времени и памяти
+    image.draft('RGB', (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _save_jpeg(image, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def generate_variants(path_or_url, variants=None):
+    """
+    Строит недостающие варианты файла (исходник декодируется один раз, варианты - от большего к меньшему).
+    Возвращает {вариант: абсолютный путь}; для неподдерживаемых или отсутствующих файлов - {}.
+    """
+    source = upload_abspath(path_or_url)
+    if not source or not os.path.isfile(source) or not is_previewable(source):
+        return {}
+
+    key, _ = _variant_key(source)
+    names = sorted(variants or VARIANTS, key=lambda name: VARIANTS[name], reverse=True)
+    result = {name: variant_abspath(key, name) for name in names}
+    missing = [name for name in names if not os.path.exists(result[name])]
+    if not missing:
+        return result
+
+    image = _open_source(source, VARIANTS[missing[0]])
+    if image is None:
+        return {}
+    for name in missing:
+        size = VARIANTS[name]
+        image.thumbnail((size, size))
+        _save_jpeg(image, result[name])
+    return result
+
+
+def remove_variants(sha256):
+    """Удаляет производные файла хранилища (вызывается при удалении самого файла)."""
+    for variant in VARIANTS:
+        target = variant_abspath(sha256, variant)
+        if os.path.exists(target):
+            os.remove(target)
+
+
+@lru_cache(maxsize=4096)
+def _content_sha256(source, size, mtime_ns):
+    """SHA-256 файла вне хранилища; размер и время изменения входят в ключ кэша."""
+    digest = hashlib.sha256()
+    with open(source, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_etag(source):
+    """Строгий ETag по содержимому: хэш из имени файла хранилища или SHA-256 остальных файлов."""
+    sha256 = blob_sha256(source)
+    if sha256:
+        return sha256
+    stat = os.stat(source)
+    return _content_sha256(source, stat.st_size, stat.st_mtime_ns)
+
+
+def _offload_response(source, etag, cache_control, mimetype):
+    """
+    Передача отдачи файла фронт-прокси: X-Accel-Redirect (nginx, internal location с alias на каталог
+    загрузок) или X-Sendfile (Apache mod_xsendfile, lighttpd). Range прокси обслуживает сам,
+    совпавший If-None-Match отвечается 304 без передачи.
+    Возвращает None, если передача не настроена.
+    """
+    accel_prefix = current_app.config.get('UPLOADS_X_ACCEL_REDIRECT')
+    if not accel_prefix and not current_app.config.get('UPLOADS_X_SENDFILE'):
+        return None
+
+    response = current_app.response_class(mimetype=mimetype or mimetypes.guess_type(source)[0]
+                                          or 'application/octet-stream')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    if accel_prefix:
+        relative = os.path.relpath(source, UPLOADS_ROOT).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = quote(f"{accel_prefix.rstrip('/')}/{relative}")
+    else:
+        response.headers['X-Sendfile'] = source
+    return response
+
+
+def _send_file(source, etag, cache_control, mimetype=None):
+    """Отдает файл со строгим ETag, условными запросами и Range - через прокси или из процесса."""
+    response = _offload_response(source, etag, cache_control, mimetype)
+    if response is None:
+        response = send_file(source, mimetype=mimetype, etag=etag, conditional=True)
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def send_upload(path_or_url, variant=None, private=False):
+    """
+    Отдает загруженный файл или его вариант (?variant=thumb|preview).
+    Отсутствующий вариант строится сразу, если фоновая задача еще не успела.
+    Файлы хранилища неизменяемы и кэшируются на год; старые файлы по пути
+    перепроверяются по ETag. private=True - для ответов, требующих авторизации.
+    """
+    source = upload_abspath(path_or_url)
+    if not source or not os.path.isfile(source):
+        return jsonify({'message': 'Файл не найден на сервере'}), 404
+    scope = 'private' if private else 'public'
+    immutable = blob_sha256(source) is not None
+
+    if not variant:
+        cache_control = f"{scope}, {IMMUTABLE_CACHE_CONTROL}" if immutable else f"{scope}, no-cache"
+        return _send_file(source, _file_etag(source), cache_control)
+
+    if variant not in VARIANTS:
+        return jsonify({'message': f"Неизвестный вариант. Допустимые: {', '.join(VARIANTS)}"}), 400
+    if not is_previewable(source):
+        return jsonify({'message': 'Для этого типа файла превью не формируется'}), 404
+
+    try:
+        target = generate_variants(source, [variant]).get(variant)
+    except Exception as e:
+        print(f"[Previews] Не удалось построить {variant} для {source}: {e}")
+        target = None
+    if not target:
+        return jsonify({'message': 'Не удалось построить превью'}), 404
+
+    key, _ = _variant_key(source)
+    cache_control = f"{scope}, {IMMUTABLE_CACHE_CONTROL if immutable else LEGACY_CACHE_CONTROL}"
+    return _send_file(target, f"{key}-{variant}", cache_control, mimetype='image/jpeg')
+
+
+def enqueue_variants(paths):
+    """Ставит построение превью новых файлов в очередь фоновых задач."""
+    paths = [path for path in paths if is_previewable(path)]
+    if not paths:
+        return
+    try:
+        from tasks import generate_upload_variants_task
+        for path in paths:
+            generate_upload_variants_task.delay(path)
+    except Exception as e:
+        # Без брокера варианты построятся при первом запросе
+        print(f"[Previews] Не удалось поставить задачу построения превью: {e}")
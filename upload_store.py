@@ -0,0 +1,242 @@
+import hashlib
+import os
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from sqlalchemy import event, update, delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+from models import db, StoredBlob
+
+UPLOADS_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+BLOBS_DIR = 'blobs'
+TMP_DIR = os.path.join(UPLOADS_ROOT, BLOBS_DIR, 'tmp')
+CHUNK_SIZE = 64 * 1024
+# Файлы без записи в БД (транзакция откатилась) удаляются сборщиком не раньше этого срока
+ORPHAN_GRACE_SECONDS = 3600
+
+# path - путь относительно UPLOADS_ROOT, url - адрес для отдачи через /uploads
+StoredUpload = namedtuple('StoredUpload', 'path url sha256 size deduplicated')
+
+
+def _extension(filename):
+    filename = secure_filename(filename or '')
+    return filename.rsplit('.', 1)[1].lower()[:20] if '.' in filename else ''
+
+
+def blob_path(sha256, extension):
+    """Путь файла относительно UPLOADS_ROOT: blobs/<первые 2 символа хэша>/<хэш>.<расширение>."""
+    name = f"{sha256}.{extension}" if extension else sha256
+    return f"{BLOBS_DIR}/{sha256[:2]}/{name}"
+
+
+def upload_abspath(path_or_url):
+    """
+    Абсолютный путь загруженного файла по url (/uploads/...), пути uploads/... или пути относительно
+    UPLOADS_ROOT. Пути, выходящие за пределы каталога загрузок (в том числе через симлинки), - None.
+    """
+    if path_or_url and os.path.isabs(path_or_url) and path_or_url.startswith(UPLOADS_ROOT + os.sep):
+        relative = os.path.relpath(path_or_url, UPLOADS_ROOT).replace(os.sep, '/')
+    else:
+        relative = (path_or_url or '').lstrip('/')
+        if relative.startswith('uploads/'):
+            relative = relative[len('uploads/'):]
+
+    path = safe_join(UPLOADS_ROOT, relative)
+    if path is None:
+        return None
+    root = os.path.realpath(UPLOADS_ROOT)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        return None
+    return path
+
+
+def _parse_blob(path_or_url):
+    """(sha256, расширение) для файла из хранилища или None для прочих путей."""
+    relative = (path_or_url or '').lstrip('/')
+    if path_or_url and os.path.isabs(path_or_url) and path_or_url.startswith(UPLOADS_ROOT + os.sep):
+        relative = os.path.relpath(path_or_url, UPLOADS_ROOT).replace(os.sep, '/')
+    elif relative.startswith('uploads/'):
+        relative = relative[len('uploads/'):]
+    parts = relative.split('/')
+    if len(parts) != 3 or parts[0] != BLOBS_DIR:
+        return None
+    sha256, _, extension = parts[2].partition('.')
+    if len(sha256) != 64 or parts[1] != sha256[:2]:
+        return None
+    return sha256, extension
+
+
+def blob_sha256(path_or_url):
+    """SHA-256 содержимого для файла из хранилища или None для прочих путей."""
+    parsed = _parse_blob(path_or_url)
+    return parsed[0] if parsed else None
+
+
+def _add_reference(sha256, extension, size, content_type):
+    """Увеличивает счетчик ссылок или создает запись. Возвращает True, если содержимое уже было в хранилище."""
+    now = datetime.now(timezone.utc)
+    increment = update(StoredBlob).where(StoredBlob.sha256 == sha256, StoredBlob.extension == extension) \
+        .values(ref_count=StoredBlob.ref_count + 1, last_referenced_at=now)
+
+    if db.session.execute(increment).rowcount:
+        return True
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(StoredBlob).values(
+                sha256=sha256, extension=extension, size=size, content_type=content_type,
+                ref_count=1, created_at=now, last_referenced_at=now
+            ))
+        return False
+    except IntegrityError:
+        # Тот же файл параллельно загружен другим запросом
+        db.session.execute(increment)
+        return True
+
+
+def store_stream(stream, filename, content_type=None):
+    """
+    Сохраняет поток в хранилище по содержимому в текущей транзакции.
+    Поток пишется во временный файл с подсчетом SHA-256; если такое содержимое уже есть,
+    файл не сохраняется повторно и увеличивается только счетчик ссылок.
+    """
+    extension = _extension(filename)
+    os.makedirs(TMP_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=TMP_DIR)
+    try:
+        digest, size = hashlib.sha256(), 0
+        with os.fdopen(fd, 'wb') as output:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                output.write(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256, extension)
+        deduplicated = _add_reference(sha256, extension, size, content_type)
+        if not deduplicated:
+            db.session.info.setdefault('new_uploads', []).append(path)
+
+        target = os.path.join(UPLOADS_ROOT, path)
+        if os.path.exists(target):
+            # Обновленное время изменения защищает файл от удаления сборщиком как "осиротевшего"
+            os.utime(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return StoredUpload(path=path, url=f"/uploads/{path}", sha256=sha256, size=size, deduplicated=deduplicated)
+
+
+def store_upload(file):
+    """Сохраняет загруженный файл (werkzeug FileStorage) в хранилище. См. store_stream."""
+    return store_stream(file.stream, file.filename, file.mimetype or None)
+
+
+def store_local_file(file_path, filename=None, content_type=None):
+    """Переносит существующий файл с диска в хранилище (исходный файл не удаляется)."""
+    with open(file_path, 'rb') as stream:
+        return store_stream(stream, filename or os.path.basename(file_path), content_type)
+
+
+def release_upload(path_or_url):
+    """
+    Снимает ссылку на файл хранилища в текущей транзакции. Файлы без ссылок удаляет
+    collect_garbage. Для путей вне хранилища ничего не делает и возвращает False.
+    """
+    parsed = _parse_blob(path_or_url)
+    if parsed is None:
+        return False
+    sha256, extension = parsed
+    db.session.execute(
+        update(StoredBlob).where(StoredBlob.sha256 == sha256, StoredBlob.extension == extension,
+                                 StoredBlob.ref_count > 0)
+        .values(ref_count=StoredBlob.ref_count - 1)
+    )
+    return True
+
+
+def release_uploads(paths):
+    """
+    Снимает по одной ссылке за каждый элемент paths (например, старый список фото при замене).
+    Новые файлы к этому моменту уже получили собственные ссылки в store_upload/retain_upload,
+    поэтому повторно загруженное то же содержимое не удерживается лишней ссылкой.
+    """
+    for path in paths or []:
+        if isinstance(path, str):
+            release_upload(path)
+
+
+def retain_upload(path_or_url):
+    """
+    Добавляет ссылку на уже сохраненный файл хранилища (путь переиспользуется в новой записи).
+    Возвращает False для путей вне хранилища и неизвестных файлов.
+    """
+    parsed = _parse_blob(path_or_url)
+    if parsed is None:
+        return False
+    sha256, extension = parsed
+    result = db.session.execute(
+        update(StoredBlob).where(StoredBlob.sha256 == sha256, StoredBlob.extension == extension)
+        .values(ref_count=StoredBlob.ref_count + 1, last_referenced_at=datetime.now(timezone.utc))
+    )
+    return result.rowcount == 1
+
+
+def collect_garbage(grace_seconds=ORPHAN_GRACE_SECONDS):
+    """
+    Удаляет файлы без ссылок: записи с ref_count = 0 и файлы хранилища без записи в БД
+    старше grace_seconds (остаются после откаченных транзакций). Возвращает число удаленных файлов.
+    """
+    from upload_previews import remove_variants
+
+    removed = 0
+    unreferenced = db.session.query(StoredBlob.id, StoredBlob.sha256, StoredBlob.extension) \
+        .filter(StoredBlob.ref_count <= 0).all()
+    for blob_id, sha256, extension in unreferenced:
+        # Запись удаляется только если на нее по-прежнему нет ссылок; файл - до фиксации,
+        # чтобы параллельная загрузка того же содержимого создала его заново
+        result = db.session.execute(delete(StoredBlob).where(StoredBlob.id == blob_id, StoredBlob.ref_count <= 0))
+        if result.rowcount:
+            target = os.path.join(UPLOADS_ROOT, blob_path(sha256, extension))
+            if os.path.exists(target):
+                os.remove(target)
+                removed += 1
+            remove_variants(sha256)
+        db.session.commit()
+
+    blobs_root = os.path.join(UPLOADS_ROOT, BLOBS_DIR)
+    if not os.path.isdir(blobs_root):
+        return removed
+
+    known = {blob_path(sha256, extension) for sha256, extension in
+             db.session.query(StoredBlob.sha256, StoredBlob.extension)}
+    cutoff = time.time() - grace_seconds
+    for directory, _, files in os.walk(blobs_root):
+        for name in files:
+            full_path = os.path.join(directory, name)
+            relative = os.path.relpath(full_path, UPLOADS_ROOT).replace(os.sep, '/')
+            if relative not in known and os.path.getmtime(full_path) < cutoff:
+                os.remove(full_path)
+                removed += 1
+    return removed
+
+
+@event.listens_for(Session, 'after_commit')
+def _enqueue_committed_previews(session):
+    paths = session.info.pop('new_uploads', None)
+    if paths:
+        from upload_previews import enqueue_variants
+
+        enqueue_variants(paths)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_uploads(session):
+    session.info.pop('new_uploads', None)
@@ -0,0 +1,201 @@
+import threading
+from datetime import date, timedelta
+import numpy as np
+from models import db, Project, WorkCalendar
+
+CALENDAR_START = date(2000, 1, 1)
+CALENDAR_END = date(2100, 12, 31)
+DEFAULT_WEEKMASK = '1111100'
+# Нерабочие праздничные дни по ст. 112 ТК РФ (месяц, день)
+DEFAULT_PUBLIC_HOLIDAYS = (
+    (1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (1, 6), (1, 7), (1, 8),
+    (2, 23), (3, 8), (5, 1), (5, 9), (6, 12), (11, 4),
+)
+
+_calendar_cache = {}
+_calendar_cache_lock = threading.Lock()
+
+
+def _parse_dates(values):
+    return [date.fromisoformat(str(value)[:10]) for value in values or ()]
+
+
+def default_holidays():
+    return [
+        date(year, month, day)
+        for year in range(CALENDAR_START.year, CALENDAR_END.year + 1)
+        for month, day in DEFAULT_PUBLIC_HOLIDAYS
+    ]
+
+
+class BusinessCalendar:
+    """
+    Рабочий календарь с заранее рассчитанными массивами рабочих дней.
+    Признак рабочего дня и накопленное число рабочих дней хранятся для всего
+    диапазона CALENDAR_START..CALENDAR_END, поэтому подсчет рабочих дней
+    между датами и сдвиг на N рабочих дней выполняются без перебора дат.
+    Даты вне диапазона приводятся к его границам.
+    """
+
+    def __init__(self, weekmask=DEFAULT_WEEKMASK, holidays=(), working_days=(), calendar_id=None, revision=0):
+        self.calendar_id = calendar_id
+        self.revision = revision
+        self.weekmask = weekmask
+
+        days = np.arange(np.datetime64(CALENDAR_START), np.datetime64(CALENDAR_END) + 1)
+        is_working = np.is_busday(days, weekmask=weekmask, holidays=np.array(holidays, dtype='datetime64[D]'))
+        extra = [self._offset(day) for day in working_days]
+        if extra:
+            is_working[extra] = True
+
+        self._is_working = is_working
+        # _cumulative[i] - число рабочих дней в диапазоне [CALENDAR_START, CALENDAR_START + i)
+        self._cumulative = np.concatenate(([0], np.cumsum(is_working, dtype=np.int64)))
+        self._working_offsets = np.flatnonzero(is_working)
+
+    @classmethod
+    def from_model(cls, calendar):
+        return cls(
+            weekmask=calendar.weekmask or DEFAULT_WEEKMASK,
+            holidays=_parse_dates(calendar.holidays),
+            working_days=_parse_dates(calendar.working_days),
+            calendar_id=calendar.id,
+            revision=calendar.revision
+        )
+
+    @staticmethod
+    def _offset(day):
+        offset = (day - CALENDAR_START).days
+        return min(max(offset, 0), (CALENDAR_END - CALENDAR_START).days)
+
+    def _date(self, offset):
+        return CALENDAR_START + timedelta(days=int(offset))
+
+    def is_working_day(self, day):
+        return bool(self._is_working[self._offset(day)])
+
+    def working_days_between(self, start_date, end_date):
+        """Число рабочих дней в диапазоне [start_date, end_date] включительно."""
+        if end_date < start_date:
+            return 0
+        return int(self._cumulative[self._offset(end_date) + 1] - self._cumulative[self._offset(start_date)])
+
+    def cumulative_working_days(self, start_date, end_date):
+        """
+        Накопленное число рабочих дней по диапазону дат: элемент k равен числу
+        рабочих дней в [start_date, start_date + k), длина массива - число дней + 1.
+        """
+        first = self._offset(start_date)
+        last = self._offset(end_date)
+        return self._cumulative[first:last + 2] - self._cumulative[first]
+
+    def working_day_index(self, day):
+        """Порядковый номер первого рабочего дня, не раньше указанного, от начала календаря."""
+        return int(self._cumulative[self._offset(day)])
+
+    def working_day_dates(self, indexes):
+        """Даты рабочих дней по массиву порядковых номеров (обратное к working_day_index)."""
+        indexes = np.clip(np.asarray(indexes), 0, len(self._working_offsets) - 1)
+        return np.datetime64(CALENDAR_START, 'D') + self._working_offsets[indexes]
+
+    def next_working_day(self, day):
+        """Ближайший рабочий день, не раньше указанного."""
+        index = self._cumulative[self._offset(day)]
+        if index >= len(self._working_offsets):
+            return day
+        return self._date(self._working_offsets[index])
+
+    def add_working_days(self, day, count):
+        """Дата, отстоящая от day на count рабочих дней вперед (day не учитывается)."""
+        if count <= 0:
+            return day
+        index = self._cumulative[self._offset(day) + 1] + count - 1
+        index = min(index, len(self._working_offsets) - 1)
+        return self._date(self._working_offsets[index])
+
+    def expected_progress(self, start_date, end_date, current_date):
+        """
+        Ожидаемый процент выполнения работы на дату при линейном выполнении
+        по рабочим дням: выходные и праздники не считаются отставанием.
+        """
+        if current_date <= start_date:
+            return 0.0
+        if current_date >= end_date:
+            return 100.0
+
+        total_days = self.working_days_between(start_date, end_date)
+        if total_days == 0:
+            return 100.0
+        elapsed_days = self.working_days_between(start_date, current_date - timedelta(days=1))
+        return (elapsed_days / total_days) * 100.0
+
+    def split_range(self, start_date, end_date, parts):
+        """
+        Делит период на parts последовательных отрезков с равным числом рабочих дней.
+        Возвращает список пар (начало, окончание); последний отрезок заканчивается end_date.
+        """
+        if parts <= 0:
+            return []
+
+        first = int(self._cumulative[self._offset(start_date)])
+        last = int(self._cumulative[self._offset(end_date) + 1]) - 1
+        working_count = last - first + 1
+        if working_count <= 0:
+            return [(start_date, end_date)] * parts
+
+        per_part = max(1, working_count // parts)
+        part_index = np.arange(parts)
+        starts = first + np.minimum(part_index * per_part, working_count - 1)
+        ends = first + np.minimum((part_index + 1) * per_part - 1, working_count - 1)
+
+        ranges = [
+            (self._date(self._working_offsets[s]), self._date(self._working_offsets[e]))
+            for s, e in zip(starts, ends)
+        ]
+        ranges[0] = (start_date, ranges[0][1])
+        ranges[-1] = (ranges[-1][0], end_date)
+        return ranges
+
+
+_builtin_calendar = None
+
+
+def get_builtin_calendar():
+    """Календарь по умолчанию: пятидневка и государственные праздники."""
+    global _builtin_calendar
+    if _builtin_calendar is None:
+        _builtin_calendar = BusinessCalendar(holidays=default_holidays())
+    return _builtin_calendar
+
+
+def get_calendar(calendar_id=None):
+    """
+    Возвращает рабочий календарь из кэша процесса.
+    Массивы рабочих дней перестраиваются только при изменении ревизии календаря.
+    Без calendar_id используется календарь, отмеченный как календарь по умолчанию,
+    а при его отсутствии - встроенный.
+    """
+    query = db.session.query(WorkCalendar.id, WorkCalendar.revision)
+    if calendar_id is not None:
+        query = query.filter(WorkCalendar.id == calendar_id)
+    else:
+        query = query.filter(WorkCalendar.is_default.is_(True)).order_by(WorkCalendar.id)
+    row = query.first()
+    if row is None:
+        return get_builtin_calendar()
+
+    with _calendar_cache_lock:
+        cached = _calendar_cache.get(row.id)
+    if cached is not None and cached.revision == row.revision:
+        return cached
+
+    calendar = BusinessCalendar.from_model(db.session.get(WorkCalendar, row.id))
+    with _calendar_cache_lock:
+        _calendar_cache[row.id] = calendar
+    return calendar
+
+
+def get_project_calendar(project_id):
+    """Рабочий календарь проекта; если календарь не назначен - календарь по умолчанию."""
+    calendar_id = db.session.query(Project.work_calendar_id).filter(Project.id == project_id).scalar()
+    return get_calendar(calendar_id)
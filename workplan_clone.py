@@ -0,0 +1,137 @@
+from datetime import timedelta
+from sqlalchemy import select, insert, delete, func, literal, type_coerce
+from models import (db, WorkPlan, WorkPlanItem, RequiredMaterial, WorkPlanTemplate, WorkPlanTemplateItem,
+                    WorkPlanTemplateMaterial)
+from workplan_history import record_snapshot
+
+# Описание хранилища структуры плана: модель работ, ссылка на владельца, модель материалов, ссылка на работу
+PLAN_STRUCTURE = (WorkPlanItem, 'work_plan_id', RequiredMaterial, 'work_item_id')
+TEMPLATE_STRUCTURE = (WorkPlanTemplateItem, 'template_id', WorkPlanTemplateMaterial, 'template_item_id')
+
+
+class WorkPlanCloneError(ValueError):
+    """План или шаблон не может быть скопирован (нет исходного плана, план уже существует)."""
+
+
+def _shift_date(column, days):
+    """Сдвиг даты на целое число дней в SQL (SQLite не поддерживает арифметику над DATE)."""
+    if not days:
+        return column
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return type_coerce(func.date(column, f'{days:+d} days'), db.Date)
+    return column + days
+
+
+def _ranked_items(item_model, owner_column, owner_id, offset_days):
+    """Работы владельца с порядковым номером (order, id) - по нему сопоставляются копии и оригиналы."""
+    return select(
+        item_model.id,
+        (func.row_number().over(order_by=(item_model.order, item_model.id)) - 1).label('rank'),
+        item_model.name,
+        item_model.unit,
+        item_model.quantity,
+        _shift_date(item_model.start_date, offset_days).label('start_date'),
+        _shift_date(item_model.end_date, offset_days).label('end_date'),
+        item_model.budget
+    ).where(getattr(item_model, owner_column) == owner_id).subquery()
+
+
+def copy_structure(source, source_id, target, target_id, offset_days=0):
+    """
+    Копирует работы и плановые материалы между планами и шаблонами двумя запросами
+    INSERT ... SELECT без загрузки строк в приложение. Порядок работ в копии нормализуется
+    к 0..n-1, и материалы привязываются к новым работам по этому номеру.
+    Возвращает (число работ, число материалов).
+    """
+    source_item, source_owner, source_material, source_material_item = source
+    target_item, target_owner, target_material, target_material_item = target
+
+    ranked = _ranked_items(source_item, source_owner, source_id, offset_days)
+    items_result = db.session.execute(
+        insert(target_item).from_select(
+            [target_owner, 'name', 'unit', 'quantity', 'start_date', 'end_date', 'order', 'budget'],
+            select(literal(target_id), ranked.c.name, ranked.c.unit, ranked.c.quantity,
+                   ranked.c.start_date, ranked.c.end_date, ranked.c.rank, ranked.c.budget)
+        )
+    )
+
+    ranked = _ranked_items(source_item, source_owner, source_id, 0)
+    materials_result = db.session.execute(
+        insert(target_material).from_select(
+            [target_material_item, 'material_id', 'planned_quantity'],
+            select(target_item.id, source_material.material_id, source_material.planned_quantity)
+            .select_from(ranked)
+            .join(source_material, getattr(source_material, source_material_item) == ranked.c.id)
+            .join(target_item, (getattr(target_item, target_owner) == target_id) & (target_item.order == ranked.c.rank))
+        )
+    )
+    return items_result.rowcount, materials_result.rowcount
+
+
+def _create_plan(project_id, start_date, end_date):
+    if db.session.query(WorkPlan.id).filter(WorkPlan.project_id == project_id).first():
+        raise WorkPlanCloneError('План работ для этого проекта уже существует')
+    work_plan = WorkPlan(project_id=project_id, start_date=start_date, end_date=end_date)
+    db.session.add(work_plan)
+    db.session.flush()
+    return work_plan
+
+
+def clone_work_plan(source_project_id, target_project_id, start_date=None, offset_days=None, user_id=None):
+    """
+    Копирует план работ проекта в другой проект со сдвигом сроков: на offset_days дней
+    или так, чтобы план начинался с start_date. Фиксация транзакции - на вызывающей стороне.
+    """
+    source = WorkPlan.query.filter_by(project_id=source_project_id).first()
+    if not source:
+        raise WorkPlanCloneError('У исходного проекта нет плана работ')
+
+    if start_date is not None:
+        offset_days = (start_date - source.start_date).days
+    offset_days = int(offset_days or 0)
+
+    work_plan = _create_plan(target_project_id, source.start_date + timedelta(days=offset_days),
+                             source.end_date + timedelta(days=offset_days))
+    items_count, materials_count = copy_structure(PLAN_STRUCTURE, source.id, PLAN_STRUCTURE, work_plan.id, offset_days)
+    record_snapshot(work_plan.id, 0, user_id=user_id)
+    return work_plan, {'items_copied': items_count, 'materials_copied': materials_count, 'offset_days': offset_days}
+
+
+def create_template_from_plan(project_id, name, user_id, description=None):
+    """Сохраняет структуру плана работ проекта как шаблон."""
+    work_plan = WorkPlan.query.filter_by(project_id=project_id).first()
+    if not work_plan:
+        raise WorkPlanCloneError('У проекта нет плана работ')
+
+    template = WorkPlanTemplate(
+        name=name,
+        description=description,
+        created_by_id=user_id,
+        source_project_id=project_id,
+        start_date=work_plan.start_date,
+        end_date=work_plan.end_date
+    )
+    db.session.add(template)
+    db.session.flush()
+    template.items_count, _ = copy_structure(PLAN_STRUCTURE, work_plan.id, TEMPLATE_STRUCTURE, template.id)
+    return template
+
+
+def apply_template(template, project_id, start_date, user_id=None):
+    """Создает план работ проекта из шаблона, начинающийся с start_date."""
+    offset_days = (start_date - template.start_date).days
+    work_plan = _create_plan(project_id, start_date, template.end_date + timedelta(days=offset_days))
+    items_count, materials_count = copy_structure(TEMPLATE_STRUCTURE, template.id, PLAN_STRUCTURE, work_plan.id, offset_days)
+    record_snapshot(work_plan.id, 0, user_id=user_id)
+    return work_plan, {'items_copied': items_count, 'materials_copied': materials_count, 'offset_days': offset_days}
+
+
+def delete_template(template_id):
+    """Удаляет шаблон с работами и материалами тремя запросами DELETE."""
+    item_ids = select(WorkPlanTemplateItem.id).where(WorkPlanTemplateItem.template_id == template_id)
+    db.session.execute(delete(WorkPlanTemplateMaterial).where(WorkPlanTemplateMaterial.template_item_id.in_(item_ids)),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(delete(WorkPlanTemplateItem).where(WorkPlanTemplateItem.template_id == template_id),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(delete(WorkPlanTemplate).where(WorkPlanTemplate.id == template_id),
+                       execution_options={'synchronize_session': False})
@@ -0,0 +1,145 @@
+import csv
+import io
+import tempfile
+from openpyxl import Workbook
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
+from models import (db, WorkPlan, WorkPlanItem, RequiredMaterial, Material, Task, ConsumptionLog,
+                    MaterialDelivery, MaterialDeliveryItem, User)
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _user_name(user):
+    return func.trim(func.coalesce(user.last_name, '') + ' ' + func.coalesce(user.first_name, ''))
+
+
+def _plan_query(project_id):
+    return select(
+        WorkPlanItem.id, WorkPlanItem.order, WorkPlanItem.name, WorkPlanItem.unit, WorkPlanItem.quantity,
+        WorkPlanItem.start_date, WorkPlanItem.end_date, WorkPlanItem.status, WorkPlanItem.progress,
+        WorkPlanItem.actual_quantity_total, WorkPlanItem.tasks_total, WorkPlanItem.tasks_completed,
+        WorkPlanItem.budget, Material.name, Material.unit, RequiredMaterial.planned_quantity
+    ).join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id) \
+     .outerjoin(RequiredMaterial, RequiredMaterial.work_item_id == WorkPlanItem.id) \
+     .outerjoin(Material, Material.id == RequiredMaterial.material_id) \
+     .where(WorkPlan.project_id == project_id) \
+     .order_by(WorkPlanItem.order, WorkPlanItem.id, Material.name)
+
+
+def _tasks_query(project_id):
+    completed_by = aliased(User)
+    return select(
+        Task.id, Task.work_plan_item_id, WorkPlanItem.name, Task.name, Task.status,
+        Task.start_date, Task.end_date, Task.projected_end_date, Task.completed_at,
+        _user_name(completed_by), Task.actual_quantity, Task.completion_comment
+    ).outerjoin(WorkPlanItem, WorkPlanItem.id == Task.work_plan_item_id) \
+     .outerjoin(completed_by, completed_by.id == Task.completed_by_id) \
+     .where(Task.project_id == project_id) \
+     .order_by(Task.end_date, Task.id)
+
+
+def _consumption_query(project_id):
+    return select(
+        ConsumptionLog.id, ConsumptionLog.consumption_date, WorkPlanItem.id, WorkPlanItem.name,
+        Material.name, Material.unit, ConsumptionLog.quantity_used, _user_name(User)
+    ).join(WorkPlanItem, WorkPlanItem.id == ConsumptionLog.work_item_id) \
+     .join(WorkPlan, WorkPlanItem.work_plan_id == WorkPlan.id) \
+     .join(Material, Material.id == ConsumptionLog.material_id) \
+     .outerjoin(User, User.id == ConsumptionLog.foreman_id) \
+     .where(WorkPlan.project_id == project_id) \
+     .order_by(ConsumptionLog.consumption_date, ConsumptionLog.id)
+
+
+def _deliveries_query(project_id):
+    return select(
+        MaterialDelivery.id, MaterialDelivery.delivery_date, MaterialDelivery.validation_status,
+        MaterialDelivery.document_id, Material.name, Material.unit, MaterialDeliveryItem.quantity,
+        _user_name(User)
+    ).join(MaterialDeliveryItem, MaterialDeliveryItem.delivery_id == MaterialDelivery.id) \
+     .join(Material, Material.id == MaterialDeliveryItem.material_id) \
+     .outerjoin(User, User.id == MaterialDelivery.foreman_id) \
+     .where(MaterialDelivery.project_id == project_id) \
+     .order_by(MaterialDelivery.delivery_date, MaterialDelivery.id, MaterialDeliveryItem.id)
+
+
+# Раздел выгрузки: название листа, заголовки колонок, построитель запроса
+EXPORT_SECTIONS = {
+    'plan': ('План работ', [
+        'ID работы', '№', 'Наименование', 'Ед. изм.', 'Объем', 'Начало', 'Окончание', 'Статус',
+        'Прогресс, %', 'Выполнено', 'Задач всего', 'Задач выполнено', 'Бюджет',
+        'Материал', 'Ед. изм. материала', 'Плановый расход'
+    ], _plan_query),
+    'tasks': ('Задачи', [
+        'ID задачи', 'ID работы', 'Работа', 'Задача', 'Статус', 'Начало', 'Окончание',
+        'Прогноз окончания', 'Выполнена', 'Исполнитель', 'Фактический объем', 'Комментарий'
+    ], _tasks_query),
+    'consumption': ('Расход материалов', [
+        'ID записи', 'Дата', 'ID работы', 'Работа', 'Материал', 'Ед. изм.', 'Количество', 'Прораб'
+    ], _consumption_query),
+    'deliveries': ('Поставки', [
+        'ID поставки', 'Дата', 'Статус проверки', 'ID документа', 'Материал', 'Ед. изм.', 'Количество', 'Прораб'
+    ], _deliveries_query),
+}
+
+
+def iter_section_rows(project_id, section):
+    """
+    Построчно выдает данные раздела выгрузки. Строки читаются курсором порциями
+    по EXPORT_BATCH_SIZE (yield_per), объекты ORM не создаются.
+    """
+    _, _, build_query = EXPORT_SECTIONS[section]
+    result = db.session.execute(build_query(project_id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+    try:
+        for row in result:
+            yield tuple(row)
+    finally:
+        result.close()
+
+
+def _csv_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return '' if value is None else value
+
+
+def iter_csv(project_id, section):
+    """CSV раздела (разделитель ';', UTF-8 с BOM для Excel), по одной строке за раз."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+
+    writer.writerow(EXPORT_SECTIONS[section][1])
+    yield '\ufeff' + flush()
+    for row in iter_section_rows(project_id, section):
+        writer.writerow([_csv_value(value) for value in row])
+        yield flush()
+
+
+def iter_xlsx(project_id, sections):
+    """
+    Книга xlsx с листом на каждый раздел. Книга строится в режиме write-only
+    (строки сразу сбрасываются во временный файл), затем файл отдается частями.
+    """
+    workbook = Workbook(write_only=True)
+    for section in sections:
+        title, headers, _ = EXPORT_SECTIONS[section]
+        sheet = workbook.create_sheet(title=title)
+        sheet.append(headers)
+        for row in iter_section_rows(project_id, section):
+            sheet.append(row)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,221 @@
+from datetime import date
+from sqlalchemy import insert
+from models import db, WorkPlan, WorkPlanItem, WorkPlanRevision
+
+# Каждая SNAPSHOT_INTERVAL-я ревизия хранится полным снимком, остальные - дельтами,
+# поэтому восстановление любой ревизии применяет не более SNAPSHOT_INTERVAL - 1 дельт
+SNAPSHOT_INTERVAL = 20
+VERSIONED_ITEM_FIELDS = ('name', 'unit', 'quantity', 'start_date', 'end_date', 'status', 'budget', 'order')
+
+
+class WorkPlanRevisionNotFound(LookupError):
+    """Запрошенная ревизия плана не сохранена в истории."""
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def item_state(item):
+    """Версионируемые поля работы (объекта или строки запроса) в виде, пригодном для JSON."""
+    return {field: _json_value(getattr(item, field)) for field in VERSIONED_ITEM_FIELDS}
+
+
+def plan_state(work_plan_id):
+    """Текущее состояние плана из рабочих таблиц: сроки плана и работы по id."""
+    plan = db.session.query(WorkPlan.start_date, WorkPlan.end_date).filter(WorkPlan.id == work_plan_id).one()
+    items = db.session.query(
+        WorkPlanItem.id, *(getattr(WorkPlanItem, field) for field in VERSIONED_ITEM_FIELDS)
+    ).filter(WorkPlanItem.work_plan_id == work_plan_id)
+    return {
+        'plan': {'start_date': _json_value(plan.start_date), 'end_date': _json_value(plan.end_date)},
+        'items': {str(row.id): item_state(row) for row in items}
+    }
+
+
+def diff_states(old, new):
+    """Компактная дельта между состояниями: только измененные поля, добавленные и удаленные работы."""
+    plan = {field: value for field, value in new['plan'].items() if old['plan'].get(field) != value}
+    added = {item_id: fields for item_id, fields in new['items'].items() if item_id not in old['items']}
+    removed = sorted((item_id for item_id in old['items'] if item_id not in new['items']), key=int)
+    changed = {}
+    for item_id, fields in new['items'].items():
+        previous = old['items'].get(item_id)
+        if previous is not None:
+            fields_changed = {field: value for field, value in fields.items() if previous.get(field) != value}
+            if fields_changed:
+                changed[item_id] = fields_changed
+    return {'plan': plan, 'added': added, 'changed': changed, 'removed': removed}
+
+
+def delta_from_patch(result):
+    """Дельта из результата apply_work_plan_patch без повторного чтения плана."""
+    return {
+        'plan': {field: _json_value(value) for field, value in result['plan'].items()},
+        'added': {
+            str(item['id']): {field: _json_value(item.get(field)) for field in VERSIONED_ITEM_FIELDS}
+            for item in result['added']
+        },
+        'changed': {
+            str(item_id): {field: _json_value(value) for field, value in fields.items()}
+            for item_id, fields in result['updated'].items() if fields
+        },
+        'removed': sorted(str(item_id) for item_id in result['deleted'])
+    }
+
+
+def apply_delta(state, delta):
+    """Применяет дельту к состоянию плана (состояние изменяется на месте)."""
+    state['plan'].update(delta.get('plan', {}))
+    items = state['items']
+    for item_id in delta.get('removed', []):
+        items.pop(item_id, None)
+    for item_id, fields in delta.get('changed', {}).items():
+        items.setdefault(item_id, {}).update(fields)
+    for item_id, fields in delta.get('added', {}).items():
+        items[item_id] = dict(fields)
+    return state
+
+
+def _has_history(work_plan_id):
+    return db.session.query(
+        db.session.query(WorkPlanRevision.id).filter(WorkPlanRevision.work_plan_id == work_plan_id).exists()
+    ).scalar()
+
+
+def ensure_baseline(work_plan_id, revision):
+    """
+    Сохраняет снимок текущего состояния, если у плана еще нет истории
+    (планы, созданные до появления версионирования). Вызывается до изменения плана.
+    """
+    if not _has_history(work_plan_id):
+        record_snapshot(work_plan_id, revision)
+
+
+def record_snapshot(work_plan_id, revision, user_id=None, state=None):
+    db.session.execute(insert(WorkPlanRevision), [{
+        'work_plan_id': work_plan_id,
+        'revision': revision,
+        'kind': 'snapshot',
+        'data': state if state is not None else plan_state(work_plan_id),
+        'created_by_id': user_id
+    }])
+
+
+def record_revision(work_plan_id, revision, delta, user_id=None):
+    """
+    Сохраняет ревизию плана: на границе SNAPSHOT_INTERVAL - полный снимок текущего
+    состояния, иначе - переданную дельту. Фиксация транзакции - на вызывающей стороне.
+    """
+    if revision % SNAPSHOT_INTERVAL == 0:
+        record_snapshot(work_plan_id, revision, user_id=user_id)
+        return
+    db.session.execute(insert(WorkPlanRevision), [{
+        'work_plan_id': work_plan_id,
+        'revision': revision,
+        'kind': 'delta',
+        'data': delta,
+        'created_by_id': user_id
+    }])
+
+
+def reconstruct_state(work_plan_id, revision):
+    """
+    Восстанавливает состояние плана на ревизию: ближайший предшествующий снимок
+    и дельты после него (не более SNAPSHOT_INTERVAL - 1).
+    """
+    snapshot = db.session.query(WorkPlanRevision.revision, WorkPlanRevision.data).filter(
+        WorkPlanRevision.work_plan_id == work_plan_id,
+        WorkPlanRevision.kind == 'snapshot',
+        WorkPlanRevision.revision <= revision
+    ).order_by(WorkPlanRevision.revision.desc()).first()
+    if snapshot is None:
+        raise WorkPlanRevisionNotFound(f'Ревизия {revision} отсутствует в истории плана')
+
+    state = {'plan': dict(snapshot.data['plan']), 'items': {k: dict(v) for k, v in snapshot.data['items'].items()}}
+    deltas = db.session.query(WorkPlanRevision.revision, WorkPlanRevision.data).filter(
+        WorkPlanRevision.work_plan_id == work_plan_id,
+        WorkPlanRevision.kind == 'delta',
+        WorkPlanRevision.revision > snapshot.revision,
+        WorkPlanRevision.revision <= revision
+    ).order_by(WorkPlanRevision.revision).all()
+
+    if snapshot.revision + len(deltas) != revision:
+        raise WorkPlanRevisionNotFound(f'Ревизия {revision} отсутствует в истории плана')
+    for delta in deltas:
+        apply_delta(state, delta.data)
+    return state
+
+
+def baseline_revision(work_plan_id):
+    """Первая сохраненная ревизия плана (базовый план)."""
+    return db.session.query(db.func.min(WorkPlanRevision.revision)).filter(
+        WorkPlanRevision.work_plan_id == work_plan_id
+    ).scalar()
+
+
+def state_to_dict(state, revision):
+    items = sorted(state['items'].items(), key=lambda pair: (pair[1].get('order') or 0, int(pair[0])))
+    return {
+        'revision': revision,
+        'start_date': state['plan'].get('start_date'),
+        'end_date': state['plan'].get('end_date'),
+        'items': [{'id': int(item_id), **fields} for item_id, fields in items]
+    }
+
+
+def _days_between(old, new):
+    if not old or not new:
+        return None
+    return (date.fromisoformat(new) - date.fromisoformat(old)).days
+
+
+def compare_states(base, target):
+    """
+    Сравнение двух состояний плана: сдвиги сроков, изменения объемов,
+    добавленные и удаленные работы, прочие измененные поля.
+    """
+    moved, quantity_changed, other_changed = [], [], []
+    for item_id, fields in target['items'].items():
+        old = base['items'].get(item_id)
+        if old is None:
+            continue
+        entry = {'id': int(item_id), 'name': fields.get('name')}
+        if old.get('start_date') != fields.get('start_date') or old.get('end_date') != fields.get('end_date'):
+            moved.append({
+                **entry,
+                'start_date': {'from': old.get('start_date'), 'to': fields.get('start_date')},
+                'end_date': {'from': old.get('end_date'), 'to': fields.get('end_date')},
+                'start_shift_days': _days_between(old.get('start_date'), fields.get('start_date')),
+                'end_shift_days': _days_between(old.get('end_date'), fields.get('end_date'))
+            })
+        if old.get('quantity') != fields.get('quantity'):
+            quantity_changed.append({
+                **entry,
+                'unit': fields.get('unit'),
+                'from': old.get('quantity'),
+                'to': fields.get('quantity'),
+                'delta': (fields.get('quantity') or 0) - (old.get('quantity') or 0)
+            })
+        changes = {
+            field: {'from': old.get(field), 'to': fields.get(field)}
+            for field in ('name', 'unit', 'status', 'budget', 'order')
+            if old.get(field) != fields.get(field)
+        }
+        if changes:
+            other_changed.append({**entry, 'changes': changes})
+
+    added = [{'id': int(item_id), **fields} for item_id, fields in target['items'].items() if item_id not in base['items']]
+    removed = [{'id': int(item_id), **fields} for item_id, fields in base['items'].items() if item_id not in target['items']]
+    return {
+        'plan': {
+            field: {'from': base['plan'].get(field), 'to': target['plan'].get(field)}
+            for field in ('start_date', 'end_date')
+            if base['plan'].get(field) != target['plan'].get(field)
+        },
+        'moved': sorted(moved, key=lambda entry: entry['id']),
+        'quantity_changed': sorted(quantity_changed, key=lambda entry: entry['id']),
+        'other_changed': sorted(other_changed, key=lambda entry: entry['id']),
+        'added': sorted(added, key=lambda entry: entry['id']),
+        'removed': sorted(removed, key=lambda entry: entry['id'])
+    }
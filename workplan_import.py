@@ -0,0 +1,264 @@
+import os
+from datetime import datetime, timezone
+from openpyxl import load_workbook
+from sqlalchemy import insert, update
+from models import db, WorkPlan, WorkPlanItem, WorkPlanImport, RequiredMaterial, Material
+from work_calendar import get_project_calendar
+from workplan_history import record_snapshot
+
+IMPORT_BATCH_SIZE = 500
+# Файлы больше этого размера импортируются фоновой задачей
+ASYNC_IMPORT_THRESHOLD = 512 * 1024
+HEADER_ROWS = 5
+MAX_REPORTED_ERRORS = 200
+
+# Колонки сметы: № п/п, наименование работы, ед. изм., объем, материал, плановый расход материала
+COLUMN_NUMBER, COLUMN_NAME, COLUMN_UNIT, COLUMN_QUANTITY, COLUMN_MATERIAL, COLUMN_MATERIAL_QUANTITY = range(6)
+
+
+class WorkPlanImportError(ValueError):
+    """Файл не может быть импортирован целиком (нет сроков или работ)."""
+
+
+def _cell(row, index):
+    value = row[index] if len(row) > index else None
+    if isinstance(value, str):
+        value = value.strip()
+    return value if value not in ('', None) else None
+
+
+def _parse_period(value):
+    dates = str(value).split('-')
+    if len(dates) != 2:
+        return None
+    try:
+        return (datetime.strptime(dates[0].strip(), '%d.%m.%Y').date(),
+                datetime.strptime(dates[1].strip(), '%d.%m.%Y').date())
+    except ValueError:
+        return None
+
+
+def _parse_material(row, materials_by_name):
+    name = str(_cell(row, COLUMN_MATERIAL))
+    material_id = materials_by_name.get(name.lower())
+    if material_id is None:
+        return None, f"Материал '{name}' не найден в справочнике"
+    try:
+        quantity = float(_cell(row, COLUMN_MATERIAL_QUANTITY))
+    except (TypeError, ValueError):
+        return None, f"Неверный плановый расход материала '{name}'"
+    if quantity <= 0:
+        return None, f"Плановый расход материала '{name}' должен быть больше нуля"
+    return (material_id, quantity), None
+
+
+def iter_records(source, materials_by_name):
+    """
+    Построчно читает смету в режиме read-only и выдает записи (вид, номер строки, данные):
+    'period' - сроки выполнения работ, 'item' - работа, 'material' - плановый материал
+    последней работы, 'error' - ошибка проверки строки. Файл в память целиком не загружается.
+    """
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for row_idx, row in enumerate(workbook.active.iter_rows(values_only=True), start=1):
+            first_cell = _cell(row, COLUMN_NUMBER)
+            name = _cell(row, COLUMN_NAME)
+
+            if first_cell and 'срок' in str(first_cell).lower() and name:
+                period = _parse_period(name)
+                if period:
+                    yield 'period', row_idx, period
+                elif '-' in str(name):
+                    yield 'error', row_idx, 'Не удалось разобрать сроки выполнения работ, ожидается ДД.ММ.ГГГГ - ДД.ММ.ГГГГ'
+                continue
+
+            if row_idx <= HEADER_ROWS:
+                continue
+
+            if not first_cell:
+                if not name and _cell(row, COLUMN_MATERIAL):
+                    material, error = _parse_material(row, materials_by_name)
+                    yield ('error', row_idx, error) if error else ('material', row_idx, material)
+                continue
+
+            unit = _cell(row, COLUMN_UNIT)
+            raw_quantity = _cell(row, COLUMN_QUANTITY)
+            if not name or (unit is None and raw_quantity is None):
+                continue
+
+            try:
+                quantity = float(raw_quantity)
+            except (TypeError, ValueError):
+                yield 'error', row_idx, f"Неверный объем работы: '{raw_quantity}'"
+                continue
+            if len(str(name)) <= 3:
+                yield 'error', row_idx, 'Слишком короткое наименование работы'
+                continue
+            if not unit:
+                yield 'error', row_idx, 'Не указана единица измерения'
+                continue
+            if quantity <= 0:
+                yield 'error', row_idx, 'Объем работы должен быть больше нуля'
+                continue
+
+            yield 'item', row_idx, {'name': str(name), 'unit': str(unit), 'quantity': quantity}
+
+            if _cell(row, COLUMN_MATERIAL):
+                material, error = _parse_material(row, materials_by_name)
+                yield ('error', row_idx, error) if error else ('material', row_idx, material)
+    finally:
+        workbook.close()
+
+
+def import_work_plan_file(project_id, source, progress_callback=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Импортирует план работ из xlsx-файла в два прохода: первый находит сроки и считает
+    работы (для распределения сроков по рабочим дням), второй вставляет работы и плановые
+    материалы пакетами по batch_size строк. Память ограничена размером пакета.
+    Ошибочные строки пропускаются и попадают в отчет. Фиксация транзакции - на вызывающей стороне;
+    progress_callback(rows_processed, report) вызывается после каждого пакета.
+    """
+    materials_by_name = {name.lower(): material_id for material_id, name in db.session.query(Material.id, Material.name)}
+
+    period, item_count, rows_total = None, 0, 0
+    for kind, row_idx, payload in iter_records(source, materials_by_name):
+        rows_total = row_idx
+        if kind == 'period':
+            period = payload
+        elif kind == 'item':
+            item_count += 1
+
+    if not period:
+        raise WorkPlanImportError('Не удалось определить сроки выполнения работ из файла')
+    if item_count == 0:
+        raise WorkPlanImportError('Не удалось извлечь работы из файла')
+
+    start_date, end_date = period
+    work_plan = WorkPlan(project_id=project_id, start_date=start_date, end_date=end_date)
+    db.session.add(work_plan)
+    db.session.flush()
+
+    item_ranges = get_project_calendar(project_id).split_range(start_date, end_date, item_count)
+    report = {
+        'work_plan_id': work_plan.id,
+        'rows_total': rows_total,
+        'items_imported': 0,
+        'materials_imported': 0,
+        'errors': [],
+        'errors_count': 0
+    }
+    batch = []
+
+    def flush_batch(rows_processed):
+        if batch:
+            item_ids = db.session.scalars(
+                insert(WorkPlanItem).returning(WorkPlanItem.id, sort_by_parameter_order=True),
+                [item for item, _ in batch]
+            ).all()
+            material_rows = [
+                {'work_item_id': item_id, 'material_id': material_id, 'planned_quantity': quantity}
+                for item_id, (_, materials) in zip(item_ids, batch)
+                for material_id, quantity in materials.items()
+            ]
+            if material_rows:
+                db.session.execute(insert(RequiredMaterial), material_rows)
+            report['items_imported'] += len(batch)
+            report['materials_imported'] += len(material_rows)
+            batch.clear()
+        if progress_callback:
+            progress_callback(rows_processed, report)
+
+    for kind, row_idx, payload in iter_records(source, materials_by_name):
+        if kind == 'item':
+            if len(batch) >= batch_size:
+                flush_batch(row_idx - 1)
+            index = report['items_imported'] + len(batch)
+            item_start, item_end = item_ranges[index]
+            batch.append(({
+                'work_plan_id': work_plan.id,
+                'name': payload['name'],
+                'unit': payload['unit'],
+                'quantity': payload['quantity'],
+                'start_date': item_start,
+                'end_date': item_end,
+                'order': index
+            }, {}))
+        elif kind == 'material':
+            if not batch:
+                kind, payload = 'error', 'Материал указан до первой работы пакета или без работы'
+            else:
+                material_id, quantity = payload
+                materials = batch[-1][1]
+                materials[material_id] = materials.get(material_id, 0.0) + quantity
+        if kind == 'error':
+            report['errors_count'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'row': row_idx, 'message': payload})
+
+    flush_batch(rows_total)
+    record_snapshot(work_plan.id, 0)
+    return work_plan, report
+
+
+def run_work_plan_import(import_id):
+    """
+    Выполняет фоновый импорт. План и его работы фиксируются одной транзакцией в конце,
+    поэтому до завершения импорта частично загруженный план не виден остальным запросам;
+    прогресс после каждого пакета записывается в запись импорта отдельным соединением.
+    При ошибке транзакция откатывается целиком. Файл удаляется после обработки.
+    """
+    job = db.session.get(WorkPlanImport, import_id)
+    if not job:
+        return None
+
+    def on_progress(rows_processed, report):
+        # SQLite не допускает второго пишущего соединения при открытой транзакции импорта
+        if db.session.get_bind().dialect.name == 'sqlite':
+            return
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(WorkPlanImport).where(WorkPlanImport.id == import_id).values(
+                    rows_total=report['rows_total'],
+                    rows_processed=rows_processed,
+                    items_imported=report['items_imported'],
+                    materials_imported=report['materials_imported'],
+                    errors_count=report['errors_count']
+                )
+            )
+
+    try:
+        job.status = 'running'
+        db.session.commit()
+
+        if WorkPlan.query.filter_by(project_id=job.project_id).first():
+            raise WorkPlanImportError('План работ для этого проекта уже существует')
+
+        work_plan, report = import_work_plan_file(job.project_id, job.file_path, progress_callback=on_progress)
+        job.rows_total = report['rows_total']
+        job.rows_processed = report['rows_total']
+        job.items_imported = report['items_imported']
+        job.materials_imported = report['materials_imported']
+        job.errors_count = report['errors_count']
+        job.errors = report['errors']
+        job.work_plan_id = work_plan.id
+        job.status = 'completed'
+        job.message = f"Импортировано работ: {report['items_imported']}, ошибок в строках: {report['errors_count']}"
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(WorkPlanImport, import_id)
+        job.work_plan_id = None
+        job.status = 'failed'
+        job.message = str(e)
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    finally:
+        try:
+            os.remove(job.file_path)
+        except OSError:
+            pass
+
+    return job
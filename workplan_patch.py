@@ -0,0 +1,203 @@
+from datetime import datetime
+from sqlalchemy import update, insert, delete, func
+from models import db, WorkPlan, WorkPlanItem, RequiredMaterial, ConsumptionLog
+from workplan_history import ensure_baseline, record_revision, delta_from_patch
+
+PATCH_OPERATIONS = ('add', 'update', 'move', 'delete')
+EDITABLE_ITEM_FIELDS = ('name', 'unit', 'quantity', 'start_date', 'end_date', 'status', 'budget')
+MAX_PATCH_OPERATIONS = 5000
+
+
+class WorkPlanPatchError(ValueError):
+    """Некорректная операция изменения плана работ (ответ 400)."""
+
+
+class WorkPlanConflict(Exception):
+    """План был изменен после ревизии, на которой основаны изменения (ответ 409)."""
+
+    def __init__(self, message, current_revision=None, details=None):
+        super().__init__(message)
+        self.current_revision = current_revision
+        self.details = details
+
+
+def _parse_date(value, field):
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).date()
+    except ValueError:
+        raise WorkPlanPatchError(f'Неверный формат даты в поле {field}')
+
+
+def _clean_fields(fields, position):
+    """Проверяет и приводит к типам изменяемые поля работы."""
+    unknown = set(fields) - set(EDITABLE_ITEM_FIELDS)
+    if unknown:
+        raise WorkPlanPatchError(f'Операция {position}: неизвестные поля {", ".join(sorted(unknown))}')
+
+    cleaned = {}
+    for field, value in fields.items():
+        if field in ('name', 'unit', 'status'):
+            if not value or not str(value).strip():
+                raise WorkPlanPatchError(f'Операция {position}: поле {field} не может быть пустым')
+            cleaned[field] = str(value).strip()
+        elif field == 'quantity':
+            try:
+                cleaned[field] = float(value)
+            except (TypeError, ValueError):
+                raise WorkPlanPatchError(f'Операция {position}: quantity должно быть числом')
+            if cleaned[field] <= 0:
+                raise WorkPlanPatchError(f'Операция {position}: quantity должно быть больше нуля')
+        elif field == 'budget':
+            try:
+                cleaned[field] = float(value) if value is not None else None
+            except (TypeError, ValueError):
+                raise WorkPlanPatchError(f'Операция {position}: budget должно быть числом')
+        else:
+            cleaned[field] = _parse_date(value, field)
+    return cleaned
+
+
+def apply_work_plan_patch(work_plan_id, base_revision, operations, plan_fields=None, user_id=None):
+    """
+    Применяет пакет операций над работами плана (add/update/move/delete) с оптимистичной
+    блокировкой: ревизия плана увеличивается атомарным UPDATE ... WHERE revision = base_revision,
+    при несовпадении выбрасывается WorkPlanConflict. Изменения записываются пакетными
+    INSERT/UPDATE/DELETE, объем работы пропорционален числу операций, а не размеру плана.
+    Новая ревизия сохраняется в историю плана дельтой. Фиксация транзакции - на вызывающей стороне.
+    Возвращает словарь с новой ревизией, созданными работами и нормализованными изменениями.
+    """
+    if not isinstance(operations, list):
+        raise WorkPlanPatchError('operations должен быть массивом')
+    if len(operations) > MAX_PATCH_OPERATIONS:
+        raise WorkPlanPatchError(f'За один запрос можно передать не более {MAX_PATCH_OPERATIONS} операций')
+
+    plan_fields = plan_fields or {}
+    plan_values = {}
+    for field in ('start_date', 'end_date'):
+        if field in plan_fields:
+            plan_values[field] = _parse_date(plan_fields[field], field)
+
+    additions, updates, deletions = [], {}, set()
+    for position, operation in enumerate(operations, start=1):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in PATCH_OPERATIONS:
+            raise WorkPlanPatchError(f'Операция {position}: op должен быть одним из {", ".join(PATCH_OPERATIONS)}')
+
+        if op == 'add':
+            item = dict(operation.get('item') or {})
+            order = item.pop('order', None)
+            fields = _clean_fields(item, position)
+            missing = [f for f in ('name', 'unit', 'quantity', 'start_date', 'end_date') if f not in fields]
+            if missing:
+                raise WorkPlanPatchError(f'Операция {position}: требуются поля {", ".join(missing)}')
+            if order is not None:
+                try:
+                    fields['order'] = int(order)
+                except (TypeError, ValueError):
+                    raise WorkPlanPatchError(f'Операция {position}: order должен быть числом')
+            additions.append((operation.get('client_id'), fields))
+            continue
+
+        try:
+            item_id = int(operation.get('id'))
+        except (TypeError, ValueError):
+            raise WorkPlanPatchError(f'Операция {position}: требуется id работы')
+        if item_id in deletions:
+            raise WorkPlanPatchError(f'Операция {position}: работа {item_id} уже удалена в этом пакете')
+
+        if op == 'delete':
+            deletions.add(item_id)
+            updates.pop(item_id, None)
+        elif op == 'move':
+            try:
+                updates.setdefault(item_id, {})['order'] = int(operation.get('order'))
+            except (TypeError, ValueError):
+                raise WorkPlanPatchError(f'Операция {position}: order должен быть числом')
+        else:
+            updates.setdefault(item_id, {}).update(_clean_fields(operation.get('fields') or {}, position))
+
+    touched_ids = set(updates) | deletions
+    current = {}
+    if touched_ids:
+        current = {
+            row.id: row for row in db.session.query(
+                WorkPlanItem.id, WorkPlanItem.name, WorkPlanItem.unit, WorkPlanItem.quantity,
+                WorkPlanItem.start_date, WorkPlanItem.end_date, WorkPlanItem.status,
+                WorkPlanItem.budget, WorkPlanItem.order, WorkPlanItem.tasks_total
+            ).filter(WorkPlanItem.work_plan_id == work_plan_id, WorkPlanItem.id.in_(touched_ids))
+        }
+    missing_ids = touched_ids - set(current)
+    if missing_ids:
+        raise WorkPlanConflict('Работы не найдены в плане (возможно, удалены другим пользователем)',
+                               details={'work_plan_item_ids': sorted(missing_ids)})
+
+    with_tasks = sorted(item_id for item_id in deletions if current[item_id].tasks_total)
+    if with_tasks:
+        raise WorkPlanConflict('Нельзя удалить работы, по которым созданы задачи',
+                               details={'work_plan_item_ids': with_tasks})
+
+    for item_id, fields in updates.items():
+        start = fields.get('start_date', current[item_id].start_date)
+        end = fields.get('end_date', current[item_id].end_date)
+        if start >= end:
+            raise WorkPlanPatchError(f'Работа {item_id}: дата начала должна быть раньше даты окончания')
+    for _, fields in additions:
+        if fields['start_date'] >= fields['end_date']:
+            raise WorkPlanPatchError(f"Работа '{fields['name']}': дата начала должна быть раньше даты окончания")
+
+    ensure_baseline(work_plan_id, base_revision)
+    result = db.session.execute(
+        update(WorkPlan)
+        .where(WorkPlan.id == work_plan_id, WorkPlan.revision == base_revision)
+        .values(revision=WorkPlan.revision + 1, editing_status='edited', **plan_values),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount != 1:
+        current_revision = db.session.query(WorkPlan.revision).filter(WorkPlan.id == work_plan_id).scalar()
+        raise WorkPlanConflict('План работ был изменен другим пользователем', current_revision=current_revision)
+
+    if deletions:
+        db.session.execute(delete(RequiredMaterial).where(RequiredMaterial.work_item_id.in_(deletions)),
+                           execution_options={'synchronize_session': False})
+        db.session.execute(delete(ConsumptionLog).where(ConsumptionLog.work_item_id.in_(deletions)),
+                           execution_options={'synchronize_session': False})
+        db.session.execute(delete(WorkPlanItem).where(WorkPlanItem.id.in_(deletions)),
+                           execution_options={'synchronize_session': False})
+
+    if updates:
+        db.session.execute(update(WorkPlanItem), [{'id': item_id, **fields} for item_id, fields in updates.items()])
+
+    added = []
+    if additions:
+        next_order = (db.session.query(func.max(WorkPlanItem.order))
+                      .filter(WorkPlanItem.work_plan_id == work_plan_id).scalar() or 0) + 1
+        rows = []
+        for client_id, fields in additions:
+            row = {'work_plan_id': work_plan_id, 'budget': None, 'status': 'not_started', **fields}
+            if 'order' not in row:
+                row['order'] = next_order
+                next_order += 1
+            rows.append(row)
+        new_ids = db.session.scalars(
+            insert(WorkPlanItem).returning(WorkPlanItem.id, sort_by_parameter_order=True), rows
+        ).all()
+        added = [
+            {'client_id': client_id, 'id': new_id, **fields_row}
+            for (client_id, _), new_id, fields_row in zip(additions, new_ids, rows)
+        ]
+
+    changes = {
+        'work_plan_id': work_plan_id,
+        'revision': base_revision + 1,
+        'plan': plan_values,
+        'added': added,
+        'updated': {item_id: fields for item_id, fields in updates.items()},
+        'previous': {
+            item_id: {field: getattr(current[item_id], field) for field in updates[item_id]}
+            for item_id in updates
+        },
+        'deleted': {item_id: current[item_id]._asdict() for item_id in deletions}
+    }
+    record_revision(work_plan_id, changes['revision'], delta_from_patch(changes), user_id=user_id)
+    db.session.expire_all()
+    return changes
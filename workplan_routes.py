@@ -1,17 +1,29 @@
-from flask import Blueprint, request, jsonify
-from datetime import datetime, timedelta
-from openpyxl import load_workbook
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from datetime import datetime, timedelta, timezone
 import os
+import uuid
 from werkzeug.utils import secure_filename
 
-from models import db, WorkPlan, WorkPlanItem, Project, Material, RequiredMaterial
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from models import db, WorkPlan, WorkPlanItem, WorkPlanImport, WorkPlanRevision, Project, Material, RequiredMaterial
 from auth import token_required, role_required
 from project_access import require_project_access
+from reference_cache import cached_json_response
+from upload_store import UPLOADS_ROOT
+from workplan_import import import_work_plan_file, WorkPlanImportError, ASYNC_IMPORT_THRESHOLD
+from workplan_export import EXPORT_SECTIONS, iter_csv, iter_xlsx
+from workplan_patch import apply_work_plan_patch, WorkPlanPatchError, WorkPlanConflict
+from workplan_history import (plan_state, item_state, diff_states, ensure_baseline, record_revision,
+                              reconstruct_state, baseline_revision, state_to_dict, compare_states,
+                              WorkPlanRevisionNotFound)
 
 workplan_bp = Blueprint('workplan_bp', __name__)
 
-UPLOAD_FOLDER = '/app/uploads'
+UPLOAD_FOLDER = UPLOADS_ROOT
 ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+# Фоновый импорт, не завершившийся за это время (упал воркер), больше не блокирует новые импорты
+IMPORT_STALE_AFTER = timedelta(hours=1)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -76,7 +88,8 @@ def allowed_file(filename):
             unit=item_data['unit'],
             start_date=item_start,
             end_date=item_end,
-            order=index
+            order=index,
+            budget=float(item_data['budget']) if item_data.get('budget') is not None else None
         )
         db.session.add(work_plan_item)
     
@@ -115,7 +128,29 @@ def update_work_plan(project_id):
     if not data or 'items' not in data:
         return jsonify({'message': 'Отсутствуют данные для обновления'}), 400
 
+    base_revision = _requested_revision(data)
+    if base_revision is not None and base_revision != work_plan.revision:
+        return jsonify({
+            'message': 'План работ был изменен другим пользователем',
+            'current_revision': work_plan.revision
+        }), 409
+
+    base_revision = work_plan.revision
+
     try:
+        ensure_baseline(work_plan.id, base_revision)
+        previous_state = plan_state(work_plan.id)
+        # Ревизия увеличивается атомарно, как в PATCH: из параллельных запросов на одной ревизии проходит один
+        result = db.session.execute(
+            update(WorkPlan)
+            .where(WorkPlan.id == work_plan.id, WorkPlan.revision == base_revision)
+            .values(revision=WorkPlan.revision + 1, editing_status='edited'),
+            execution_options={'synchronize_session': False}
+        )
+        if result.rowcount != 1:
+            raise WorkPlanConflict('План работ был изменен другим пользователем')
+        db.session.expire(work_plan, ['revision', 'editing_status'])
+
         if 'start_date' in data and 'end_date' in data:
             work_plan.start_date = datetime.fromisoformat(data['start_date'].replace('Z', '+00:00')).date()
             work_plan.end_date = datetime.fromisoformat(data['end_date'].replace('Z', '+00:00')).date()
@@ -144,6 +179,8 @@ def update_work_plan(project_id):
                     item.start_date = item_start
                     item.end_date = item_end
                     item.order = index
+                    if 'budget' in item_data:
+                        item.budget = float(item_data['budget']) if item_data['budget'] is not None else None
             else: 
                 new_item = WorkPlanItem(
                     work_plan_id=work_plan.id,
@@ -152,13 +189,23 @@ def update_work_plan(project_id):
                     unit=item_data['unit'],
                     start_date=item_start,
                     end_date=item_end,
-                    order=index
+                    order=index,
+                    budget=float(item_data['budget']) if item_data.get('budget') is not None else None
                 )
                 db.session.add(new_item)
 
-        work_plan.editing_status = 'edited'
+        db.session.flush()
+        record_revision(work_plan.id, base_revision + 1, diff_states(previous_state, plan_state(work_plan.id)),
+                        user_id=request.current_user['id'])
         db.session.commit()
 
+    except (WorkPlanConflict, IntegrityError):
+        db.session.rollback()
+        current_revision = db.session.query(WorkPlan.revision).filter(WorkPlan.id == work_plan.id).scalar()
+        return jsonify({
+            'message': 'План работ был изменен другим пользователем',
+            'current_revision': current_revision
+        }), 409
     except (ValueError, KeyError) as e:
         db.session.rollback()
         return jsonify({'message': f'Ошибка в данных: {str(e)}'}), 400
@@ -169,6 +216,164 @@ def update_work_plan(project_id):
     return jsonify(work_plan.to_dict()), 200
 
 
+def _requested_revision(data):
+    """Ревизия плана, на которой основаны изменения: поле revision или заголовок If-Match."""
+    value = data.get('revision') if data else None
+    if value is None and request.headers.get('If-Match'):
+        value = request.headers['If-Match'].replace('W/', '').strip('" ')
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+@workplan_bp.route('/api/projects/<int:project_id>/work-plan', methods=['PATCH'])
+@token_required
+@role_required('client')
+def patch_work_plan(project_id):
+    """
+    Частичное изменение плана работ пакетом операций.
+    Тело: revision (или заголовок If-Match), operations - массив операций:
+    {op: 'add', item: {...}, client_id}, {op: 'update', id, fields: {...}},
+    {op: 'move', id, order}, {op: 'delete', id}; необязательно start_date/end_date плана.
+    Если план изменен после указанной ревизии, возвращается 409 без применения изменений.
+    """
+    current_user = request.current_user
+    
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+    
+    work_plan_id = db.session.query(WorkPlan.id).filter(WorkPlan.project_id == project_id).scalar()
+    if not work_plan_id:
+        return jsonify({'message': 'План работ не найден'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    base_revision = _requested_revision(data)
+    if base_revision is None:
+        return jsonify({'message': 'Требуется ревизия плана (поле revision или заголовок If-Match)'}), 400
+    
+    try:
+        result = apply_work_plan_patch(
+            work_plan_id,
+            base_revision,
+            data.get('operations') or [],
+            plan_fields={field: data[field] for field in ('start_date', 'end_date') if field in data},
+            user_id=current_user['id']
+        )
+        db.session.commit()
+    except WorkPlanPatchError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+    except WorkPlanConflict as e:
+        db.session.rollback()
+        response = {'message': str(e)}
+        if e.current_revision is not None:
+            response['current_revision'] = e.current_revision
+        if e.details:
+            response.update(e.details)
+        return jsonify(response), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Внутренняя ошибка сервера: {str(e)}'}), 500
+    
+    response = jsonify({
+        'work_plan_id': work_plan_id,
+        'revision': result['revision'],
+        'added': [{'client_id': item['client_id'], 'id': item['id']} for item in result['added']],
+        'updated': sorted(result['updated']),
+        'deleted': sorted(result['deleted'])
+    })
+    response.headers['ETag'] = f'"{result["revision"]}"'
+    return response, 200
+
+
+@workplan_bp.route('/api/projects/<int:project_id>/work-plan/revisions', methods=['GET'])
+@token_required
+def get_work_plan_revisions(project_id):
+    """История ревизий плана работ (без содержимого снимков и дельт)."""
+    current_user = request.current_user
+    
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+    
+    work_plan = WorkPlan.query.filter_by(project_id=project_id).first()
+    if not work_plan:
+        return jsonify({'message': 'План работ не найден'}), 404
+    
+    revisions = work_plan.revisions.order_by(WorkPlanRevision.revision.desc()).all()
+    return jsonify({
+        'work_plan_id': work_plan.id,
+        'current_revision': work_plan.revision,
+        'revisions': [revision.to_dict() for revision in revisions]
+    }), 200
+
+
+@workplan_bp.route('/api/projects/<int:project_id>/work-plan/revisions/<int:revision>', methods=['GET'])
+@token_required
+def get_work_plan_revision(project_id, revision):
+    """Состояние плана работ на указанную ревизию."""
+    current_user = request.current_user
+    
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+    
+    work_plan = WorkPlan.query.filter_by(project_id=project_id).first()
+    if not work_plan:
+        return jsonify({'message': 'План работ не найден'}), 404
+    
+    try:
+        state = reconstruct_state(work_plan.id, revision)
+    except WorkPlanRevisionNotFound as e:
+        return jsonify({'message': str(e)}), 404
+    
+    return jsonify({'work_plan_id': work_plan.id, **state_to_dict(state, revision)}), 200
+
+
+@workplan_bp.route('/api/projects/<int:project_id>/work-plan/diff', methods=['GET'])
+@token_required
+def get_work_plan_diff(project_id):
+    """
+    Сравнение двух ревизий плана работ: сдвиги сроков, изменения объемов,
+    добавленные и удаленные работы. По умолчанию сравнивается базовый план (первая ревизия)
+    с текущим состоянием. Параметры: from, to - номера ревизий.
+    """
+    current_user = request.current_user
+    
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+    
+    work_plan = WorkPlan.query.filter_by(project_id=project_id).first()
+    if not work_plan:
+        return jsonify({'message': 'План работ не найден'}), 404
+    
+    try:
+        from_revision = request.args.get('from', type=int)
+        to_revision = request.args.get('to', type=int)
+        if from_revision is None:
+            from_revision = baseline_revision(work_plan.id)
+            if from_revision is None:
+                from_revision = work_plan.revision
+        base = plan_state(work_plan.id) if from_revision == work_plan.revision else reconstruct_state(work_plan.id, from_revision)
+        if to_revision is None or to_revision == work_plan.revision:
+            to_revision = work_plan.revision
+            target = plan_state(work_plan.id)
+        else:
+            target = reconstruct_state(work_plan.id, to_revision)
+    except WorkPlanRevisionNotFound as e:
+        return jsonify({'message': str(e)}), 404
+    
+    return jsonify({
+        'work_plan_id': work_plan.id,
+        'from_revision': from_revision,
+        'to_revision': to_revision,
+        **compare_states(base, target)
+    }), 200
+
+
 @workplan_bp.route('/api/projects/<int:project_id>/work-plan', methods=['DELETE'])
 @token_required
 @role_required('client')
@@ -217,88 +422,120 @@ def import_work_plan(project_id):
     if not allowed_file(file.filename):
         return jsonify({'message': 'Недопустимый формат файла. Разрешены только xlsx и xls'}), 400
     
-    try:
-        wb = load_workbook(file, data_only=True)
-        ws = wb.active
-        
-        start_date = None
-        end_date = None
-        items = []
-        
-        for row_idx, row in enumerate(ws.iter_rows(values_only=True), start=1):
-            if not row[0]:
-                continue
-            
-            first_cell = str(row[0]).strip()
-            
-            if 'срок' in first_cell.lower() and row[1]:
-                date_str = str(row[1]).strip()
-                if '-' in date_str:
-                    dates = date_str.split('-')
-                    if len(dates) == 2:
-                        try:
-                            start_date = datetime.strptime(dates[0].strip(), '%d.%m.%Y').date()
-                            end_date = datetime.strptime(dates[1].strip(), '%d.%m.%Y').date()
-                        except:
-                            pass
-            
-            if row_idx > 5 and row[1] and row[2] and row[3]:
-                try:
-                    name = str(row[1]).strip()
-                    unit = str(row[2]).strip()
-                    quantity = float(row[3])
-                    
-                    if name and unit and quantity > 0 and len(name) > 3:
-                        items.append({
-                            'name': name,
-                            'unit': unit,
-                            'quantity': quantity
-                        })
-                except (ValueError, TypeError):
-                    continue
-        
-        if not start_date or not end_date:
-            return jsonify({'message': 'Не удалось определить сроки выполнения работ из файла'}), 400
-        
-        if len(items) == 0:
-            return jsonify({'message': 'Не удалось извлечь работы из файла'}), 400
+    active_import = WorkPlanImport.query.filter(
+        WorkPlanImport.project_id == project_id,
+        WorkPlanImport.status.in_(['pending', 'running']),
+        WorkPlanImport.created_at > datetime.now(timezone.utc) - IMPORT_STALE_AFTER
+    ).first()
+    if active_import:
+        return jsonify({'message': 'Импорт плана работ уже выполняется', 'import': active_import.to_dict()}), 409
+    
+    file.stream.seek(0, os.SEEK_END)
+    file_size = file.stream.tell()
+    file.stream.seek(0)
+    
+    if file_size > ASYNC_IMPORT_THRESHOLD:
+        import_dir = os.path.join(UPLOAD_FOLDER, 'work_plan_imports')
+        os.makedirs(import_dir, exist_ok=True)
+        file_path = os.path.join(import_dir, f"{uuid.uuid4()}_{secure_filename(file.filename)}")
+        file.save(file_path)
         
-        work_plan = WorkPlan(
+        job = WorkPlanImport(
             project_id=project_id,
-            start_date=start_date,
-            end_date=end_date
+            requested_by_id=current_user['id'],
+            file_path=file_path,
+            status='pending'
         )
-        db.session.add(work_plan)
-        db.session.flush()
-        
-        total_days = (end_date - start_date).days
-        days_per_item = max(1, total_days // len(items))
-        
-        current_start = start_date
-        for index, item_data in enumerate(items):
-            item_end = min(current_start + timedelta(days=days_per_item), end_date)
-            if index == len(items) - 1:
-                item_end = end_date
-            
-            work_plan_item = WorkPlanItem(
-                work_plan_id=work_plan.id,
-                name=item_data['name'],
-                quantity=item_data['quantity'],
-                unit=item_data['unit'],
-                start_date=current_start,
-                end_date=item_end,
-                order=index
-            )
-            db.session.add(work_plan_item)
-            current_start = item_end
-        
+        db.session.add(job)
         db.session.commit()
         
-        return jsonify(work_plan.to_dict()), 201
+        try:
+            from tasks import import_work_plan_task
+            import_work_plan_task.delay(job.id)
+        except Exception as e:
+            job.status = 'failed'
+            job.message = f'Не удалось запустить фоновую задачу: {e}'
+            job.finished_at = datetime.now(timezone.utc)
+            db.session.commit()
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return jsonify({'message': f'Ошибка при запуске импорта: {e}', 'import': job.to_dict()}), 500
         
+        return jsonify({
+            'message': 'Файл большого размера, импорт запущен в фоновой задаче',
+            'import': job.to_dict()
+        }), 202
+    
+    try:
+        work_plan, report = import_work_plan_file(project_id, file.stream)
+        db.session.commit()
+    except WorkPlanImportError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Ошибка при импорте файла: {str(e)}'}), 500
+    
+    result = work_plan.to_dict()
+    result['import_errors'] = report['errors']
+    result['import_errors_count'] = report['errors_count']
+    return jsonify(result), 201
+
+
+@workplan_bp.route('/api/projects/<int:project_id>/work-plan/imports/<int:import_id>', methods=['GET'])
+@token_required
+def get_work_plan_import(project_id, import_id):
+    """Статус фонового импорта плана работ: прогресс и ошибки по строкам."""
+    current_user = request.current_user
+    
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+    
+    job = WorkPlanImport.query.filter_by(id=import_id, project_id=project_id).first_or_404()
+    return jsonify(job.to_dict()), 200
+
+
+@workplan_bp.route('/api/projects/<int:project_id>/work-plan/export', methods=['GET'])
+@token_required
+def export_work_plan(project_id):
+    """
+    Выгружает план работ с прогрессом и плановыми материалами, задачи, расход материалов и поставки.
+    Параметры: format - xlsx (по умолчанию, лист на раздел) или csv (один раздел);
+    sections - разделы через запятую: plan, tasks, consumption, deliveries.
+    Данные читаются курсором порциями и передаются потоком.
+    """
+    current_user = request.current_user
+    
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+    
+    db.get_or_404(Project, project_id)
+    
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in ('xlsx', 'csv'):
+        return jsonify({'message': 'Формат выгрузки должен быть xlsx или csv'}), 400
+    
+    sections = [s.strip() for s in request.args.get('sections', ','.join(EXPORT_SECTIONS)).split(',') if s.strip()]
+    unknown = [s for s in sections if s not in EXPORT_SECTIONS]
+    if unknown or not sections:
+        return jsonify({'message': f'Неизвестные разделы: {", ".join(unknown)}. Доступны: {", ".join(EXPORT_SECTIONS)}'}), 400
+    
+    if export_format == 'csv':
+        if len(sections) != 1:
+            return jsonify({'message': 'Для CSV укажите один раздел в параметре sections'}), 400
+        return Response(
+            stream_with_context(iter_csv(project_id, sections[0])),
+            mimetype='text/csv; charset=utf-8',
+            headers={'Content-Disposition': f'attachment; filename=project_{project_id}_{sections[0]}.csv'}
+        )
+    
+    return Response(
+        stream_with_context(iter_xlsx(project_id, sections)),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers={'Content-Disposition': f'attachment; filename=project_{project_id}_work_plan.xlsx'}
+    )
 
 
 @workplan_bp.route('/api/work-plan-items/<int:item_id>', methods=['GET'])
@@ -338,12 +575,17 @@ def update_work_plan_item(item_id):
     if not data:
         return jsonify({'message': 'Отсутствуют данные для обновления'}), 400
     
+    ensure_baseline(work_plan.id, work_plan.revision)
+    previous_fields = item_state(item)
+    
     if 'name' in data:
         item.name = data['name']
     if 'quantity' in data:
         item.quantity = float(data['quantity'])
     if 'unit' in data:
         item.unit = data['unit']
+    if 'budget' in data:
+        item.budget = float(data['budget']) if data['budget'] is not None else None
     if 'status' in data:
         item.status = data['status']
     if 'progress' in data:
@@ -364,6 +606,15 @@ def update_work_plan_item(item_id):
         except ValueError:
             return jsonify({'message': 'Неверный формат даты'}), 400
     
+    new_revision = db.session.execute(
+        update(WorkPlan).where(WorkPlan.id == item.work_plan_id)
+        .values(revision=WorkPlan.revision + 1).returning(WorkPlan.revision),
+        execution_options={'synchronize_session': False}
+    ).scalar_one()
+    record_revision(work_plan.id, new_revision, diff_states(
+        {'plan': {}, 'items': {str(item.id): previous_fields}},
+        {'plan': {}, 'items': {str(item.id): item_state(item)}}
+    ), user_id=current_user['id'])
     db.session.commit()
     
     result = item.to_dict()
@@ -474,9 +725,11 @@ def delete_required_material(item_id, material_id):
 @workplan_bp.route('/api/materials', methods=['GET'])
 @token_required
 def get_materials():
-    """Получает список всех материалов."""
-    materials = Material.query.all()
-    return jsonify([m.to_dict() for m in materials]), 200
+    """
+    Получает список всех материалов.
+    Ответ кэшируется до изменения справочника и отдается со строгим ETag (304 при If-None-Match).
+    """
+    return cached_json_response('materials', None, lambda: [m.to_dict() for m in Material.query.all()])
 
 
 @workplan_bp.route('/api/materials', methods=['POST'])
@@ -0,0 +1,170 @@
+from flask import Blueprint, request, jsonify
+from datetime import datetime
+from models import db, WorkPlanTemplate
+from auth import token_required, role_required
+from project_access import require_project_access
+from workplan_clone import (clone_work_plan, create_template_from_plan, apply_template, delete_template,
+                            WorkPlanCloneError)
+
+workplan_template_bp = Blueprint('workplan_template_bp', __name__)
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).date()
+
+
+def _get_own_template(template_id, user_id):
+    template = db.get_or_404(WorkPlanTemplate, template_id)
+    if template.created_by_id != user_id:
+        return None, (jsonify({'message': 'Доступ к шаблону запрещен'}), 403)
+    return template, None
+
+
+@workplan_template_bp.route('/api/projects/<int:project_id>/work-plan/clone', methods=['POST'])
+@token_required
+@role_required('client')
+def clone_project_work_plan(project_id):
+    """
+    Копирует план работ другого проекта (работы и плановые материалы) в проект.
+    Тело: source_project_id и start_date (новая дата начала) или offset_days (сдвиг сроков в днях).
+    """
+    current_user = request.current_user
+    data = request.get_json(silent=True) or {}
+
+    if not data.get('source_project_id'):
+        return jsonify({'message': 'Требуется source_project_id'}), 400
+
+    for checked_project_id in (project_id, data['source_project_id']):
+        access_error = require_project_access(checked_project_id, current_user['id'], current_user['role'])
+        if access_error:
+            return access_error
+
+    try:
+        start_date = _parse_date(data['start_date']) if data.get('start_date') else None
+        offset_days = int(data['offset_days']) if data.get('offset_days') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Неверный формат start_date или offset_days'}), 400
+
+    try:
+        work_plan, report = clone_work_plan(data['source_project_id'], project_id, start_date=start_date,
+                                            offset_days=offset_days, user_id=current_user['id'])
+        db.session.commit()
+    except WorkPlanCloneError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Ошибка при копировании плана: {str(e)}'}), 500
+
+    return jsonify({
+        'message': 'План работ скопирован',
+        'work_plan_id': work_plan.id,
+        'start_date': work_plan.start_date.isoformat(),
+        'end_date': work_plan.end_date.isoformat(),
+        **report
+    }), 201
+
+
+@workplan_template_bp.route('/api/work-plan-templates', methods=['GET'])
+@token_required
+@role_required('client')
+def get_work_plan_templates():
+    """Шаблоны планов работ текущего заказчика."""
+    current_user = request.current_user
+    templates = WorkPlanTemplate.query.filter_by(created_by_id=current_user['id']) \
+        .order_by(WorkPlanTemplate.created_at.desc()).all()
+    return jsonify([template.to_dict() for template in templates]), 200
+
+
+@workplan_template_bp.route('/api/work-plan-templates', methods=['POST'])
+@token_required
+@role_required('client')
+def create_work_plan_template():
+    """Создает шаблон из плана работ проекта. Тело: project_id, name, description."""
+    current_user = request.current_user
+    data = request.get_json(silent=True) or {}
+
+    if not data.get('project_id') or not data.get('name'):
+        return jsonify({'message': 'Требуются project_id и name'}), 400
+
+    access_error = require_project_access(data['project_id'], current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+
+    try:
+        template = create_template_from_plan(data['project_id'], data['name'], current_user['id'],
+                                             description=data.get('description'))
+        db.session.commit()
+    except WorkPlanCloneError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 404
+
+    return jsonify(template.to_dict()), 201
+
+
+@workplan_template_bp.route('/api/work-plan-templates/<int:template_id>', methods=['GET'])
+@token_required
+@role_required('client')
+def get_work_plan_template(template_id):
+    """Шаблон плана работ с работами и материалами."""
+    template, error = _get_own_template(template_id, request.current_user['id'])
+    if error:
+        return error
+    return jsonify(template.to_dict(include_items=True)), 200
+
+
+@workplan_template_bp.route('/api/work-plan-templates/<int:template_id>', methods=['DELETE'])
+@token_required
+@role_required('client')
+def delete_work_plan_template(template_id):
+    """Удаляет шаблон плана работ."""
+    template, error = _get_own_template(template_id, request.current_user['id'])
+    if error:
+        return error
+
+    delete_template(template.id)
+    db.session.commit()
+    return jsonify({'message': 'Шаблон удален'}), 200
+
+
+@workplan_template_bp.route('/api/projects/<int:project_id>/work-plan/from-template', methods=['POST'])
+@token_required
+@role_required('client')
+def create_work_plan_from_template(project_id):
+    """Создает план работ проекта из шаблона. Тело: template_id, start_date."""
+    current_user = request.current_user
+    data = request.get_json(silent=True) or {}
+
+    access_error = require_project_access(project_id, current_user['id'], current_user['role'])
+    if access_error:
+        return access_error
+
+    if not data.get('template_id') or not data.get('start_date'):
+        return jsonify({'message': 'Требуются template_id и start_date'}), 400
+
+    try:
+        start_date = _parse_date(data['start_date'])
+    except ValueError:
+        return jsonify({'message': 'Неверный формат даты'}), 400
+
+    template, error = _get_own_template(data['template_id'], current_user['id'])
+    if error:
+        return error
+
+    try:
+        work_plan, report = apply_template(template, project_id, start_date, user_id=current_user['id'])
+        db.session.commit()
+    except WorkPlanCloneError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': f'Ошибка при создании плана из шаблона: {str(e)}'}), 500
+
+    return jsonify({
+        'message': 'План работ создан из шаблона',
+        'work_plan_id': work_plan.id,
+        'start_date': work_plan.start_date.isoformat(),
+        'end_date': work_plan.end_date.isoformat(),
+        **report
+    }), 201